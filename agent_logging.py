@@ -0,0 +1,112 @@
+"""
+Logging Setup
+
+Replaces the print() calls of the servers and clients with leveled logging:
+
+- Records are put on a queue by the calling thread and written by a background
+  listener thread, so a tool call never waits for console or file I/O.
+- Everything goes to stderr (and optionally a file), never to stdout, which is
+  the protocol channel of a stdio MCP server.
+- Use %-style arguments (logger.debug("result %s", value)) so a message is only
+  formatted when its level is enabled; a disabled DEBUG call costs one cached
+  level check.
+- DEBUG records from the same call site (e.g. the "CALLED: add" line of a tool
+  that is called thousands of times) are sampled: the first LOG_SAMPLE_BURST
+  are kept, then one in every LOG_SAMPLE_EVERY. INFO and above are never sampled.
+
+Configuration (environment variables, e.g. in .env; read when setup_logging()
+runs, so call it after load_dotenv()):
+    LOG_LEVEL         DEBUG, INFO, WARNING or ERROR (default: INFO)
+    LOG_FILE          Also write the log to this file (default: off)
+    LOG_SAMPLE_BURST  DEBUG records always kept per call site (default: 20)
+    LOG_SAMPLE_EVERY  After the burst, keep one DEBUG record in this many (default: 100)
+    LIBRARY_LOG_LEVEL Level for the mcp, httpx and urllib3 loggers (default: WARNING,
+                      which hides the per-request "Processing request" lines)
+"""
+
+import atexit
+import logging
+import logging.handlers
+import os
+import queue
+import sys
+
+# Third-party loggers that log at INFO on every request
+LIBRARY_LOGGERS = ("mcp", "httpx", "urllib3")
+
+LOG_FORMAT = "%(asctime)s %(levelname)-7s %(name)s: %(message)s"
+
+# The listener of the configured queue, or None before setup_logging()
+_listener = None
+
+
+class SamplingFilter(logging.Filter):
+    """Thin out high-rate DEBUG records, keyed by logger and message template"""
+
+    def __init__(self, burst=20, every=100):
+        super().__init__()
+        self.burst = burst
+        self.every = max(1, every)
+        self._counts = {}
+
+    def filter(self, record):
+        if record.levelno > logging.DEBUG:
+            return True
+        key = (record.name, record.msg)
+        if len(self._counts) > 10000 and key not in self._counts:
+            self._counts.clear()  # Call sites should use templates; never grow without bound
+        count = self._counts.get(key, 0) + 1
+        self._counts[key] = count
+        if count <= self.burst:
+            return True
+        if (count - self.burst) % self.every == 0:
+            record.msg = f"{record.msg} [sampled, {count} so far]"
+            return True
+        return False
+
+
+def setup_logging(name, level=None):
+    """Configure queue-based logging for the process (once) and return a logger
+
+    Call it before creating the FastMCP server: FastMCP only installs its own
+    console handler when the root logger has none yet.
+
+    Args:
+        name (str): Name of the logger to return, e.g. "mcp-server" or "talk2mcp"
+        level (str): Log level (default: the LOG_LEVEL environment variable, or INFO)
+
+    Returns:
+        logging.Logger: The named logger
+    """
+    global _listener
+    root = logging.getLogger()
+    if _listener is None:
+        root.setLevel(level or os.getenv("LOG_LEVEL", "INFO").upper())
+
+        formatter = logging.Formatter(LOG_FORMAT)
+        handlers = [logging.StreamHandler(sys.stderr)]
+        log_file = os.getenv("LOG_FILE", "")
+        if log_file:
+            handlers.append(logging.FileHandler(log_file, encoding="utf-8"))
+        for handler in handlers:
+            handler.setFormatter(formatter)
+
+        log_queue = queue.SimpleQueue()
+        queue_handler = logging.handlers.QueueHandler(log_queue)
+        # Sample before enqueueing, so dropped records cost no formatting or queue traffic
+        queue_handler.addFilter(SamplingFilter(
+            burst=int(os.getenv("LOG_SAMPLE_BURST", "20")),
+            every=int(os.getenv("LOG_SAMPLE_EVERY", "100")),
+        ))
+        root.handlers[:] = [queue_handler]
+        library_level = os.getenv("LIBRARY_LOG_LEVEL", "WARNING").upper()
+        for library in LIBRARY_LOGGERS:
+            logging.getLogger(library).setLevel(library_level)
+
+        _listener = logging.handlers.QueueListener(log_queue, *handlers, respect_handler_level=True)
+        _listener.start()
+        # Write out whatever is still queued when the process exits
+        atexit.register(_listener.stop)
+    elif level:
+        root.setLevel(level)
+    return logging.getLogger(name)
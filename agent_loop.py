@@ -0,0 +1,793 @@
+"""
+Agent Loop
+
+Shared implementation of the iterative tool-calling loop used by the talk2mcp
+clients. Each client builds its own system prompt and query, then hands the
+MCP session to run_agent(), which asks the LLM for one FUNCTION_CALL at a time,
+executes it and feeds the result back until the LLM gives a FINAL_ANSWER.
+
+Tool results are kept as native Python values (numbers, strings, lists) in a
+per-run RunState instead of being flattened into strings and re-parsed:
+
+- Results are decoded from the MCP structured content when the server sends it,
+  otherwise from the JSON text content.
+- Large lists are not pasted into the prompt. Servers with a result store keep
+  them server-side and return a handle such as res://4, which is passed back to
+  the server unchanged. Otherwise the list is stored in the run state under a
+  handle such as $r2 and the prompt only shows a short preview; when the LLM
+  passes $r2 as a parameter, the stored list is sent to the tool as-is.
+
+With AGENT_FUNCTION_CALLING=native the tools' input schemas are sent as
+function declarations and the LLM answers with structured function calls
+(name plus JSON arguments), so nothing is parsed out of a FUNCTION_CALL line
+and parameters containing "|" or commas arrive intact. Each run counts its
+failed iterations (unusable responses, bad arguments, tool errors) and the
+estimated output tokens of the LLM, to compare the two modes.
+
+Every call is fingerprinted by tool and arguments. A call the LLM already made
+in this run is answered from the run's memo instead of calling the tool
+again, with an "already computed" note in the history; after
+AGENT_REPEAT_LIMIT repeats in a row the run has stopped making progress and
+ends early. Only successful calls of side-effect-free tools are memoized, and
+a call of a tool with side effects (the post-tool-delay and terminal tools,
+e.g. Paint and email) clears the memo. A tool result marked as an error
+counts as a failed iteration, and after AGENT_FAILURE_LIMIT of them in a row
+the run ends early (interrupted, so it can be resumed or retried).
+
+Clients can declare terminal tools (send_email, add_text_in_paint): when one
+succeeds and the answer is already known (a FINAL_ANSWER in its arguments,
+or the result of the last successful calculation, unless that is a list
+stored on the server, known only by its res:// handle), the run completes right away,
+without the post-tool sleep and the LLM call that would only return the
+FINAL_ANSWER.
+
+With a checkpoint (see run_checkpoint.py) the run state is saved after every
+LLM response, tool result and iteration, and an interrupted run continues
+from its last completed step.
+
+The history of earlier iterations is compacted to a token budget before it is
+put into the prompt (see history_compactor.py): recent iterations verbatim,
+older ones summarized or elided. The estimated tokens saved are logged at the
+end of the run.
+
+Every phase of every iteration is timed as a span (see tracing.py) and a latency
+breakdown table is logged when the run ends.
+"""
+
+import asyncio
+import hashlib
+import json
+import logging
+import os
+import re
+from dataclasses import dataclass, field
+
+from history_compactor import (
+    HISTORY_TOKEN_BUDGET,
+    SUMMARY_LIST_ITEMS,
+    HistoryEntry,
+    brief,
+    compact_history,
+    estimate_tokens,
+    tool_call_entry,
+)
+from llm_providers import FunctionCall
+from tracing import Tracer
+
+logger = logging.getLogger(__name__)
+
+# Maximum number of tool-calling iterations before stopping
+MAX_ITERATIONS = int(os.getenv("AGENT_MAX_ITERATIONS", "10"))
+
+# Repeated calls in a row (answered from the memo) after which a run ends early
+REPEAT_LIMIT = int(os.getenv("AGENT_REPEAT_LIMIT", "2"))
+
+# Tool errors in a row after which a run ends early
+FAILURE_LIMIT = int(os.getenv("AGENT_FAILURE_LIMIT", "3"))
+
+# "text" (FUNCTION_CALL lines) or "native" (function declarations and structured calls)
+AGENT_FUNCTION_CALLING = os.getenv("AGENT_FUNCTION_CALLING", "text")
+
+# Replaces the FUNCTION_CALL format of the clients' system prompts in native mode
+NATIVE_CALL_INSTRUCTIONS = """Call the functions directly instead of writing FUNCTION_CALL lines.
+To pass a stored result such as $r2 or res://4, give the handle as a string (as the only item for a list parameter).
+When you have the answer, reply with FINAL_ANSWER: [result] as text."""
+
+# Lists longer than this are passed by handle instead of being written into the prompt
+LIST_HANDLE_THRESHOLD = 20
+
+# Number of items shown at each end of a list preview
+LIST_PREVIEW_ITEMS = 5
+
+# Result handles look like $r1, $r2, ... (one per iteration)
+HANDLE_PATTERN = re.compile(r"\$r(\d+)\b")
+
+# Handles of results kept in the server's result store
+SERVER_HANDLE_PATTERN = re.compile(r"res://\d+")
+
+
+@dataclass
+class RunState:
+    """State of one agent run (replaces the module-level globals the clients used to keep)"""
+    query: str
+    iteration: int = 0
+    history: list = field(default_factory=list)   # HistoryEntry per iteration, compacted into the prompt
+    results: list = field(default_factory=list)   # Native result value of each tool call
+    handles: dict = field(default_factory=dict)   # Handle name ($r1, ...) -> native value
+    last_response: object = None
+    final_answer: str = None
+    history_token_budget: int = HISTORY_TOKEN_BUDGET
+    tokens_saved: int = 0                          # Estimated prompt tokens saved by history compaction
+    failed_iterations: int = 0                     # Unusable responses, bad arguments and tool errors
+    output_tokens: int = 0                         # Estimated tokens of the LLM's responses
+    llm_calls: int = 0
+    memo: dict = field(default_factory=dict)      # Call fingerprint -> native result value
+    repeated_calls: int = 0                        # Calls answered from the memo
+    consecutive_repeats: int = 0
+    consecutive_failures: int = 0                  # Tool results marked as errors in a row
+    iterations_saved: int = 0                      # Iterations left when a run without progress ended early
+    last_computed: object = None                   # Result of the last successful call without side effects
+    completed_by: str = None                       # Terminal tool that completed the run
+    pending_response: object = None                # LLM response whose tool call is not done yet (for resuming)
+    plan: str = None                               # PLAN response being executed (plan mode, for resuming)
+    plan_results: dict = field(default_factory=dict)  # Completed plan step ("1", "2", ...) -> native result value
+
+    def store_handle(self, value):
+        """Store a value under a new handle and return the handle name"""
+        handle = f"$r{self.iteration + 1}"
+        self.handles[handle] = value
+        return handle
+
+    def resolve(self, text):
+        """Return the stored value if text is exactly a handle, otherwise None"""
+        handle = text.strip()
+        return self.handles.get(handle) if HANDLE_PATTERN.fullmatch(handle) else None
+
+    def expand_handles(self, text):
+        """Replace every handle inside a piece of text with the JSON of its value"""
+        def replace(match):
+            handle = match.group(0)
+            if handle in self.handles:
+                return json.dumps(self.handles[handle])
+            return handle
+        return HANDLE_PATTERN.sub(replace, text)
+
+
+def schema_types(param_info):
+    """Return the JSON schema types a parameter accepts (handles anyOf unions)"""
+    if 'type' in param_info:
+        return [param_info['type']]
+    return [option.get('type') for option in param_info.get('anyOf', []) if option.get('type') not in (None, 'null')]
+
+
+def describe_tools(tools):
+    """Format the MCP tool list into numbered lines for the system prompt
+
+    Args:
+        tools: Tools returned by session.list_tools()
+
+    Returns:
+        str: One line per tool, e.g. "1. add(a: integer, b: integer) - Add two numbers"
+    """
+    try:
+        tools_description = []
+        for i, tool in enumerate(tools):
+            try:
+                # Extract tool properties from the tool object
+                params = tool.inputSchema
+                desc = getattr(tool, 'description', 'No description available')
+                name = getattr(tool, 'name', f'tool_{i}')
+
+                # Format the input schema into a more readable format
+                if 'properties' in params:
+                    param_details = []
+                    for param_name, param_info in params['properties'].items():
+                        param_type = '|'.join(schema_types(param_info)) or 'unknown'
+                        param_details.append(f"{param_name}: {param_type}")
+                    params_str = ', '.join(param_details)
+                else:
+                    params_str = 'no parameters'
+
+                # Create a formatted description of the tool
+                tool_desc = f"{i+1}. {name}({params_str}) - {desc}"
+                tools_description.append(tool_desc)
+                logger.debug("Added description for tool: %s", tool_desc)
+            except Exception as e:
+                logger.error("Error processing tool %s: %s", i, e)
+                tools_description.append(f"{i+1}. Error processing tool")
+
+        logger.debug("Successfully created tools description")
+        return "\n".join(tools_description)
+    except Exception as e:
+        logger.error("Error creating tools description: %s", e)
+        return "Error loading tools"
+
+
+def decode_tool_result(result):
+    """Turn an MCP CallToolResult into a native Python value
+
+    Structured content (sent by FastMCP for tools with return annotations) is
+    used when present; otherwise each text item is parsed as JSON, falling back
+    to the raw text.
+
+    Args:
+        result: The CallToolResult returned by session.call_tool
+
+    Returns:
+        The decoded value: a number, string, list or dict
+    """
+    structured = getattr(result, 'structuredContent', None)
+    if structured is not None:
+        # FastMCP wraps non-object return values as {"result": value}
+        if isinstance(structured, dict) and list(structured) == ["result"]:
+            return structured["result"]
+        return structured
+
+    content = getattr(result, 'content', None)
+    if content is None:
+        return str(result)
+
+    values = []
+    for item in content:
+        text = getattr(item, 'text', None)
+        if text is None:
+            mime_type = getattr(item, 'mimeType', None)
+            values.append(f"<{mime_type} content>" if mime_type else str(item))
+            continue
+        try:
+            values.append(json.loads(text))
+        except ValueError:
+            values.append(text)
+
+    # Tools that return {"content": [TextContent(...)]} arrive as one JSON object
+    if len(values) == 1 and isinstance(values[0], dict) and isinstance(values[0].get('content'), list):
+        texts = [item.get('text') for item in values[0]['content'] if isinstance(item, dict)]
+        values = [text for text in texts if text is not None] or values
+    return values[0] if len(values) == 1 else values
+
+
+def format_value(value, state):
+    """Describe a tool result for the prompt, passing large lists by handle
+
+    Args:
+        value: The native result value
+        state (RunState): The current run (large lists are stored in it)
+
+    Returns:
+        str: Text to embed in the prompt
+    """
+    if isinstance(value, dict) and SERVER_HANDLE_PATTERN.fullmatch(str(value.get('handle', ''))):
+        handle = value['handle']
+        preview = value.get('preview', {})
+        head = json.dumps(preview.get('head', []))[:-1]
+        tail = json.dumps(preview.get('tail', []))[1:]
+        return (f"a list of {value.get('length')} values stored on the server as {handle} "
+                f"(preview: {head}, ..., {tail}); pass {handle} as a parameter to use it")
+    if isinstance(value, list) and len(value) > LIST_HANDLE_THRESHOLD:
+        handle = state.store_handle(value)
+        head = json.dumps(value[:LIST_PREVIEW_ITEMS])[:-1]
+        tail = json.dumps(value[-LIST_PREVIEW_ITEMS:])[1:]
+        return (f"a list of {len(value)} values stored as {handle} "
+                f"(preview: {head}, ..., {tail}); pass {handle} as a parameter to use it")
+    if isinstance(value, (list, dict)):
+        return json.dumps(value)
+    return str(value)
+
+
+def declaration_schema(param_info):
+    """Convert a parameter's JSON schema to the subset function declarations accept
+
+    Unions (anyOf) become their first non-null type, marked nullable; arrays
+    without an item type get number items, since the servers' untyped lists
+    are lists of numbers; objects without properties (free-form dicts) are
+    declared as JSON text.
+    """
+    options = [option for option in param_info.get('anyOf', []) if option.get('type') not in (None, 'null')]
+    nullable = len(options) < len(param_info.get('anyOf', []))
+    schema = dict(options[0], **{k: v for k, v in param_info.items() if k == 'description'}) if options else param_info
+    param_type = schema.get('type', 'string')
+    if param_type == 'object' and not schema.get('properties'):
+        description = f"{schema['description']} (a JSON object)" if schema.get('description') else "A JSON object"
+        return {'type': 'string', 'description': description}
+
+    declared = {'type': param_type}
+    for key in ('description', 'enum'):
+        if key in schema:
+            declared[key] = schema[key]
+    if nullable:
+        declared['nullable'] = True
+    if param_type == 'array':
+        items = schema.get('items') or {}
+        declared['items'] = declaration_schema(items) if items.get('type') or items.get('anyOf') else {'type': 'number'}
+    elif param_type == 'object':
+        declared['properties'] = {name: declaration_schema(info) for name, info in schema['properties'].items()}
+        if schema.get('required'):
+            declared['required'] = list(schema['required'])
+    return declared
+
+
+def function_declarations(tools):
+    """Build the function declarations for native function calling from the MCP tools
+
+    Returns:
+        list: One dict per tool with name, description and parameters
+    """
+    declarations = []
+    for tool in tools:
+        declaration = {'name': tool.name, 'description': tool.description or tool.name}
+        properties = tool.inputSchema.get('properties', {})
+        if properties:
+            declaration['parameters'] = {
+                'type': 'object',
+                'properties': {name: declaration_schema(info) for name, info in properties.items()},
+                'required': list(tool.inputSchema.get('required', [])),
+            }
+        declarations.append(declaration)
+    return declarations
+
+
+def _native_value(value, param_info, state):
+    """Convert one argument of a structured function call to the tool's schema"""
+    if isinstance(value, str):
+        # Handles, numbers given as text and JSON objects (see declaration_schema)
+        return coerce_argument(value, param_info, state)
+    if isinstance(value, list):
+        if len(value) == 1 and isinstance(value[0], str) and (
+                state.resolve(value[0]) is not None or SERVER_HANDLE_PATTERN.fullmatch(value[0].strip())):
+            return coerce_argument(value[0], param_info, state)
+        array_info = next((option for option in param_info.get('anyOf', [param_info])
+                           if option.get('type') == 'array'), param_info)
+        return [_native_value(item, array_info.get('items', {}), state) for item in value]
+    types = schema_types(param_info)
+    # JSON numbers may arrive as floats; whole ones are ints unless the schema says number
+    if isinstance(value, float) and value.is_integer() and 'number' not in types:
+        return int(value)
+    return value
+
+
+def native_arguments(tool, args, state):
+    """Build the call_tool arguments for a tool from a structured function call's arguments
+
+    Raises:
+        ValueError: If a required parameter is missing or an unknown one is given
+    """
+    properties = tool.inputSchema.get('properties', {})
+    for param_name in tool.inputSchema.get('required', []):
+        if param_name not in args:
+            raise ValueError(f"Missing parameter {param_name} for {tool.name}")
+    arguments = {}
+    for param_name, value in args.items():
+        if param_name not in properties:
+            raise ValueError(f"Unknown parameter {param_name} for {tool.name}")
+        arguments[param_name] = _native_value(value, properties[param_name], state)
+    return arguments
+
+
+def run_finished(state, max_iterations):
+    """True if a run is over: it answered, used up its iterations or stopped making progress
+
+    A run that ended early without an answer (the LLM or a tool failed) is
+    interrupted and can be resumed from its checkpoint.
+    """
+    return (state.final_answer is not None or state.iteration >= max_iterations
+            or state.consecutive_repeats >= REPEAT_LIMIT)
+
+
+def call_fingerprint(func_name, arguments):
+    """Fingerprint of a tool call: the same tool with equal arguments gives the same one"""
+    canonical = json.dumps([func_name, arguments], sort_keys=True, default=str)
+    return hashlib.sha256(canonical.encode()).hexdigest()
+
+
+def remember_call(state, func_name, fingerprint, value, failed, side_effect_tools):
+    """Keep a call's result in the memo, so a repeat of the call is answered from it
+
+    Only calls of side-effect-free tools that succeeded are kept: an error may
+    not happen again, and a repeated Paint or email call must really run.
+
+    Args:
+        state (RunState): The run
+        func_name (str): The tool that was called
+        fingerprint (str): call_fingerprint() of the call
+        value: The decoded result
+        failed (bool): Whether the tool reported an error
+        side_effect_tools: Tools that change state outside the run (Paint, email)
+    """
+    if func_name in side_effect_tools:
+        # The state outside the run changed, so earlier results may no longer hold
+        state.memo.clear()
+    elif not failed:
+        state.memo[fingerprint] = value
+
+
+def _record_repeat(state, iteration, func_name, fingerprint):
+    """Answer a repeated call from the memo; return True if the run stopped making progress"""
+    value = state.memo[fingerprint]
+    state.repeated_calls += 1
+    state.consecutive_repeats += 1
+    logger.info("Repeated call to %s answered from the memo", func_name)
+    note = (f"In the {iteration} iteration you called {func_name} with the same parameters again. "
+            f"It was already computed and returned {brief(value)}. Do not repeat calls; "
+            f"use the result or give the FINAL_ANSWER.")
+    state.history.append(HistoryEntry(full=note, summary=note, elided=f"Iteration {iteration}: repeated {func_name}."))
+    state.last_response = value
+    return state.consecutive_repeats >= REPEAT_LIMIT
+
+
+def known_answer(state, arguments):
+    """The FINAL_ANSWER a terminal tool call reports, or None if it is not known
+
+    Args:
+        state (RunState): The current run
+        arguments (dict): The terminal tool's arguments
+
+    Returns:
+        str: A FINAL_ANSWER written into the arguments (add_text_in_paint), otherwise
+            one built from the last calculated result, or None before any calculation
+            and when that result is a server-side list known only by its res:// handle
+    """
+    for argument in arguments.values():
+        if isinstance(argument, str) and "FINAL_ANSWER:" in argument:
+            return argument[argument.index("FINAL_ANSWER:"):].strip()
+    value = state.last_computed
+    if value is None:
+        return None
+    if SERVER_HANDLE_PATTERN.search(json.dumps(value, default=str)):
+        return None  # Only the handle's summary is known here; the LLM gives the answer
+    if isinstance(value, list):
+        return f"FINAL_ANSWER: {json.dumps(value)}"
+    return f"FINAL_ANSWER: [{brief(value) if isinstance(value, dict) else value}]"
+
+
+def response_output(response):
+    """What the model wrote: the response text, or a function call's name and JSON arguments"""
+    if isinstance(response, FunctionCall):
+        return json.dumps({"name": response.name, "args": response.args})
+    return response.strip()
+
+
+def parse_function_call(response_text):
+    """Split a 'FUNCTION_CALL: name|p1|p2' line into the tool name and raw parameters"""
+    _, function_info = response_text.split(":", 1)
+    parts = [p.strip() for p in function_info.split("|")]
+    return parts[0], parts[1:]
+
+
+def _parse_number(text, param_type=None):
+    """Convert text to a number according to a JSON schema type (int or float when untyped)"""
+    text = text.strip()
+    if param_type == 'number':
+        return float(text)
+    try:
+        return int(text)
+    except ValueError:
+        number = float(text)
+        return int(number) if param_type == 'integer' else number
+
+
+def coerce_argument(value, param_info, state):
+    """Convert one raw FUNCTION_CALL parameter to the type in the tool's input schema
+
+    Args:
+        value (str): The raw parameter text from the LLM
+        param_info (dict): The parameter's JSON schema
+        state (RunState): The current run, used to resolve result handles
+
+    Returns:
+        The converted value
+    """
+    handle_value = state.resolve(value)
+    if handle_value is not None:
+        return handle_value
+    if SERVER_HANDLE_PATTERN.fullmatch(value.strip()):
+        # Server-side handles are resolved by the server itself
+        return value.strip()
+
+    types = schema_types(param_info)
+    param_type = types[0] if types else 'string'
+    if 'array' in types:
+        param_type = 'array'
+        param_info = next(option for option in param_info.get('anyOf', [param_info]) if option.get('type') == 'array')
+    elif 'object' in types:
+        param_type = 'object'
+    if param_type in ('integer', 'number'):
+        return _parse_number(value, param_type)
+    if param_type == 'array':
+        item_type = param_info.get('items', {}).get('type')
+        text = value.strip()
+        if text.startswith('['):
+            items = json.loads(text)
+        else:
+            items = [item.strip() for item in text.split(',') if item.strip()]
+        if item_type == 'string':
+            return [str(item) for item in items]
+        return [item if isinstance(item, (int, float)) else _parse_number(str(item), item_type) for item in items]
+    if param_type == 'object':
+        return json.loads(value) if value.strip() else None
+    if param_type == 'boolean':
+        return value.strip().lower() in ('true', '1', 'yes')
+    # Strings may mention handles (e.g. an email body containing the final list)
+    return state.expand_handles(str(value))
+
+
+def build_arguments(tool, params, state):
+    """Build the call_tool arguments for a tool from the raw FUNCTION_CALL parameters
+
+    Raises:
+        ValueError: If a required parameter is missing
+    """
+    arguments = {}
+    schema_properties = tool.inputSchema.get('properties', {})
+    required_params = tool.inputSchema.get('required', [])
+    params = list(params)
+    for param_name, param_info in schema_properties.items():
+        if not params:  # Check if we have enough parameters
+            # Optional parameters (like evaluate's variables) may be left out
+            if param_name not in required_params:
+                continue
+            raise ValueError(f"Not enough parameters provided for {tool.name}")
+        arguments[param_name] = coerce_argument(params.pop(0), param_info, state)
+    return arguments
+
+
+def build_prompt(system_prompt, state):
+    """Build the prompt for the next iteration from the query and the run's compacted history
+
+    Returns:
+        tuple: (prompt, estimated tokens saved by compacting the history)
+    """
+    if not state.history:
+        return f"{system_prompt}\n\nQuery: {state.query}", 0
+    history, full_tokens, tokens = compact_history(state.history, state.history_token_budget)
+    return f"{system_prompt}\n\nQuery: {state.query}\n\n{history}  What should I do next?", full_tokens - tokens
+
+
+async def run_agent(session, tools, system_prompt, query, generate,
+                    post_tool_delays=None, max_iterations=MAX_ITERATIONS, tracer=None,
+                    history_token_budget=HISTORY_TOKEN_BUDGET, state=None,
+                    function_calling=AGENT_FUNCTION_CALLING, catalog=None, terminal_tools=(),
+                    checkpoint=None):
+    """Run the iterative tool-calling loop for one query
+
+    Args:
+        session: An initialized MCP ClientSession
+        tools: Tools returned by session.list_tools()
+        system_prompt (str): Instructions and tool descriptions for the LLM
+        query (str): The problem to solve
+        generate: Async callable taking a prompt (and, in native mode, function
+            declarations) and returning the LLM's response text or a FunctionCall
+        post_tool_delays (dict): Seconds to wait after specific tools (e.g. Paint operations)
+        max_iterations (int): Maximum number of iterations
+        tracer (Tracer): Records the latency of every phase (default: a new Tracer,
+            whose summary is logged and exporters closed at the end of the run)
+        history_token_budget (int): Estimated tokens the history may use in a prompt
+        state (RunState): Continue this run (e.g. a partly executed plan) instead
+            of starting a new one
+        function_calling (str): "text" for FUNCTION_CALL lines, "native" for
+            structured function calls
+        catalog: The tools offered to the LLM as function declarations (default:
+            all tools; see tool_selector.py). Any of the tools can be executed.
+        terminal_tools: Tools that end the run when they succeed and the answer is
+            known, instead of asking the LLM for the FINAL_ANSWER
+        checkpoint (RunCheckpoint): Saves the run as it goes; its restored state (if
+            any) is continued when no state is given
+
+    Returns:
+        RunState: The finished run, including history, results and final answer
+    """
+    if state is None and checkpoint is not None:
+        state = checkpoint.state
+    if state is None:
+        state = RunState(query=query, history_token_budget=history_token_budget)
+    post_tool_delays = post_tool_delays or {}
+    tools_by_name = {tool.name: tool for tool in tools}
+    declarations = None
+    if function_calling == "native":
+        declarations = function_declarations(tools if catalog is None else catalog)
+        system_prompt = f"{system_prompt}\n\n{NATIVE_CALL_INSTRUCTIONS}"
+    owns_tracer = tracer is None
+    if owns_tracer:
+        tracer = Tracer()
+
+    try:
+        with tracer.span("run", query=query, function_calling=function_calling) as run_attributes:
+            await _run_iterations(session, tools_by_name, system_prompt, generate,
+                                  post_tool_delays, max_iterations, state, tracer, declarations,
+                                  set(terminal_tools), checkpoint)
+            run_attributes["iterations"] = state.iteration
+            run_attributes["answered"] = state.final_answer is not None
+            run_attributes["tokens_saved"] = state.tokens_saved
+            run_attributes["failed_iterations"] = state.failed_iterations
+            run_attributes["output_tokens"] = state.output_tokens
+            run_attributes["repeated_calls"] = state.repeated_calls
+            run_attributes["iterations_saved"] = state.iterations_saved
+            run_attributes["completed_by"] = state.completed_by
+        if checkpoint is not None:
+            checkpoint.finish(state, done=run_finished(state, max_iterations))
+        if state.tokens_saved:
+            logger.info("History compaction saved ~%s prompt tokens", state.tokens_saved)
+        if state.repeated_calls:
+            logger.info("Repeated calls answered from the memo: %s, iterations saved by ending early: %s",
+                        state.repeated_calls, state.iterations_saved)
+        if state.llm_calls:
+            logger.info("Failed iterations: %s, output tokens per LLM call: ~%.0f (%s function calling)",
+                        state.failed_iterations, state.output_tokens / state.llm_calls, function_calling)
+    finally:
+        if owns_tracer:
+            tracer.print_summary()
+            tracer.close()
+    return state
+
+
+async def _run_iterations(session, tools_by_name, system_prompt, generate,
+                          post_tool_delays, max_iterations, state, tracer, declarations=None,
+                          terminal_tools=frozenset(), checkpoint=None):
+    """The body of run_agent, with every phase of every iteration wrapped in a span"""
+    # Tools that change state outside the run (Paint, email) are never answered from the memo
+    side_effect_tools = set(post_tool_delays) | set(terminal_tools)
+    # Main iteration loop - runs until max_iterations or we get a final answer
+    while state.iteration < max_iterations:
+        iteration = state.iteration + 1
+        logger.info("--- Iteration %s ---", iteration)
+        with tracer.span("iteration", iteration=iteration):
+
+            # Get the model's response with timeout protection
+            logger.debug("Preparing to generate LLM response...")
+            with tracer.span("prompt_build", iteration=iteration) as attributes:
+                prompt, tokens_saved = build_prompt(system_prompt, state)
+                state.tokens_saved += tokens_saved
+                attributes["prompt_chars"] = len(prompt)
+                attributes["tokens_saved"] = tokens_saved
+            try:
+                response = state.pending_response
+                if response is None:
+                    with tracer.span("llm_call", iteration=iteration) as attributes:
+                        if declarations is None:
+                            response = await generate(prompt)
+                        else:
+                            response = await generate(prompt, declarations)
+                        output = response_output(response)
+                        attributes["response_chars"] = len(output)
+                    state.llm_calls += 1
+                    state.output_tokens += estimate_tokens(output)
+                    if checkpoint is not None:
+                        # Saved before the tool call, so a resumed run does not ask the LLM again
+                        state.pending_response = response
+                        checkpoint.save(state)
+                else:
+                    # Saved before the run was interrupted, or the planner's FUNCTION_CALL reply
+                    logger.info("Continuing with the saved LLM response")
+                call = response if isinstance(response, FunctionCall) else None
+                response_text = "" if call else response.strip()
+                logger.info("LLM Response: %s", f"{call.name}({call.args})" if call else response_text)
+            except Exception as e:
+                logger.error("Failed to get LLM response: %s", e)
+                break
+
+            with tracer.span("response_parse", iteration=iteration):
+                # Ensure we only use the FUNCTION_CALL line if multiple lines are returned
+                for line in response_text.split('\n'):
+                    line = line.strip()
+                    if line.startswith("FUNCTION_CALL:"):
+                        response_text = line
+                        break
+                if response_text.startswith("FUNCTION_CALL:"):
+                    func_name, params = parse_function_call(response_text)
+                elif call:
+                    func_name, params = call.name, call.args
+
+            # Process tool calls (when the model wants to use a function)
+            if call or response_text.startswith("FUNCTION_CALL:"):
+                logger.debug("Function name: %s", func_name)
+                logger.debug("Raw parameters: %s", params)
+
+                try:
+                    # Find the matching tool in the available tools list
+                    tool = tools_by_name.get(func_name)
+                    if not tool:
+                        logger.debug("Available tools: %s", list(tools_by_name))
+                        raise ValueError(f"Unknown tool: {func_name}")
+
+                    # Prepare arguments according to the tool's expected input schema
+                    with tracer.span("argument_coercion", iteration=iteration, tool=func_name):
+                        if call:
+                            arguments = native_arguments(tool, params, state)
+                        else:
+                            arguments = build_arguments(tool, params, state)
+                    logger.debug("Final arguments: %s", arguments)
+
+                    # A call already made in this run is answered from the memo
+                    fingerprint = call_fingerprint(func_name, arguments)
+                    if fingerprint in state.memo:
+                        with tracer.span("memo_hit", iteration=iteration, tool=func_name):
+                            stalled = _record_repeat(state, iteration, func_name, fingerprint)
+                        if stalled:
+                            state.iterations_saved = max_iterations - iteration
+                            logger.warning("%s repeated calls in a row, ending the run early", state.consecutive_repeats)
+                            break
+                    else:
+                        state.consecutive_repeats = 0
+                        # Call the tool with the prepared arguments
+                        with tracer.span("tool_call", iteration=iteration, tool=func_name):
+                            result = await session.call_tool(func_name, arguments=arguments)
+                        with tracer.span("result_decode", iteration=iteration, tool=func_name):
+                            value = decode_tool_result(result)
+                        logger.debug("Result value: %s", value)
+                        failed = getattr(result, 'isError', False)
+                        if failed:
+                            state.failed_iterations += 1
+                            state.consecutive_failures += 1
+                            logger.warning("%s returned an error: %s", func_name, brief(value))
+                        else:
+                            state.consecutive_failures = 0
+
+                        # A successful terminal tool with a known answer completes the run
+                        answer = None
+                        if func_name in terminal_tools and not failed:
+                            answer = known_answer(state, arguments)
+
+                        # Keep the native value and describe it for the next iteration
+                        state.results.append(value)
+                        result_str = format_value(value, state)
+                        shown_arguments = {
+                            name: (f"<list of {len(arg)} values>" if isinstance(arg, list) and len(arg) > LIST_HANDLE_THRESHOLD else arg)
+                            for name, arg in arguments.items()
+                        }
+                        full = (f"In the {iteration} iteration you called {func_name} with {shown_arguments} parameters, "
+                                f"and the function returned {result_str}.")
+                        # Summaries shorten lists, so keep a handle that still passes the whole list
+                        handle = None
+                        if isinstance(value, list) and len(value) > 2 * SUMMARY_LIST_ITEMS:
+                            handle = state.store_handle(value)
+                        state.history.append(tool_call_entry(iteration, func_name, full, arguments, value, handle))
+                        state.last_response = value
+                        remember_call(state, func_name, fingerprint, value, failed, side_effect_tools)
+                        if func_name not in side_effect_tools and not failed:
+                            state.last_computed = value
+                        if checkpoint is not None:
+                            # The call is done: a resumed run goes on with the next iteration
+                            state.pending_response = None
+                            checkpoint.log_call(iteration, func_name, arguments, value)
+                            checkpoint.save(state, iteration=iteration)
+
+                        # Give slow side effects (Paint, email) time to complete, unless the run ends here
+                        if func_name in post_tool_delays and answer is None:
+                            with tracer.span("post_tool_sleep", iteration=iteration, tool=func_name):
+                                await asyncio.sleep(post_tool_delays[func_name])
+
+                        if answer is not None:
+                            state.final_answer = state.expand_handles(answer)
+                            state.completed_by = func_name
+                            logger.info("=== Agent Execution Complete (%s succeeded, final LLM call skipped) ===", func_name)
+                            logger.info("Final answer: %s", state.final_answer)
+                            break
+                        if state.consecutive_failures >= FAILURE_LIMIT:
+                            state.iteration += 1  # This iteration is done and saved
+                            logger.warning("%s tool errors in a row, ending the run early", state.consecutive_failures)
+                            break
+
+                except Exception as e:
+                    # Handle errors during tool execution
+                    state.failed_iterations += 1
+                    logger.exception("Error in iteration %s (%s): %s", iteration, type(e).__name__, e)
+                    error = f"Error in iteration {iteration}: {str(e)}"
+                    state.history.append(HistoryEntry(full=error, summary=error, elided=error))
+                    break
+
+            # Process final answer when the model has completed the calculation
+            elif response_text.startswith("FINAL_ANSWER:"):
+                state.final_answer = state.expand_handles(response_text)
+                logger.info("=== Agent Execution Complete ===")
+                logger.info("Final answer: %s", state.final_answer)
+                break
+
+            # Neither a call nor an answer: the iteration is wasted
+            else:
+                state.failed_iterations += 1
+                logger.warning("Response is neither a FUNCTION_CALL nor a FINAL_ANSWER: %s", response_text)
+
+        # Increment iteration counter
+        state.iteration += 1
+        state.pending_response = None
+        if checkpoint is not None:
+            checkpoint.save(state)
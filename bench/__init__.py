@@ -0,0 +1,12 @@
+"""
+Offline Benchmark Suite
+
+Runs the talk2mcp agent loop against a real MCP server process, but with a
+scripted, deterministic stand-in for Gemini (fake_llm.py) and a local HTTP stub
+for the Gmail and OAuth endpoints (fake_gmail.py), so runs are repeatable and
+need no network access or API keys.
+
+Run from the repository root:
+    python -m bench.run_bench                  # writes bench/results/<commit>.json
+    python -m bench.compare OLD.json NEW.json  # compare two result files
+"""
@@ -0,0 +1,88 @@
+"""
+Benchmark Comparison
+
+Compares two result files written by bench/run_bench.py (or two written by
+bench/micro.py, or by bench/importtime.py) and prints every latency and throughput metric side by side
+with the relative change.
+Exits with status 1 if any metric regressed by more than the threshold.
+
+Usage (from the repository root):
+    python -m bench.compare bench/results/OLD.json bench/results/NEW.json [--threshold 10]
+"""
+
+import argparse
+import json
+import sys
+
+# Throughput metrics; every other metric is a time where lower is better
+HIGHER_IS_BETTER = ("calls_per_second", "bytes_per_second")
+
+
+def flatten(results):
+    """Collect the comparable metrics of a result file as {"path.to.metric": value}
+
+    Only the aggregated means, p50s and p95s and the throughput are compared;
+    individual samples and metadata are skipped.
+    """
+    metrics = {}
+
+    def walk(prefix, value):
+        if isinstance(value, dict):
+            for key, item in value.items():
+                walk(f"{prefix}.{key}" if prefix else key, item)
+        elif isinstance(value, (int, float)) and not isinstance(value, bool):
+            name = prefix.rsplit(".", 1)[-1]
+            if (name in ("mean_ms", "p50_ms", "p95_ms", "mean_us", "p50_us", "p95_us")
+                    or name in HIGHER_IS_BETTER
+                    or ".span_mean_ms." in prefix or ".breakdown_us." in prefix):
+                metrics[prefix] = value
+
+    walk("", {key: value for key, value in results.items() if key != "meta"})
+    return metrics
+
+
+def compare(old, new, threshold):
+    """Print the comparison table and return the list of regressed metrics"""
+    old_metrics, new_metrics = flatten(old), flatten(new)
+    regressions = []
+    print(f"{'metric':<64}{'old':>12}{'new':>12}{'change':>9}")
+    for name in sorted(set(old_metrics) | set(new_metrics)):
+        before, after = old_metrics.get(name), new_metrics.get(name)
+        if before is None or after is None:
+            shown_before = "-" if before is None else f"{before:.2f}"
+            shown_after = "-" if after is None else f"{after:.2f}"
+            print(f"{name:<64}{shown_before:>12}{shown_after:>12}{'':>9}")
+            continue
+        change = 100 * (after - before) / before if before else 0.0
+        # Lower is better for times, higher is better for throughput
+        worse = -change if name.rsplit(".", 1)[-1] in HIGHER_IS_BETTER else change
+        flag = ""
+        if worse > threshold:
+            flag = "  <-- slower"
+            regressions.append(name)
+        print(f"{name:<64}{before:>12.2f}{after:>12.2f}{change:>8.1f}%{flag}")
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Compare two benchmark result files")
+    parser.add_argument("old", help="baseline result file")
+    parser.add_argument("new", help="result file to compare against the baseline")
+    parser.add_argument("--threshold", type=float, default=10.0,
+                        help="percent change counted as a regression (default: 10)")
+    args = parser.parse_args()
+
+    with open(args.old) as f:
+        old = json.load(f)
+    with open(args.new) as f:
+        new = json.load(f)
+    print(f"Comparing {old['meta']['commit']} -> {new['meta']['commit']}\n")
+    regressions = compare(old, new, args.threshold)
+    if regressions:
+        print(f"\n{len(regressions)} metric(s) regressed by more than {args.threshold:g}%")
+        sys.exit(1)
+    print("\nNo regressions above the threshold")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,109 @@
+"""
+Local Gmail / OAuth HTTP Stub
+
+A tiny HTTP server that answers the two endpoints example2-3_Gmail_2.py uses:
+
+    POST /token                              OAuth refresh -> {"access_token": ...}
+    POST /gmail/v1/users/me/messages/send    Gmail send    -> {"id": ..., "labelIds": ["SENT"]}
+
+Point the server at it with GMAIL_OAUTH_TOKEN_URL=<url>/token and
+GMAIL_API_URL=<url>. write_credentials() creates the client secret and token
+files the server expects.
+"""
+
+import json
+import os
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+
+class _Handler(BaseHTTPRequestHandler):
+    def do_POST(self):
+        length = int(self.headers.get("Content-Length", 0))
+        self.rfile.read(length)
+        stub = self.server.stub
+        if self.path == "/token":
+            stub.token_requests += 1
+            self._reply(200, {"access_token": f"fake-access-{stub.token_requests}", "expires_in": 3600})
+        elif self.path == "/gmail/v1/users/me/messages/send":
+            if not self.headers.get("Authorization", "").startswith("Bearer "):
+                self._reply(401, {"error": "missing bearer token"})
+                return
+            stub.sent_messages += 1
+            self._reply(200, {"id": f"msg-{stub.sent_messages}", "labelIds": ["SENT"]})
+        else:
+            self._reply(404, {"error": f"unknown path {self.path}"})
+
+    def _reply(self, status, body):
+        data = json.dumps(body).encode()
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def log_message(self, format, *args):
+        pass  # Keep benchmark output clean
+
+
+class FakeGmailServer:
+    """Runs the stub on a free localhost port in a background thread
+
+    Use it as a context manager:
+
+        with FakeGmailServer() as gmail:
+            env = gmail.server_env(tmp_dir)
+    """
+
+    def __init__(self, host="127.0.0.1", port=0):
+        self.token_requests = 0
+        self.sent_messages = 0
+        self._httpd = ThreadingHTTPServer((host, port), _Handler)
+        self._httpd.stub = self
+        self._thread = None
+
+    @property
+    def url(self):
+        host, port = self._httpd.server_address[:2]
+        return f"http://{host}:{port}"
+
+    def start(self):
+        self._thread = threading.Thread(target=self._httpd.serve_forever, name="fake-gmail", daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self._httpd.shutdown()
+        self._httpd.server_close()
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc_info):
+        self.stop()
+
+    def write_credentials(self, directory):
+        """Write a client secret file and a token file (with a refresh token) into directory
+
+        Returns:
+            tuple: (client secret path, token path)
+        """
+        secret_path = os.path.join(directory, "client_secret_bench.json")
+        token_path = os.path.join(directory, "token.json")
+        with open(secret_path, 'w') as f:
+            json.dump({"installed": {"client_id": "bench-client", "client_secret": "bench-secret"}}, f)
+        with open(token_path, 'w') as f:
+            json.dump({"access_token": "expired", "refresh_token": "bench-refresh"}, f)
+        return secret_path, token_path
+
+    def server_env(self, directory):
+        """Environment variables that point example2-3_Gmail_2.py at this stub"""
+        secret_path, token_path = self.write_credentials(directory)
+        return {
+            "GMAIL_OAUTH_TOKEN_URL": f"{self.url}/token",
+            "GMAIL_API_URL": self.url,
+            "GMAIL_CLIENT_SECRET_FILE": secret_path,
+            "GMAIL_TOKEN_FILE": token_path,
+            "USER_EMAIL": "bench@example.com",
+            "NO_PROXY": "127.0.0.1,localhost",  # Never send stub traffic through a proxy
+        }
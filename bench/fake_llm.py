@@ -0,0 +1,54 @@
+"""
+Scripted LLM Stand-In
+
+Replays a fixed list of responses (FUNCTION_CALL / FINAL_ANSWER lines) instead
+of calling Gemini. It has the same shape as the generate() callable the clients
+pass to run_agent(), so the agent loop runs unchanged. A response given as a
+dict ({"name": ..., "args": {...}}) is returned as a structured FunctionCall,
+as a model does in native function-calling mode.
+"""
+
+import asyncio
+import json
+import re
+
+from llm_providers import FunctionCall
+
+# Handles the LLM would copy from the previous result (server res://N or client $rN)
+_HANDLE_PATTERN = re.compile(r"res://\d+|\$r\d+")
+
+
+class ScriptedLLM:
+    """Returns scripted responses in order, one per call"""
+
+    def __init__(self, responses, latency=0.0):
+        """Create a scripted LLM
+
+        Args:
+            responses (list): Response lines or function call dicts, in order. "{handle}"
+                in a response is replaced with the last result handle (res://N or $rN) in
+                the prompt, so scripts work however many runs the server has already stored.
+            latency (float): Simulated seconds per call (default: none)
+        """
+        self.responses = list(responses)
+        self.latency = latency
+        self.calls = 0
+        self.prompt_chars = []
+
+    async def __call__(self, prompt, declarations=None):
+        if self.calls >= len(self.responses):
+            raise RuntimeError(f"Scripted LLM ran out of responses after {self.calls} calls")
+        response = self.responses[self.calls]
+        self.calls += 1
+        self.prompt_chars.append(len(prompt))
+        text = json.dumps(response) if isinstance(response, dict) else response
+        if "{handle}" in text:
+            handles = _HANDLE_PATTERN.findall(prompt)
+            if not handles:
+                raise RuntimeError(f"Scripted response needs a result handle but the prompt has none: {response}")
+            text = text.replace("{handle}", handles[-1])
+        if self.latency:
+            await asyncio.sleep(self.latency)
+        if isinstance(response, dict):
+            return FunctionCall(**json.loads(text))
+        return text
@@ -0,0 +1,155 @@
+"""
+Import-Time Profiling
+
+Measures the cold start of the clients: a fresh interpreter loads the script
+(its module-level code, without the main block) under `python -X importtime`,
+which reports the self and cumulative import time of every module. The
+report is parsed into the cost of each top-level import (mcp, agent_loop,
+dotenv, ...) and the slowest individual modules, so a heavy dependency that
+crept into the startup path shows up by name.
+
+Each script is loaded once untimed (to write the .pyc files) and then
+--repeat times; the medians are reported.
+
+With --budget-ms this is a check: it exits with status 1 if the median cold
+start of any script is over the budget, e.g. before deploying the cron jobs.
+The result file can also be compared with bench/compare.py.
+
+Usage (from the repository root):
+    python -m bench.importtime [SCRIPT ...] [--repeat 5] [--top 10] [--budget-ms 1500] [--output FILE]
+"""
+
+import argparse
+import json
+import os
+import re
+import statistics
+import subprocess
+import sys
+import time
+
+from tracing import percentile
+from bench.run_bench import REPO_ROOT, RESULTS_DIR, git_commit
+
+# The clients and the batch CLI
+DEFAULT_SCRIPTS = ["talk2mcp-2.py", "talk2mcp-2_Gmail.py", "talk2mcp-2_Gmail_2.py", "main.py"]
+
+# Runs the script's module-level code only: its __name__ is not "__main__"
+LOADER = "import runpy, sys; runpy.run_path(sys.argv[1], run_name='__importtime__')"
+
+# "import time:  self [us] | cumulative | imported package", the name indented two spaces per level
+IMPORT_LINE = re.compile(r"^import time:\s+(\d+) \|\s+(\d+) \|( +)(\S+)\s*$")
+
+
+def parse_importtime(report):
+    """Parse the stderr of `python -X importtime`
+
+    Returns:
+        list: (module, self_us, cumulative_us, depth) in report order; depth 0 are
+            the imports made by the script itself (and the interpreter's startup)
+    """
+    modules = []
+    for line in report.splitlines():
+        match = IMPORT_LINE.match(line)
+        if match:
+            self_us, cumulative_us, indent, name = match.groups()
+            modules.append((name, int(self_us), int(cumulative_us), (len(indent) - 1) // 2))
+    return modules
+
+
+def load_once(script):
+    """Load the script in a fresh interpreter; returns (wall seconds, parsed import report)"""
+    start = time.perf_counter()
+    completed = subprocess.run([sys.executable, "-X", "importtime", "-c", LOADER, script], cwd=REPO_ROOT,
+                               capture_output=True, text=True)
+    wall = time.perf_counter() - start
+    if completed.returncode != 0:
+        raise RuntimeError(f"Loading {script} failed:\n{completed.stderr[-2000:]}")
+    return wall, parse_importtime(completed.stderr)
+
+
+def profile_script(script, repeat, top):
+    """Cold start and import costs of a script, as medians over repeat runs"""
+    load_once(script)  # Writes the .pyc files, which every later start reuses
+    walls = []
+    top_level = {}
+    self_times = {}
+    for _ in range(repeat):
+        wall, modules = load_once(script)
+        walls.append(wall * 1000)
+        for name, self_us, cumulative_us, depth in modules:
+            if depth == 0:
+                top_level.setdefault(name, []).append(cumulative_us / 1000)
+            self_times.setdefault(name, []).append(self_us / 1000)
+    top_level = {name: statistics.median(times) for name, times in top_level.items()}
+    self_times = {name: statistics.median(times) for name, times in self_times.items()}
+    return {
+        "cold_start": {
+            "mean_ms": statistics.mean(walls),
+            "p50_ms": statistics.median(walls),
+            "p95_ms": percentile(walls, 0.95),
+        },
+        "imports_ms": sum(top_level.values()),
+        "modules": len(self_times),
+        "top_level_ms": dict(sorted(top_level.items(), key=lambda item: -item[1])[:top]),
+        "slowest_self_ms": dict(sorted(self_times.items(), key=lambda item: -item[1])[:top]),
+    }
+
+
+def print_report(script, row):
+    """Print the cold start and the largest import costs of one script"""
+    cold = row["cold_start"]["p50_ms"]
+    print("\n" + "=" * 78)
+    print(f"{script}: cold start {cold:.0f} ms (median), imports {row['imports_ms']:.0f} ms, "
+          f"{row['modules']} modules")
+    print("=" * 78)
+    print(f"{'top-level import':<48}{'cumulative ms':>15}{'share':>9}")
+    for name, ms in row["top_level_ms"].items():
+        print(f"{name:<48}{ms:>15.1f}{100 * ms / cold:>8.1f}%")
+    print(f"\n{'slowest modules (self time)':<48}{'self ms':>15}")
+    for name, ms in row["slowest_self_ms"].items():
+        print(f"{name:<48}{ms:>15.1f}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Per-module import cost and cold start of the clients")
+    parser.add_argument("scripts", nargs="*", default=DEFAULT_SCRIPTS,
+                        help=f"scripts to load (default: {' '.join(DEFAULT_SCRIPTS)})")
+    parser.add_argument("--repeat", type=int, default=5, help="timed loads per script")
+    parser.add_argument("--top", type=int, default=10, help="imports and modules listed per script")
+    parser.add_argument("--budget-ms", type=float, default=0,
+                        help="fail if a script's median cold start is over this (default: no check)")
+    parser.add_argument("--output", help="result file (default: bench/results/importtime-<commit>.json)")
+    args = parser.parse_args()
+
+    commit, dirty = git_commit()
+    results = {
+        "meta": {"commit": commit, "dirty": dirty, "python": sys.version.split()[0], "repeat": args.repeat},
+        "importtime": {},
+    }
+    for script in args.scripts:
+        row = profile_script(script, args.repeat, args.top)
+        results["importtime"][script] = row
+        print_report(script, row)
+
+    output = args.output
+    if not output:
+        os.makedirs(RESULTS_DIR, exist_ok=True)
+        suffix = "-dirty" if dirty else ""
+        output = os.path.join(RESULTS_DIR, f"importtime-{commit}{suffix}.json")
+    with open(output, 'w') as f:
+        json.dump(results, f, indent=2)
+    print(f"\nResults written to {output}")
+
+    if args.budget_ms:
+        over = {script: row["cold_start"]["p50_ms"] for script, row in results["importtime"].items()
+                if row["cold_start"]["p50_ms"] > args.budget_ms}
+        if over:
+            for script, ms in over.items():
+                print(f"OVER BUDGET: {script} cold start {ms:.0f} ms > {args.budget_ms:.0f} ms")
+            sys.exit(1)
+        print(f"All cold starts within the {args.budget_ms:.0f} ms budget")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,287 @@
+"""
+Stdio Round-Trip Microbenchmarks
+
+Hammers a trivial tool (add) and payload-heavy tools (fibonacci_numbers,
+strings_to_chars_to_int, add_list) over the stdio pipe at several payload sizes
+and concurrency levels, and reports calls/s and bytes/s for each combination.
+
+For every tool and payload size it also splits one sequential call into:
+    tool_body         the tool function itself (from tool_metrics)
+    fastmcp_dispatch  argument validation and result conversion, measured by
+                      calling the same server in-process without a transport
+    json_codec        encoding and decoding of the JSON-RPC request and
+                      response on both sides (the same pydantic calls the
+                      client and server stdio transports make, timed here)
+    pipe_io           what is left of the round trip: pipe writes/reads, event
+                      loop scheduling and process switches
+
+It also measures what the tool_metrics wrapper adds to every call, against a
+bare functools.wraps wrapper (metrics_overhead_ns).
+
+Large list results are sent in full (the result store threshold is raised) and
+CPU-bound tools run inline (MCP_CPU_WORKERS=0), so the numbers isolate the
+transport and serialization cost. Use --handles / --cpu-workers to measure the
+normal configuration instead.
+
+Usage (from the repository root):
+    python -m bench.micro [--sizes 10,100,1000] [--concurrency 1,4,16] [--calls 200] [--output FILE]
+"""
+
+import argparse
+import asyncio
+import contextlib
+import functools
+import importlib.util
+import io
+import json
+import os
+import tempfile
+import time
+import timeit
+
+from mcp import types
+
+import result_store
+import tool_metrics
+import tool_workers
+from tracing import percentile
+from bench.fake_gmail import FakeGmailServer
+from bench.run_bench import RESULTS_DIR, SERVER_SCRIPT, git_commit, server_session
+
+# Tool name -> function building its arguments for a payload size (add ignores the size)
+WORKLOADS = {
+    "add": lambda size: {"a": size, "b": 1},
+    "fibonacci_numbers": lambda size: {"n": size},
+    "strings_to_chars_to_int": lambda size: {"string": "x" * size},
+    "add_list": lambda size: {"l": list(range(size))},
+}
+
+
+def load_server(path=SERVER_SCRIPT):
+    """Import a server script in-process (its __main__ block does not run) and return its FastMCP instance"""
+    spec = importlib.util.spec_from_file_location("bench_server", path)
+    module = importlib.util.module_from_spec(spec)
+    with contextlib.redirect_stdout(io.StringIO()):
+        spec.loader.exec_module(module)
+    return module.mcp
+
+
+def codec_timings(name, arguments, result, repeat=20):
+    """Time the JSON-RPC encode/decode work of one call on both sides of the pipe
+
+    Returns:
+        tuple: (seconds per call, request bytes, response bytes)
+    """
+    request = types.JSONRPCMessage(types.JSONRPCRequest(
+        jsonrpc="2.0", id=1, method="tools/call", params={"name": name, "arguments": arguments}
+    ))
+    response = types.JSONRPCMessage(types.JSONRPCResponse(
+        jsonrpc="2.0", id=1, result=result.model_dump(by_alias=True, exclude_none=True)
+    ))
+    request_json = request.model_dump_json(by_alias=True, exclude_none=True)
+    response_json = response.model_dump_json(by_alias=True, exclude_none=True)
+
+    start = time.perf_counter()
+    for _ in range(repeat):
+        request.model_dump_json(by_alias=True, exclude_none=True)      # client encodes the request
+        types.JSONRPCMessage.model_validate_json(request_json)         # server decodes it
+        response.model_dump_json(by_alias=True, exclude_none=True)     # server encodes the response
+        decoded = types.JSONRPCMessage.model_validate_json(response_json)  # client decodes it
+        types.CallToolResult.model_validate(decoded.root.result)       # and validates the result type
+    elapsed = (time.perf_counter() - start) / repeat
+    return elapsed, len(request_json.encode()), len(response_json.encode())
+
+
+async def in_process_timings(server, name, arguments, repeat):
+    """Time the tool body and the full in-process FastMCP dispatch (no transport)
+
+    Returns:
+        tuple: (tool body seconds per call, dispatch seconds per call)
+    """
+    metrics = tool_metrics.metrics_for(name)
+    calls_before, total_before = metrics.calls, metrics.total_ns
+    with contextlib.redirect_stdout(io.StringIO()):
+        start = time.perf_counter()
+        for _ in range(repeat):
+            await server.call_tool(name, arguments)
+        elapsed = (time.perf_counter() - start) / repeat
+    calls = metrics.calls - calls_before
+    body = (metrics.total_ns - total_before) / calls / 1e9 if calls else 0.0
+    return body, elapsed
+
+
+def metrics_overhead(calls=200_000, repeat=5):
+    """Nanoseconds tool_metrics adds per call (sync tool, best of repeat runs)"""
+    def add(a: int, b: int) -> int:
+        return a + b
+
+    @functools.wraps(add)
+    def bare(*args, **kwargs):
+        return add(*args, **kwargs)
+
+    instrumented = tool_metrics.instrument(add, "metrics_overhead_bench")
+    per_call = {}
+    for label, wrapper in (("bare", bare), ("instrumented", instrumented)):
+        best = min(timeit.repeat(lambda: wrapper(a=1, b=2), number=calls, repeat=repeat))
+        per_call[label] = best / calls * 1e9
+    del tool_metrics._registry["metrics_overhead_bench"]
+    return {
+        "bare_wrapper": round(per_call["bare"], 1),
+        "instrumented": round(per_call["instrumented"], 1),
+        "overhead": round(per_call["instrumented"] - per_call["bare"], 1),
+    }
+
+
+async def measure_stdio(session, name, arguments, calls, concurrency):
+    """Run calls round trips with the given number of concurrent requests in flight
+
+    Returns:
+        tuple: (total seconds, per-call latencies in seconds, last result)
+    """
+    latencies = []
+    last_result = None
+    remaining = calls
+
+    async def worker():
+        nonlocal remaining, last_result
+        while remaining > 0:
+            remaining -= 1
+            start = time.perf_counter()
+            result = await session.call_tool(name, arguments=arguments)
+            latencies.append(time.perf_counter() - start)
+            if result.isError:
+                raise RuntimeError(f"{name} failed: {result.content}")
+            last_result = result
+
+    start = time.perf_counter()
+    await asyncio.gather(*(worker() for _ in range(concurrency)))
+    return time.perf_counter() - start, latencies, last_result
+
+
+async def run_micro(sizes, concurrency_levels, calls, handles, cpu_workers):
+    """Run every workload at every size and concurrency level and return the results dict"""
+    commit, dirty = git_commit()
+    results = {
+        "meta": {
+            "commit": commit,
+            "dirty": dirty,
+            "timestamp": time.strftime("%Y-%m-%dT%H:%M:%S"),
+            "server": os.path.basename(SERVER_SCRIPT),
+            "calls": calls,
+            "handles": handles,
+            "cpu_workers": cpu_workers,
+        },
+        "micro": {},
+        "metrics_overhead_ns": metrics_overhead(),
+    }
+    print(f"tool_metrics overhead: {results['metrics_overhead_ns']['overhead']:.0f} ns per call")
+
+    settings = {"MCP_CPU_WORKERS": str(cpu_workers)}
+    if not handles:
+        settings["RESULT_HANDLE_THRESHOLD"] = str(10 ** 9)
+    # The in-process server (both modules read these at call time); its CPU-bound
+    # tools always run inline, so the dispatch figure never includes the worker pool
+    tool_workers.CPU_WORKERS = 0
+    if not handles:
+        result_store.RESULT_HANDLE_THRESHOLD = 10 ** 9
+    server = load_server()
+
+    with FakeGmailServer() as gmail, tempfile.TemporaryDirectory() as tmp_dir:
+        server_env = {**gmail.server_env(tmp_dir), **settings}
+        async with server_session(server_env) as (session, _):
+            for name, build_arguments in WORKLOADS.items():
+                for size in ([1] if name == "add" else sizes):
+                    arguments = build_arguments(size)
+                    # Warm up (imports, caches, worker start-up)
+                    await measure_stdio(session, name, arguments, 3, 1)
+
+                    for concurrency in concurrency_levels:
+                        elapsed, latencies, last_result = await measure_stdio(
+                            session, name, arguments, calls, concurrency
+                        )
+                        codec, request_bytes, response_bytes = codec_timings(name, arguments, last_result)
+                        latencies_us = [latency * 1e6 for latency in latencies]
+                        row = {
+                            "tool": name,
+                            "size": size,
+                            "concurrency": concurrency,
+                            "calls": calls,
+                            "seconds": round(elapsed, 4),
+                            "calls_per_second": round(calls / elapsed, 1),
+                            "bytes_per_second": round(calls * (request_bytes + response_bytes) / elapsed),
+                            "request_bytes": request_bytes,
+                            "response_bytes": response_bytes,
+                            "round_trip": {
+                                "mean_us": round(sum(latencies_us) / len(latencies_us), 1),
+                                "p50_us": round(percentile(latencies_us, 0.50), 1),
+                                "p95_us": round(percentile(latencies_us, 0.95), 1),
+                            },
+                        }
+                        if concurrency == 1:
+                            # Where the time of one sequential call goes
+                            body, dispatch = await in_process_timings(server, name, arguments, min(calls, 50))
+                            round_trip = row["round_trip"]["mean_us"] / 1e6
+                            row["breakdown_us"] = {
+                                "tool_body": round(body * 1e6, 1),
+                                "fastmcp_dispatch": round(max(dispatch - body, 0.0) * 1e6, 1),
+                                "json_codec": round(codec * 1e6, 1),
+                                "pipe_io": round(max(round_trip - dispatch - codec, 0.0) * 1e6, 1),
+                            }
+                        key = f"{name}/size={size}/concurrency={concurrency}"
+                        results["micro"][key] = row
+                        print(f"{key:<52}{row['calls_per_second']:>10.0f} calls/s"
+                              f"{row['bytes_per_second'] / 1e6:>9.2f} MB/s")
+    return results
+
+
+def print_breakdown(results):
+    """Print the per-call time breakdown of the sequential runs"""
+    print("\n" + "=" * 96)
+    print("Where one sequential call spends its time (microseconds)")
+    print("=" * 96)
+    print(f"{'workload':<36}{'bytes':>10}{'round trip':>12}{'tool body':>11}{'dispatch':>10}"
+          f"{'json':>9}{'pipe io':>9}")
+    for key, row in results["micro"].items():
+        breakdown = row.get("breakdown_us")
+        if not breakdown:
+            continue
+        workload = f"{row['tool']}/size={row['size']}"
+        print(f"{workload:<36}{row['request_bytes'] + row['response_bytes']:>10}"
+              f"{row['round_trip']['mean_us']:>12.0f}{breakdown['tool_body']:>11.0f}"
+              f"{breakdown['fastmcp_dispatch']:>10.0f}{breakdown['json_codec']:>9.0f}{breakdown['pipe_io']:>9.0f}")
+    print("=" * 96)
+
+
+def parse_list(text):
+    return [int(value) for value in text.split(",") if value.strip()]
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Stdio round-trip and serialization microbenchmarks")
+    parser.add_argument("--sizes", type=parse_list, default=[10, 100, 1000],
+                        help="comma-separated payload sizes (list lengths / string lengths)")
+    parser.add_argument("--concurrency", type=parse_list, default=[1, 4, 16],
+                        help="comma-separated numbers of concurrent requests")
+    parser.add_argument("--calls", type=int, default=200, help="calls per measurement")
+    parser.add_argument("--handles", action="store_true",
+                        help="keep the result store on (large lists come back as res:// handles)")
+    parser.add_argument("--cpu-workers", type=int, default=0,
+                        help="MCP_CPU_WORKERS for the server (default: 0, CPU-bound tools run inline)")
+    parser.add_argument("--output", help="result file (default: bench/results/micro-<commit>.json)")
+    args = parser.parse_args()
+
+    results = asyncio.run(run_micro(args.sizes, args.concurrency, args.calls, args.handles, args.cpu_workers))
+    print_breakdown(results)
+
+    output = args.output
+    if not output:
+        os.makedirs(RESULTS_DIR, exist_ok=True)
+        suffix = "-dirty" if results["meta"]["dirty"] else ""
+        output = os.path.join(RESULTS_DIR, f"micro-{results['meta']['commit']}{suffix}.json")
+    with open(output, 'w') as f:
+        json.dump(results, f, indent=2)
+    print(f"Results written to {output}")
+
+
+if __name__ == "__main__":
+    main()
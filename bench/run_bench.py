@@ -0,0 +1,282 @@
+"""
+Benchmark Runner
+
+Measures, against a real example2-3_Gmail_2.py server process over stdio:
+    - server startup time (spawn + initialize + list_tools)
+    - tool throughput (sequential call_tool round trips of a cheap tool)
+    - end-to-end run latency of each scenario in scenarios.py, driven by the
+      scripted LLM, with the per-iteration overhead of the agent loop and the
+      mean duration of each traced phase
+
+Results are written as JSON (default: bench/results/<git commit>.json) so runs
+on different commits can be compared with bench/compare.py.
+
+Usage (from the repository root):
+    python -m bench.run_bench [--repeat 5] [--calls 200] [--llm-latency 0] [--output FILE]
+"""
+
+import argparse
+import asyncio
+import contextlib
+import io
+import json
+import os
+import platform
+import subprocess
+import sys
+import tempfile
+import time
+
+from mcp import ClientSession, StdioServerParameters
+from mcp.client.stdio import stdio_client
+
+from agent_loop import decode_tool_result, describe_tools, run_agent
+from tracing import Tracer, percentile
+from bench.fake_gmail import FakeGmailServer
+from bench.fake_llm import ScriptedLLM
+from bench.scenarios import SCENARIOS
+from planner import run_planned
+from tool_selector import select_tools
+from history_compactor import estimate_tokens
+
+REPO_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+SERVER_SCRIPT = os.path.join(REPO_ROOT, "example2-3_Gmail_2.py")
+RESULTS_DIR = os.path.join(REPO_ROOT, "bench", "results")
+
+SYSTEM_PROMPT_TEMPLATE = """You are an agent that solves problems in iterations using tools.
+
+Available tools:
+{tools_description}
+
+Respond with EXACTLY ONE line:
+FUNCTION_CALL: function_name|param1|param2|...
+or
+FINAL_ANSWER: [your answer]"""
+
+
+def summarize(samples_ms):
+    """Mean, p50, p95 and max of a list of millisecond samples"""
+    if not samples_ms:
+        return {"mean_ms": 0.0, "p50_ms": 0.0, "p95_ms": 0.0, "max_ms": 0.0}
+    return {
+        "mean_ms": round(sum(samples_ms) / len(samples_ms), 3),
+        "p50_ms": round(percentile(samples_ms, 0.50), 3),
+        "p95_ms": round(percentile(samples_ms, 0.95), 3),
+        "max_ms": round(max(samples_ms), 3),
+    }
+
+
+def git_commit():
+    """Return (short commit hash, whether the working tree has changes), or ("unknown", False)"""
+    try:
+        commit = subprocess.run(["git", "rev-parse", "--short", "HEAD"], cwd=REPO_ROOT,
+                                capture_output=True, text=True, check=True).stdout.strip()
+        status = subprocess.run(["git", "status", "--porcelain", "--untracked-files=no"], cwd=REPO_ROOT,
+                                capture_output=True, text=True, check=True).stdout.strip()
+        return commit, bool(status)
+    except (OSError, subprocess.CalledProcessError):
+        return "unknown", False
+
+
+@contextlib.asynccontextmanager
+async def server_session(server_env):
+    """Start the MCP server and yield (initialized session, tools)"""
+    params = StdioServerParameters(
+        command=sys.executable,
+        args=[SERVER_SCRIPT],
+        env={**os.environ, **server_env},
+        cwd=REPO_ROOT,
+    )
+    async with stdio_client(params) as (read, write):
+        async with ClientSession(read, write) as session:
+            await session.initialize()
+            tools = (await session.list_tools()).tools
+            yield session, tools
+
+
+@contextlib.contextmanager
+def quiet(enabled):
+    """Swallow the agent loop's progress output while measuring"""
+    if not enabled:
+        yield
+        return
+    with contextlib.redirect_stdout(io.StringIO()):
+        yield
+
+
+async def bench_startup(server_env, repeat):
+    """Time spawn + initialize + list_tools of a fresh server process"""
+    samples = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        async with server_session(server_env):
+            samples.append((time.perf_counter() - start) * 1000)
+    return {"samples_ms": [round(s, 3) for s in samples], **summarize(samples)}
+
+
+async def bench_throughput(session, calls):
+    """Sequential round trips of the cheapest tool"""
+    latencies = []
+    start = time.perf_counter()
+    for i in range(calls):
+        call_start = time.perf_counter()
+        result = await session.call_tool("add", arguments={"a": i, "b": 1})
+        latencies.append((time.perf_counter() - call_start) * 1000)
+        if decode_tool_result(result) != i + 1:
+            raise RuntimeError(f"add returned an unexpected result: {result}")
+    elapsed = time.perf_counter() - start
+    return {
+        "tool": "add",
+        "calls": calls,
+        "seconds": round(elapsed, 3),
+        "calls_per_second": round(calls / elapsed, 1),
+        **summarize(latencies),
+    }
+
+
+async def bench_scenario(session, tools, scenario, repeat, llm_latency, verbose):
+    """Run one scenario repeat times and aggregate latency and span timings"""
+    with quiet(not verbose):
+        full_prompt = SYSTEM_PROMPT_TEMPLATE.format(tools_description=describe_tools(tools))
+        catalog = select_tools(tools, scenario["query"])
+        system_prompt = SYSTEM_PROMPT_TEMPLATE.format(tools_description=describe_tools(catalog))
+    run_samples, overhead_samples, span_samples = [], [], {}
+    correct = 0
+    iterations = 0
+    failed_iterations = 0
+    output_tokens = llm_calls = 0
+    repeated_calls = 0
+    for _ in range(repeat):
+        llm = ScriptedLLM(scenario["responses"], latency=llm_latency)
+        tracer = Tracer(jsonl_path=None, otlp_endpoint=None)
+        start = time.perf_counter()
+        with quiet(not verbose):
+            if scenario.get("mode") == "plan":
+                state = await run_planned(session, tools, system_prompt, scenario["query"], llm, tracer=tracer,
+                                          catalog=catalog, terminal_tools=scenario.get("terminal_tools", ()))
+            else:
+                state = await run_agent(session, tools, system_prompt, scenario["query"], llm, tracer=tracer,
+                                        function_calling=scenario.get("function_calling", "text"), catalog=catalog,
+                                        terminal_tools=scenario.get("terminal_tools", ()))
+        run_ms = (time.perf_counter() - start) * 1000
+        llm_ms = sum(span["duration_ms"] for span in tracer.spans if span["span"] == "llm_call")
+
+        iterations = state.iteration + 1
+        failed_iterations += state.failed_iterations
+        output_tokens += state.output_tokens
+        llm_calls += state.llm_calls
+        repeated_calls += state.repeated_calls
+        run_samples.append(run_ms)
+        overhead_samples.append((run_ms - llm_ms) / iterations)
+        for row in tracer.summary():
+            if row["span"] not in ("run", "iteration"):
+                span_samples.setdefault(row["span"], []).append(row["mean_ms"])
+        if state.final_answer is not None and state.last_response == scenario["expected_result"]:
+            correct += 1
+
+    return {
+        "runs": repeat,
+        "iterations": iterations,
+        "correct_runs": correct,
+        "failed_iterations": failed_iterations,
+        "output_tokens_per_call": round(output_tokens / llm_calls, 1) if llm_calls else None,
+        "repeated_calls": repeated_calls,
+        "catalog_tools": len(catalog),
+        "system_prompt_tokens": {"all_tools": estimate_tokens(full_prompt), "selected": estimate_tokens(system_prompt)},
+        "run_ms": summarize(run_samples),
+        "per_iteration_overhead_ms": summarize(overhead_samples),
+        "span_mean_ms": {name: round(sum(values) / len(values), 3) for name, values in span_samples.items()},
+    }
+
+
+async def run_benchmarks(repeat, calls, llm_latency, scenario_names, verbose):
+    """Run the whole suite and return the results dict"""
+    commit, dirty = git_commit()
+    results = {
+        "meta": {
+            "commit": commit,
+            "dirty": dirty,
+            "timestamp": time.strftime("%Y-%m-%dT%H:%M:%S"),
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "server": os.path.basename(SERVER_SCRIPT),
+            "repeat": repeat,
+            "llm_latency_s": llm_latency,
+        },
+    }
+    with FakeGmailServer() as gmail, tempfile.TemporaryDirectory() as tmp_dir:
+        server_env = gmail.server_env(tmp_dir)
+
+        print(f"Measuring server startup ({repeat} runs)...")
+        results["server_startup"] = await bench_startup(server_env, repeat)
+
+        async with server_session(server_env) as (session, tools):
+            print(f"Measuring tool throughput ({calls} calls)...")
+            results["tool_throughput"] = await bench_throughput(session, calls)
+
+            results["scenarios"] = {}
+            for name in scenario_names:
+                print(f"Running scenario {name} ({repeat} runs)...")
+                results["scenarios"][name] = await bench_scenario(
+                    session, tools, SCENARIOS[name], repeat, llm_latency, verbose
+                )
+
+        results["fake_gmail"] = {"token_requests": gmail.token_requests, "sent_messages": gmail.sent_messages}
+    return results
+
+
+def print_results(results):
+    """Print a short human-readable summary"""
+    startup = results["server_startup"]
+    throughput = results["tool_throughput"]
+    print("\n" + "=" * 120)
+    print(f"Benchmark results for {results['meta']['commit']}{' (dirty)' if results['meta']['dirty'] else ''}")
+    print("=" * 120)
+    print(f"Server startup:   mean {startup['mean_ms']:.1f} ms, p95 {startup['p95_ms']:.1f} ms")
+    print(f"Tool throughput:  {throughput['calls_per_second']:.0f} calls/s "
+          f"(p50 {throughput['p50_ms']:.2f} ms, p95 {throughput['p95_ms']:.2f} ms)")
+    print(f"\n{'scenario':<24}{'iters':>6}{'ok':>6}{'run p50 ms':>12}{'run p95 ms':>12}{'overhead/iter ms':>18}"
+          f"{'failed':>8}{'out tok/call':>14}{'tools':>7}{'sys tokens':>12}")
+    for name, scenario in results["scenarios"].items():
+        print(f"{name:<24}{scenario['iterations']:>6}{scenario['correct_runs']:>3}/{scenario['runs']:<2}"
+              f"{scenario['run_ms']['p50_ms']:>12.2f}{scenario['run_ms']['p95_ms']:>12.2f}"
+              f"{scenario['per_iteration_overhead_ms']['mean_ms']:>18.2f}"
+              f"{scenario['failed_iterations']:>8}{scenario['output_tokens_per_call'] or 0:>14.1f}"
+              f"{scenario['catalog_tools']:>7}{scenario['system_prompt_tokens']['selected']:>6}/"
+              f"{scenario['system_prompt_tokens']['all_tools']:<5}")
+    print("=" * 120)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Offline benchmarks for the talk2mcp agent loop")
+    parser.add_argument("--repeat", type=int, default=5, help="runs per scenario and startup measurement")
+    parser.add_argument("--calls", type=int, default=200, help="tool calls for the throughput measurement")
+    parser.add_argument("--llm-latency", type=float, default=0.0, help="simulated seconds per LLM call")
+    parser.add_argument("--scenario", action="append", choices=sorted(SCENARIOS),
+                        help="scenario to run (repeatable, default: all)")
+    parser.add_argument("--output", help="result file (default: bench/results/<commit>.json)")
+    parser.add_argument("--verbose", action="store_true", help="show the agent loop's output")
+    args = parser.parse_args()
+
+    results = asyncio.run(run_benchmarks(
+        args.repeat, args.calls, args.llm_latency, args.scenario or list(SCENARIOS), args.verbose
+    ))
+    print_results(results)
+
+    output = args.output
+    if not output:
+        os.makedirs(RESULTS_DIR, exist_ok=True)
+        suffix = "-dirty" if results["meta"]["dirty"] else ""
+        output = os.path.join(RESULTS_DIR, f"{results['meta']['commit']}{suffix}.json")
+    with open(output, 'w') as f:
+        json.dump(results, f, indent=2)
+    print(f"Results written to {output}")
+
+    failed = [name for name, scenario in results["scenarios"].items() if scenario["correct_runs"] < scenario["runs"]]
+    if failed:
+        print(f"WARNING: scenarios with incorrect results: {', '.join(failed)}")
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
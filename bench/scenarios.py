@@ -0,0 +1,137 @@
+"""
+Benchmark Scenarios
+
+Each scenario is a query plus the exact responses a well-behaved LLM would
+give for it, and the value the last tool call must return for the run to count
+as correct. They run against example2-3_Gmail_2.py, which has every math tool
+and sends email over HTTP (so the fake Gmail stub can stand in for Google).
+Scenarios with "mode": "plan" run in plan-then-execute mode (planner.py),
+where the single response is the whole plan. "terminal_tools" are passed to
+the run like the clients' TERMINAL_TOOLS. Scenarios with
+"function_calling": "native" answer with structured function calls (dicts)
+instead of FUNCTION_CALL lines.
+"""
+
+SCENARIOS = {
+    # Short tool calls: measures the fixed per-iteration cost of the loop and transport
+    "arithmetic": {
+        "query": "Add 2 and 3, then multiply the result by 4.",
+        "responses": [
+            "FUNCTION_CALL: add|2|3",
+            "FUNCTION_CALL: multiply|5|4",
+            "FINAL_ANSWER: [20]",
+        ],
+        "expected_result": 20,
+    },
+    # The workflow from the clients' default query
+    "ascii_exponential_sum": {
+        "query": "Find the ASCII values of characters in INDIA and then return sum of exponentials of those values.",
+        "responses": [
+            "FUNCTION_CALL: strings_to_chars_to_int|INDIA",
+            "FUNCTION_CALL: int_list_to_exponential_sum|[73, 78, 68, 73, 65]",
+            "FINAL_ANSWER: [7.599822246093079e+33]",
+        ],
+        "expected_result": 7.599822246093079e+33,
+    },
+    # A large intermediate list passed between tools by handle
+    "large_list_handles": {
+        "query": "Sum the first 200 Fibonacci numbers.",
+        "responses": [
+            "FUNCTION_CALL: fibonacci_numbers|200",
+            "FUNCTION_CALL: add_list|{handle}",
+            "FINAL_ANSWER: [453973694165307953197296969697410619233825]",
+        ],
+        "expected_result": 453973694165307953197296969697410619233825,
+    },
+    # One evaluate call instead of several round trips
+    "evaluate": {
+        "query": "Compute (5 + 3) * 2^3.",
+        "responses": [
+            "FUNCTION_CALL: evaluate|add(5, 3) * power(2, 3)",
+            "FINAL_ANSWER: [64]",
+        ],
+        "expected_result": 64,
+    },
+    # Email delivery through the OAuth refresh and Gmail send endpoints (stubbed)
+    "send_email": {
+        "query": "Add 2 and 3 and email me the result.",
+        "responses": [
+            "FUNCTION_CALL: add|2|3",
+            "FUNCTION_CALL: send_email|bench@example.com|Benchmark result|The answer is 5",
+            "FINAL_ANSWER: [5]",
+        ],
+        "expected_result": "Email sent successfully to bench@example.com",
+    },
+    # The whole workflow as one plan: steps 1/2 and 3/4 run in parallel, the email waits for both
+    "planned_email": {
+        "mode": "plan",
+        "query": "Find the Fibonacci numbers of the length of New Delhi and the exponential sum of "
+                 "the ASCII values of INDIA, and email me both.",
+        "responses": [
+            "PLAN:\n"
+            "1. length_string|New Delhi\n"
+            "2. strings_to_chars_to_int|INDIA\n"
+            "3. fibonacci_numbers|$1\n"
+            "4. int_list_to_exponential_sum|$2\n"
+            "5. send_email|bench@example.com|Plan result|Fibonacci: $3, exponential sum: $4\n"
+            "FINAL_ANSWER: [$3]",
+        ],
+        "expected_result": "Email sent successfully to bench@example.com",
+    },
+    # The model answers the plan request with a single FUNCTION_CALL: the loop starts with it
+    "planned_single_call": {
+        "mode": "plan",
+        "query": "Add 2 and 3.",
+        "responses": [
+            "FUNCTION_CALL: add|2|3",
+            "FINAL_ANSWER: [5]",
+        ],
+        "expected_result": 5,
+    },
+    # The arithmetic scenario with structured function calls instead of FUNCTION_CALL lines
+    "arithmetic_native": {
+        "function_calling": "native",
+        "query": "Add 2 and 3, then multiply the result by 4.",
+        "responses": [
+            {"name": "add", "args": {"a": 2, "b": 3}},
+            {"name": "multiply", "args": {"a": 5, "b": 4}},
+            "FINAL_ANSWER: [20]",
+        ],
+        "expected_result": 20,
+    },
+    # "|" and commas in a parameter, which a FUNCTION_CALL line would split apart
+    "send_email_native": {
+        "function_calling": "native",
+        "query": "Sum the ASCII values of INDIA and email me the values and the sum.",
+        "responses": [
+            {"name": "strings_to_chars_to_int", "args": {"string": "INDIA"}},
+            # Gemini sends JSON numbers as floats; whole ones reach the tool as ints
+            {"name": "add_list", "args": {"l": [73.0, 78.0, 68.0, 73.0, 65.0]}},
+            {"name": "send_email", "args": {"recipient": "bench@example.com", "subject": "Sum | ASCII",
+                                            "message": "Values: 73, 78, 68, 73, 65 | sum: 357"}},
+            "FINAL_ANSWER: [357]",
+        ],
+        "expected_result": "Email sent successfully to bench@example.com",
+    },
+    # The model repeats a call: the repeat is answered from the run's memo, not the server
+    "repeated_call": {
+        "query": "Add 2 and 3, then multiply the result by 4.",
+        "responses": [
+            "FUNCTION_CALL: add|2|3",
+            "FUNCTION_CALL: add|2|3",
+            "FUNCTION_CALL: multiply|5|4",
+            "FINAL_ANSWER: [20]",
+        ],
+        "expected_result": 20,
+    },
+    # send_email is terminal: the run completes without the final LLM call
+    "send_email_terminal": {
+        "terminal_tools": ["send_email"],
+        "query": "Add 2 and 3 and email me the result.",
+        "responses": [
+            "FUNCTION_CALL: add|2|3",
+            "FUNCTION_CALL: send_email|bench@example.com|Benchmark result|The answer is 5",
+        ],
+        "expected_result": "Email sent successfully to bench@example.com",
+    },
+}
@@ -0,0 +1,203 @@
+"""
+Transport Benchmark: stdio vs Shared HTTP/SSE Server
+
+Runs the same load - concurrent clients, each calling a cheap tool in a loop -
+against example2-3_Gmail_2.py over every transport:
+
+    stdio     every client starts its own server process (what the clients do by default)
+    http      all clients share one streamable HTTP server process
+    http-Nw   all clients share a streamable HTTP server with N stateless worker processes
+    sse       all clients share one SSE server process
+
+For each transport and number of clients it reports the time until all clients
+are connected (for stdio this includes starting the server processes), the
+aggregate calls/s once they are, and the per-call latency.
+
+Usage (from the repository root):
+    python -m bench.transport [--clients 1,10,100] [--calls 50] [--workers 4] [--output FILE]
+"""
+
+import argparse
+import asyncio
+import contextlib
+import json
+import os
+import socket
+import subprocess
+import sys
+import tempfile
+import time
+
+from mcp import ClientSession
+from mcp.client.sse import sse_client
+from mcp.client.streamable_http import streamablehttp_client
+
+from agent_loop import decode_tool_result
+from bench.fake_gmail import FakeGmailServer
+from bench.micro import parse_list
+from bench.run_bench import REPO_ROOT, RESULTS_DIR, SERVER_SCRIPT, git_commit, server_session, summarize
+
+
+def free_port():
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+@contextlib.contextmanager
+def network_server(transport, workers, server_env, timeout=60.0):
+    """Start a shared http/sse server process and yield its URL once it accepts connections"""
+    port = free_port()
+    env = {**os.environ, **server_env, "MCP_PORT": str(port), "MCP_HTTP_WORKERS": str(workers)}
+    process = subprocess.Popen([sys.executable, SERVER_SCRIPT, transport], env=env, cwd=REPO_ROOT,
+                               stderr=subprocess.DEVNULL)
+    try:
+        deadline = time.monotonic() + timeout
+        while True:
+            if process.poll() is not None:
+                raise RuntimeError(f"{transport} server exited with status {process.returncode}")
+            try:
+                socket.create_connection(("127.0.0.1", port), timeout=0.5).close()
+                break
+            except OSError:
+                if time.monotonic() > deadline:
+                    raise RuntimeError(f"{transport} server did not start within {timeout:.0f}s")
+                time.sleep(0.05)
+        path = "/sse" if transport == "sse" else "/mcp"
+        yield f"http://127.0.0.1:{port}{path}"
+    finally:
+        process.terminate()
+        try:
+            process.wait(timeout=10)
+        except subprocess.TimeoutExpired:
+            process.kill()
+
+
+@contextlib.asynccontextmanager
+async def open_session(url, server_env):
+    """Yield an initialized session to the shared server at url, or to a server of its own if url is None"""
+    if url is None:
+        async with server_session(server_env) as (session, _):
+            yield session
+        return
+    if url.endswith("/sse"):
+        streams = sse_client(url)
+    else:
+        streams = streamablehttp_client(url)
+    async with streams as (read, write, *_):
+        async with ClientSession(read, write) as session:
+            await session.initialize()
+            yield session
+
+
+async def run_clients(url, server_env, clients, calls):
+    """Connect clients concurrently, then let each make calls sequential add calls
+
+    Returns:
+        dict: connect time, aggregate throughput and per-call latency
+    """
+    connected = asyncio.Barrier(clients + 1)
+    finished = asyncio.Barrier(clients + 1)
+    latencies = []
+
+    async def client(index):
+        try:
+            async with open_session(url, server_env) as session:
+                await connected.wait()
+                for i in range(calls):
+                    start = time.perf_counter()
+                    result = await session.call_tool("add", arguments={"a": index, "b": i})
+                    latencies.append((time.perf_counter() - start) * 1000)
+                    if decode_tool_result(result) != index + i:
+                        raise RuntimeError(f"add returned an unexpected result: {result}")
+                # Stay connected until every client is finished, so the server load stays constant
+                await finished.wait()
+        except Exception:
+            await connected.abort()
+            await finished.abort()
+            raise
+
+    start = time.perf_counter()
+    tasks = [asyncio.create_task(client(index)) for index in range(clients)]
+    try:
+        await connected.wait()
+        connect_ms = (time.perf_counter() - start) * 1000
+        start = time.perf_counter()
+        await finished.wait()
+        elapsed = time.perf_counter() - start
+    except asyncio.BrokenBarrierError:
+        await asyncio.gather(*tasks)  # Raises the error of the client that failed
+        raise
+    await asyncio.gather(*tasks)
+
+    return {
+        "clients": clients,
+        "calls": clients * calls,
+        "connect_ms": round(connect_ms, 1),
+        "seconds": round(elapsed, 3),
+        "calls_per_second": round(clients * calls / elapsed, 1),
+        "latency": summarize(latencies),
+    }
+
+
+async def run_transports(client_counts, calls, workers, transports):
+    """Run every transport at every client count and return the results dict"""
+    commit, dirty = git_commit()
+    results = {
+        "meta": {
+            "commit": commit,
+            "dirty": dirty,
+            "timestamp": time.strftime("%Y-%m-%dT%H:%M:%S"),
+            "server": os.path.basename(SERVER_SCRIPT),
+            "calls_per_client": calls,
+            "http_workers": workers,
+            "cpu_count": os.cpu_count(),
+        },
+        "transport": {},
+    }
+    with FakeGmailServer() as gmail, tempfile.TemporaryDirectory() as tmp_dir:
+        server_env = gmail.server_env(tmp_dir)
+        for transport in transports:
+            name, server_workers = transport, 1
+            if transport == "http-workers":
+                name, server_workers = f"http-{workers}w", workers
+            with contextlib.ExitStack() as stack:
+                url = None
+                if transport != "stdio":
+                    url = stack.enter_context(network_server(transport.split("-")[0], server_workers, server_env))
+                for clients in client_counts:
+                    row = await run_clients(url, server_env, clients, calls)
+                    key = f"{name}/clients={clients}"
+                    results["transport"][key] = row
+                    print(f"{key:<28}{row['calls_per_second']:>10.0f} calls/s"
+                          f"{row['latency']['p50_ms']:>9.2f} ms p50{row['latency']['p95_ms']:>9.2f} ms p95"
+                          f"{row['connect_ms']:>10.0f} ms to connect")
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Throughput of stdio vs a shared HTTP/SSE server")
+    parser.add_argument("--clients", type=parse_list, default=[1, 10, 100],
+                        help="comma-separated numbers of concurrent clients")
+    parser.add_argument("--calls", type=int, default=50, help="calls per client")
+    parser.add_argument("--workers", type=int, default=4, help="server processes for the http-workers run")
+    parser.add_argument("--transport", action="append", choices=["stdio", "http", "http-workers", "sse"],
+                        help="transport to run (repeatable, default: all)")
+    parser.add_argument("--output", help="result file (default: bench/results/transport-<commit>.json)")
+    args = parser.parse_args()
+
+    transports = args.transport or ["stdio", "http", "http-workers", "sse"]
+    results = asyncio.run(run_transports(args.clients, args.calls, args.workers, transports))
+
+    output = args.output
+    if not output:
+        os.makedirs(RESULTS_DIR, exist_ok=True)
+        suffix = "-dirty" if results["meta"]["dirty"] else ""
+        output = os.path.join(RESULTS_DIR, f"transport-{results['meta']['commit']}{suffix}.json")
+    with open(output, 'w') as f:
+        json.dump(results, f, indent=2)
+    print(f"Results written to {output}")
+
+
+if __name__ == "__main__":
+    main()
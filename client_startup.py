@@ -0,0 +1,321 @@
+"""
+Client Startup
+
+The clients used to start up strictly in sequence: file checks, spawning the
+server, initialize(), list_tools(), building the prompt, and only then the
+first LLM call - so the user waited for the server process to import its
+libraries before the LLM was even asked. start_client() overlaps the steps
+that do not depend on each other:
+
+- the server is spawned and its session initialized in a task of its own;
+- the LLM provider is created in a thread (for Gemini this imports and
+  configures google.generativeai) and warmed up where it can be;
+- the tool catalog is loaded from the cache of the last start, so the system
+  prompt can be built and the first LLM call made while the server is still
+  starting; tool calls wait until the session is ready;
+- the client's own checks (e.g. the OAuth files) run in threads.
+
+When the server's own tool list arrives, the cache is refreshed if it
+changed. The cache is keyed by the server script and the local modules it
+imports, so editing any of them starts without the cache. Without a cached
+catalog (first start, new or edited server) the client waits for
+list_tools() as before.
+
+A startup timeline is printed when the client closes, with the time to the
+first LLM call.
+
+Configuration (environment variables, e.g. in .env):
+    TOOL_CATALOG_CACHE  Directory of the cached tool catalogs (default: .tool_catalog_cache, empty disables)
+"""
+
+import asyncio
+import hashlib
+import json
+import logging
+import os
+import re
+import time
+from contextlib import asynccontextmanager, contextmanager
+
+from mcp import ClientSession, types
+
+from llm_client import ResilientLLM
+from llm_gateway import LLMGateway
+from llm_providers import create_provider
+from server_transport import connect_server
+
+TOOL_CATALOG_CACHE = os.getenv("TOOL_CATALOG_CACHE", ".tool_catalog_cache")
+
+# "from x import ..." (absolute) or "import x, y as z" at the start of a line
+IMPORT_LINE = re.compile(r"^[ \t]*(?:from[ \t]+([\w.]+)[ \t]+import\b|import[ \t]+([\w. \t,]+))", re.MULTILINE)
+
+# Width of the bars in the timeline
+TIMELINE_WIDTH = 30
+
+logger = logging.getLogger(__name__)
+
+
+class StartupTimeline:
+    """Start and end of every startup phase, relative to the start of the client"""
+
+    def __init__(self):
+        self._origin = time.perf_counter()
+        self.phases = []   # (name, start_ms, end_ms)
+        self.marks = {}    # name -> ms
+
+    def now(self):
+        """Milliseconds since the client started"""
+        return (time.perf_counter() - self._origin) * 1000
+
+    def add(self, name, start):
+        """Record a phase that started at start (ms) and ends now"""
+        self.phases.append((name, start, self.now()))
+
+    @contextmanager
+    def phase(self, name):
+        """Time a block of code as a startup phase"""
+        start = self.now()
+        try:
+            yield
+        finally:
+            self.add(name, start)
+
+    def mark(self, name):
+        """Record the moment of an event (the first time only)"""
+        self.marks.setdefault(name, self.now())
+        return self.marks[name]
+
+    def print(self):
+        """Print the phases as a table with bars, in order of their start"""
+        total = max([end for _, _, end in self.phases] + list(self.marks.values()) + [1.0])
+        print("\n" + "=" * 78)
+        print("Startup timeline (ms since the client started)")
+        print("=" * 78)
+        print(f"{'phase':<26}{'start':>8}{'end':>8}{'ms':>8}  timeline")
+        for name, start, end in sorted(self.phases, key=lambda phase: phase[1]):
+            left = int(TIMELINE_WIDTH * start / total)
+            width = max(1, int(TIMELINE_WIDTH * end / total) - left)
+            print(f"{name:<26}{start:>8.0f}{end:>8.0f}{end - start:>8.0f}  {' ' * left}{'#' * width}")
+        for name, at in sorted(self.marks.items(), key=lambda mark: mark[1]):
+            print(f"{name:<26}{at:>8.0f}{'':>16}  {' ' * int(TIMELINE_WIDTH * at / total)}|")
+        print("=" * 78)
+
+
+def _local_modules(script):
+    """The script and the modules next to it that it imports, directly or through each other"""
+    root = os.path.dirname(os.path.abspath(script))
+    found, pending = [], [os.path.abspath(script)]
+    while pending:
+        path = pending.pop()
+        if path in found:
+            continue
+        found.append(path)
+        try:
+            with open(path, encoding="utf-8", errors="replace") as f:
+                source = f.read()
+        except OSError:
+            continue
+        # A line scan, not ast.parse: this runs before the first LLM call
+        names = set()
+        for module, imported in IMPORT_LINE.findall(source):
+            names.update([module] if module else (name.split()[0] for name in imported.split(",") if name.strip()))
+        for name in names:
+            # Only modules of this project (next to the script); installed packages change with their version
+            base = os.path.join(root, *name.split("."))
+            for candidate in (f"{base}.py", os.path.join(base, "__init__.py")):
+                if os.path.isfile(candidate):
+                    pending.append(candidate)
+                    break
+    return sorted(found)
+
+
+def catalog_key(server_params):
+    """Cache key of a server's tool catalog
+
+    Its command, or URL, and the size and mtime of its script and of the local
+    modules the script imports, so editing a module that defines or wraps the
+    tools (e.g. expression_eval.py) invalidates the cached catalog as well.
+    """
+    url = os.getenv("MCP_SERVER_URL", "")
+    parts = [url] if url else [server_params.command, *server_params.args]
+    for arg in server_params.args if not url else ():
+        if not os.path.isfile(arg):
+            continue
+        for path in _local_modules(arg) if arg.endswith(".py") else [arg]:
+            info = os.stat(path)
+            parts.append(f"{path}:{info.st_size}:{info.st_mtime_ns}")
+    return hashlib.sha256("\0".join(parts).encode()).hexdigest()[:16]
+
+
+def load_cached_tools(key):
+    """The tools cached under key, or None"""
+    if not TOOL_CATALOG_CACHE:
+        return None
+    try:
+        with open(os.path.join(TOOL_CATALOG_CACHE, f"{key}.json"), encoding="utf-8") as f:
+            return [types.Tool.model_validate(tool) for tool in json.load(f)]
+    except (OSError, ValueError):
+        return None
+
+
+def save_cached_tools(key, tools):
+    """Cache the tools under key (best effort)"""
+    if not TOOL_CATALOG_CACHE:
+        return
+    try:
+        os.makedirs(TOOL_CATALOG_CACHE, exist_ok=True)
+        path = os.path.join(TOOL_CATALOG_CACHE, f"{key}.json")
+        with open(f"{path}.tmp", "w", encoding="utf-8") as f:
+            json.dump(_dump_tools(tools), f)
+        os.replace(f"{path}.tmp", path)  # Another client starting at the same time never reads half a file
+    except OSError as e:
+        logger.warning("Could not cache the tool catalog: %s", e)
+
+
+def _dump_tools(tools):
+    return [tool.model_dump(mode="json", exclude_none=True) for tool in tools]
+
+
+class ReadySession:
+    """Stands in for the ClientSession while the server is starting: tool calls wait until it is ready"""
+
+    def __init__(self, ready):
+        self._ready = ready
+
+    async def call_tool(self, name, arguments=None, *args, **kwargs):
+        session, _ = await self._ready
+        return await session.call_tool(name, arguments, *args, **kwargs)
+
+    async def list_tools(self):
+        session, _ = await self._ready
+        return await session.list_tools()
+
+
+class ClientStartup:
+    """What start_client() gives the client
+
+    Attributes:
+        session (ReadySession): Use like a ClientSession
+        tools (list): The tool catalog (from the cache, if it had one)
+        checks (dict): Name -> result of each check
+        llm (ResilientLLM): The LLM client, for its stats
+        gateway (LLMGateway): The LLM gateway, for its stats
+        timeline (StartupTimeline): The startup phases
+    """
+
+    def __init__(self, session, tools, checks, llm, gateway, timeline):
+        self.session = session
+        self.tools = tools
+        self.checks = checks
+        self.llm = llm
+        self.gateway = gateway
+        self.timeline = timeline
+
+    async def generate(self, prompt, declarations=None):
+        """The LLM call to pass to run_agent(); records the time to the first call"""
+        if "first_llm_call" not in self.timeline.marks:
+            at = self.timeline.mark("first_llm_call")
+            logger.info("Time to first LLM call: %.0f ms", at)
+        return await self.llm(prompt, declarations)
+
+
+async def _serve(server_params, timeline, ready, closing):
+    """Connect to the server and keep the session open until closing is set
+
+    The session is opened and closed in this one task, as the transports' task
+    groups require, while other tasks use it through the ready future.
+    """
+    try:
+        start = timeline.now()
+        async with connect_server(server_params) as (read, write):
+            timeline.add("server_spawn", start)
+            async with ClientSession(read, write) as session:
+                with timeline.phase("session_init"):
+                    await session.initialize()
+                with timeline.phase("list_tools"):
+                    tools = (await session.list_tools()).tools
+                ready.set_result((session, tools))
+                await closing.wait()
+    except BaseException as e:
+        if not ready.done():
+            ready.set_exception(e)
+        raise
+
+
+def _create_llm(timeline):
+    """Create the provider, gateway and LLM client (blocking: imports the provider's SDK)"""
+    with timeline.phase("llm_setup"):
+        provider = create_provider()
+    with timeline.phase("llm_warmup"):
+        provider.warmup()
+    gateway = LLMGateway(provider)
+    return ResilientLLM(gateway.generate), gateway
+
+
+async def _check(timeline, check):
+    with timeline.phase(check.__name__):
+        return await asyncio.to_thread(check)
+
+
+async def _refresh_cache(key, cached, ready):
+    """Compare the cached catalog with the server's and update the cache if it changed"""
+    try:
+        _, tools = await asyncio.shield(ready)
+    except Exception:
+        return  # Reported where the session is used
+    if _dump_tools(cached) != _dump_tools(tools):
+        logger.warning("The cached tool catalog was out of date; it is refreshed for the next start")
+        save_cached_tools(key, tools)
+
+
+@asynccontextmanager
+async def start_client(server_params, checks=()):
+    """Start the server session, the LLM client and the client's checks concurrently
+
+    Args:
+        server_params (StdioServerParameters): How to start the server over stdio
+            (MCP_SERVER_URL connects to a running server instead)
+        checks: Blocking callables returning True if the client can run (e.g. OAuth
+            file checks); run in threads, their results are in ClientStartup.checks
+
+    Yields:
+        ClientStartup: The session, tool catalog, LLM client and check results
+    """
+    timeline = StartupTimeline()
+    ready = asyncio.get_running_loop().create_future()
+    closing = asyncio.Event()
+    server = asyncio.create_task(_serve(server_params, timeline, ready, closing))
+    llm_setup = asyncio.create_task(asyncio.to_thread(_create_llm, timeline))
+    check_tasks = {check.__name__: asyncio.create_task(_check(timeline, check)) for check in checks}
+
+    key = catalog_key(server_params)
+    with timeline.phase("tool_cache"):
+        cached = load_cached_tools(key)
+    refresh = None
+    try:
+        results = {name: await task for name, task in check_tasks.items()}
+        if not all(results.values()):
+            tools, source = cached or [], "a check failed"  # The client stops here; no need to wait for the server
+        elif cached is None:
+            _, tools = await asyncio.shield(ready)
+            source = "from the server"
+            save_cached_tools(key, tools)
+        else:
+            tools, source = cached, "cached"
+            refresh = asyncio.create_task(_refresh_cache(key, cached, ready))
+        llm, gateway = await llm_setup
+        timeline.mark("startup_done")
+        logger.info("Started with %s tools (%s), %.0f ms", len(tools), source, timeline.marks["startup_done"])
+        client = ClientStartup(ReadySession(ready), tools, results, llm, gateway, timeline)
+        try:
+            yield client
+        finally:
+            await gateway.close()
+    finally:
+        closing.set()
+        for task in (llm_setup, *check_tasks.values()):
+            task.cancel()
+        outcome, *_ = await asyncio.gather(server, *([refresh] if refresh else []), return_exceptions=True)
+        if isinstance(outcome, Exception):
+            logger.warning("Server session ended with an error: %s", outcome)
+        timeline.print()
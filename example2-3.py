@@ -1,27 +1,45 @@
 # Import necessary libraries
 # ----- MCP Framework Imports -----
-from mcp.server.fastmcp import FastMCP, Image  # MCP framework for building AI-accessible tools
+from mcp.server.fastmcp import FastMCP, Image, Context  # MCP framework for building AI-accessible tools
 from mcp.server.fastmcp.prompts import base    # Prompt templates for the MCP framework
 from mcp.types import TextContent              # Type for text response content
 from mcp import types                          # MCP type definitions
 
 # ----- Image Processing Imports -----
-from PIL import Image as PILImage              # Python Imaging Library for image processing
+from thumbnails import make_thumbnail, thumbnail_directory  # Encoded, cached thumbnails (Pillow)
+from large_images import crop_to_file                   # Crops without decoding whole large images
 
 # ----- Utility Imports -----
 import math                                    # Math operations for calculator functions
+import json                                    # Serializing server statistics
 import sys                                     # System utilities
 import time                                    # For adding delays
+from expression_eval import evaluate_expression  # Safe AST-based formula evaluator
+from tool_workers import cpu_bound, inline_function  # Process pool for CPU-heavy tools
+from result_store import with_result_store, store_for  # Handles for large intermediate results
+from tool_metrics import instrument_tools, metrics_snapshot  # Per-tool call counts and latencies
+from agent_logging import setup_logging  # Leveled, queue-based logging (never on stdout)
+from server_transport import run_server  # stdio, or a shared HTTP/SSE server
 
 # ----- Windows Automation Imports -----
-from pywinauto.application import Application  # For automating Windows applications (MS Paint)
-import win32gui                                # Windows GUI utilities for window manipulation
-import win32con                                # Windows API constants for window states
-from win32api import GetSystemMetrics          # For getting screen dimensions
+# Only the Paint tools need these; without them (e.g. on the Linux worker boxes)
+# the math tools still work and the Paint tools report an error
+try:
+    from pywinauto.application import Application  # For automating Windows applications (MS Paint)
+    import win32gui                                # Windows GUI utilities for window manipulation
+    import win32con                                # Windows API constants for window states
+    from win32api import GetSystemMetrics          # For getting screen dimensions
+except ImportError:
+    Application = win32gui = win32con = GetSystemMetrics = None
+
+# Log to stderr through a background queue - stdout is the MCP protocol channel
+logger = setup_logging("mcp-server")
 
 # Initialize MCP server with the name "Calculator"
 # This creates the server instance that will register and expose our tools to LLMs
 mcp = FastMCP("Calculator")
+# Record call counts, errors and latencies of every tool registered below
+instrument_tools(mcp)
 
 # =============================================================================
 # MATHEMATICAL FUNCTION TOOLS
@@ -32,112 +50,115 @@ mcp = FastMCP("Calculator")
 @mcp.tool()
 def add(a: int, b: int) -> int:
     """Add two numbers"""
-    print("CALLED: add(a: int, b: int) -> int:")
+    logger.debug("CALLED: add(a: int, b: int) -> int:")
     return int(a + b)
 
 # List addition tool - sums all numbers in a list
 @mcp.tool()
+@with_result_store(lists=("l",))
 def add_list(l: list) -> int:
     """Add all numbers in a list"""
-    print("CALLED: add(l: list) -> int:")
+    logger.debug("CALLED: add(l: list) -> int:")
     return sum(l)
 
 # String length tool - returns the number of characters in a string
 @mcp.tool()
 def length_string(string: str) -> int:
     """Return the length of a string"""
-    print("CALLED: length_string(string: str) -> int:")
+    logger.debug("CALLED: length_string(string: str) -> int:")
     return len(string)
 
 # Subtraction tool - subtracts the second number from the first
 @mcp.tool()
 def subtract(a: int, b: int) -> int:
     """Subtract two numbers"""
-    print("CALLED: subtract(a: int, b: int) -> int:")
+    logger.debug("CALLED: subtract(a: int, b: int) -> int:")
     return int(a - b)
 
 # Multiplication tool - multiplies two integers
 @mcp.tool()
 def multiply(a: int, b: int) -> int:
     """Multiply two numbers"""
-    print("CALLED: multiply(a: int, b: int) -> int:")
+    logger.debug("CALLED: multiply(a: int, b: int) -> int:")
     return int(a * b)
 
 # Division tool - divides the first number by the second (returns float)
 @mcp.tool() 
 def divide(a: int, b: int) -> float:
     """Divide two numbers"""
-    print("CALLED: divide(a: int, b: int) -> float:")
+    logger.debug("CALLED: divide(a: int, b: int) -> float:")
     return float(a / b)
 
 # Power tool - raises the first number to the power of the second
 @mcp.tool()
+@cpu_bound()
 def power(a: int, b: int) -> int:
     """Power of two numbers"""
-    print("CALLED: power(a: int, b: int) -> int:")
+    logger.debug("CALLED: power(a: int, b: int) -> int:")
     return int(a ** b)
 
 # Square root tool - calculates the square root of a number
 @mcp.tool()
 def sqrt(a: int) -> float:
     """Square root of a number"""
-    print("CALLED: sqrt(a: int) -> float:")
+    logger.debug("CALLED: sqrt(a: int) -> float:")
     return float(a ** 0.5)
 
 # Cube root tool - calculates the cube root of a number
 @mcp.tool()
 def cbrt(a: int) -> float:
     """Cube root of a number"""
-    print("CALLED: cbrt(a: int) -> float:")
+    logger.debug("CALLED: cbrt(a: int) -> float:")
     return float(a ** (1/3))
 
 # Factorial tool - calculates the factorial of an integer (n!)
 @mcp.tool()
+@cpu_bound()
 def factorial(a: int) -> int:
     """factorial of a number"""
-    print("CALLED: factorial(a: int) -> int:")
+    logger.debug("CALLED: factorial(a: int) -> int:")
     return int(math.factorial(a))
 
 # Natural logarithm tool - calculates ln(a)
 @mcp.tool()
 def log(a: int) -> float:
     """log of a number"""
-    print("CALLED: log(a: int) -> float:")
+    logger.debug("CALLED: log(a: int) -> float:")
     return float(math.log(a))
 
 # Modulo tool - calculates the remainder when dividing two numbers
 @mcp.tool()
 def remainder(a: int, b: int) -> int:
     """remainder of two numbers divison"""
-    print("CALLED: remainder(a: int, b: int) -> int:")
+    logger.debug("CALLED: remainder(a: int, b: int) -> int:")
     return int(a % b)
 
 # Sine tool - calculates the sine of an angle (in radians)
 @mcp.tool()
 def sin(a: int) -> float:
     """sin of a number"""
-    print("CALLED: sin(a: int) -> float:")
+    logger.debug("CALLED: sin(a: int) -> float:")
     return float(math.sin(a))
 
 # Cosine tool - calculates the cosine of an angle (in radians)
 @mcp.tool()
 def cos(a: int) -> float:
     """cos of a number"""
-    print("CALLED: cos(a: int) -> float:")
+    logger.debug("CALLED: cos(a: int) -> float:")
     return float(math.cos(a))
 
 # Tangent tool - calculates the tangent of an angle (in radians)
 @mcp.tool()
 def tan(a: int) -> float:
     """tan of a number"""
-    print("CALLED: tan(a: int) -> float:")
+    logger.debug("CALLED: tan(a: int) -> float:")
     return float(math.tan(a))
 
 # Special mining tool - specialized function that subtracts the second number twice from the first
 @mcp.tool()
 def mine(a: int, b: int) -> int:
     """special mining tool"""
-    print("CALLED: mine(a: int, b: int) -> int:")
+    logger.debug("CALLED: mine(a: int, b: int) -> int:")
     return int(a - b - b)
 
 # =============================================================================
@@ -145,34 +166,52 @@ def mine(a: int, b: int) -> int:
 # Tools for manipulating images and processing strings
 # =============================================================================
 
-# Thumbnail generation tool - creates a 100x100 thumbnail from an image file
+# Thumbnail generation tool - creates an encoded thumbnail (cached by file contents) from an image file
 @mcp.tool()
-def create_thumbnail(image_path: str) -> Image:
-    """Create a thumbnail from an image"""
-    print("CALLED: create_thumbnail(image_path: str) -> Image:")
-    img = PILImage.open(image_path)
-    img.thumbnail((100, 100))
-    return Image(data=img.tobytes(), format="png")
+def create_thumbnail(image_path: str, size: int = 100, image_format: str = "png", quality: int = 85) -> Image:
+    """Create a thumbnail from an image (size is the longest side in pixels, image_format is png, jpeg or webp)"""
+    logger.debug("CALLED: create_thumbnail(image_path: str, size: int, image_format: str, quality: int) -> Image:")
+    data, image_format = make_thumbnail(image_path, size, image_format, quality)
+    return Image(data=data, format=image_format)
+
+# Batch thumbnail tool - creates thumbnails for every image in a directory using a thread pool
+@mcp.tool()
+def create_thumbnails(directory: str, size: int = 100, image_format: str = "png", quality: int = 85) -> dict:
+    """Create thumbnails for every image in a directory (written to <directory>/thumbnails)"""
+    logger.debug("CALLED: create_thumbnails(directory: str, size: int, image_format: str, quality: int) -> dict:")
+    return thumbnail_directory(directory, size, image_format, quality)
+
+# Crop tool - crops a region out of an image, streaming large uncompressed scans instead of decoding them in full
+@mcp.tool()
+def crop_image(image_path: str, left: int, top: int, right: int, bottom: int, output_path: str = "") -> dict:
+    """Crop a region of an image (works on very large scans) and save it as PNG; returns the output path and peak memory used"""
+    logger.debug("CALLED: crop_image(image_path: str, left: int, top: int, right: int, bottom: int, output_path: str) -> dict:")
+    return crop_to_file(image_path, (left, top, right, bottom), output_path)
 
 # String to ASCII conversion tool - converts each character to its ASCII value
 @mcp.tool()
+@with_result_store(store_output=True)
 def strings_to_chars_to_int(string: str) -> list[int]:
     """Return the ASCII values of the characters in a word"""
-    print("CALLED: strings_to_chars_to_int(string: str) -> list[int]:")
+    logger.debug("CALLED: strings_to_chars_to_int(string: str) -> list[int]:")
     return [int(ord(char)) for char in string]
 
 # Exponential sum tool - calculates sum of e^x for each number in a list
 @mcp.tool()
+@with_result_store(lists=("int_list",))
+@cpu_bound()
 def int_list_to_exponential_sum(int_list: list) -> float:
     """Return sum of exponentials of numbers in a list"""
-    print("CALLED: int_list_to_exponential_sum(int_list: list) -> float:")
+    logger.debug("CALLED: int_list_to_exponential_sum(int_list: list) -> float:")
     return sum(math.exp(i) for i in int_list)
 
 # Fibonacci sequence generator - returns the first n numbers in the Fibonacci sequence
 @mcp.tool()
-def fibonacci_numbers(n: int) -> list:
+@with_result_store(store_output=True)
+@cpu_bound()
+def fibonacci_numbers(n: int) -> list[int]:
     """Return the first n Fibonacci Numbers"""
-    print("CALLED: fibonacci_numbers(n: int) -> list:")
+    logger.debug("CALLED: fibonacci_numbers(n: int) -> list[int]:")
     if n <= 0:
         return []
     fib_sequence = [0, 1]
@@ -180,6 +219,59 @@ def fibonacci_numbers(n: int) -> list:
         fib_sequence.append(fib_sequence[-1] + fib_sequence[-2])
     return fib_sequence[:n]
 
+# =============================================================================
+# EXPRESSION EVALUATION TOOL
+# Lets the LLM compute a whole formula in a single call instead of one tool per step
+# =============================================================================
+
+# Math tools that can be called as functions inside evaluate() expressions
+MATH_FUNCTIONS = {
+    "add": add,
+    "add_list": inline_function(add_list),
+    "length_string": length_string,
+    "subtract": subtract,
+    "multiply": multiply,
+    "divide": divide,
+    "power": inline_function(power),
+    "sqrt": sqrt,
+    "cbrt": cbrt,
+    "factorial": inline_function(factorial),
+    "log": log,
+    "remainder": remainder,
+    "sin": sin,
+    "cos": cos,
+    "tan": tan,
+    "mine": mine,
+    "strings_to_chars_to_int": inline_function(strings_to_chars_to_int),
+    "int_list_to_exponential_sum": inline_function(int_list_to_exponential_sum),
+    "fibonacci_numbers": inline_function(fibonacci_numbers),
+}
+
+# Expression evaluation tool - evaluates a formula built from the math tools above
+@mcp.tool()
+@with_result_store(lists=("variables",))
+@cpu_bound()
+def evaluate(expression: str, variables: dict | None = None) -> float | int | list:
+    """Evaluate a whole formula in one call, e.g. 'mine(add(5, 3), 2) * 4' or 'n = length_string("Delhi"); fibonacci_numbers(n)'. All math tools can be used as functions and lists are written as [1, 2, 3]"""
+    logger.debug("CALLED: evaluate(expression: str, variables: dict) -> float | int | list:")
+    return evaluate_expression(expression, MATH_FUNCTIONS, variables)
+
+# Result fetch tool - returns the full list behind a result handle
+@mcp.tool()
+def get_result(handle: str, ctx: Context) -> list:
+    """Return the full list stored under a result handle such as res://3 (only needed to see every value)"""
+    logger.debug("CALLED: get_result(handle: str) -> list:")
+    return store_for(ctx).get(handle)
+
+# Server statistics tool - per-tool call counts, errors, latency percentiles and payload sizes
+@mcp.tool()
+def server_stats(ctx: Context) -> dict:
+    """Return per-tool call counts, errors, latency percentiles (p50/p95/p99) and payload sizes"""
+    logger.debug("CALLED: server_stats() -> dict:")
+    stats = metrics_snapshot()
+    stats["result_store"] = store_for(ctx).stats()
+    return stats
+
 # =============================================================================
 # PAINT APPLICATION TOOLS 
 # These tools use pywinauto to automate Microsoft Paint application
@@ -253,20 +345,14 @@ async def draw_rectangle(x1: int, y1: int, x2: int, y2: int) -> dict:
 
 # Add text tool - Adds text at a specified location in MS Paint
 @mcp.tool()
+@with_result_store(texts=("text",))
 async def add_text_in_paint(text: str) -> dict:
     """Add text in Paint"""
     global paint_app
     try:
         # Check if Paint is already open
         if not paint_app:
-            return {
-                "content": [
-                    TextContent(
-                        type="text",
-                        text="Paint is not open. Please call open_paint first."
-                    )
-                ]
-            }
+            raise RuntimeError("Paint is not open. Please call open_paint first.")
         
         # Get the Paint window reference
         paint_window = paint_app.window(class_name='MSPaintApp')
@@ -341,15 +427,8 @@ async def add_text_in_paint(text: str) -> dict:
             ]
         }
     except Exception as e:
-        # Return error message if adding text fails
-        return {
-            "content": [
-                TextContent(
-                    type="text",
-                    text=f"Error: {str(e)}"
-                )
-            ]
-        }
+        # Report the failure as a tool error (isError), so the client does not treat it as done
+        raise RuntimeError(f"Error: {str(e)}") from e
 
 # Open Paint tool - Launches Microsoft Paint application and maximizes the window
 @mcp.tool()
@@ -398,9 +477,15 @@ async def open_paint() -> dict:
 @mcp.resource("greeting://{name}")
 def get_greeting(name: str) -> str:
     """Get a personalized greeting"""
-    print("CALLED: get_greeting(name: str) -> str:")
+    logger.debug("CALLED: get_greeting(name: str) -> str:")
     return f"Hello, {name}!"
 
+# Server statistics resource - the same numbers as the server_stats tool, as JSON
+@mcp.resource("stats://server")
+def get_server_stats() -> str:
+    """Get per-tool execution metrics as JSON"""
+    return json.dumps(metrics_snapshot(), indent=2)
+
 
 # =============================================================================
 # PROMPT TEMPLATES
@@ -412,7 +497,7 @@ def get_greeting(name: str) -> str:
 @mcp.prompt()
 def review_code(code: str) -> str:
     """Prompt template for code review"""
-    print("CALLED: review_code(code: str) -> str:")
+    logger.debug("CALLED: review_code(code: str) -> str:")
     return f"Please review this code:\n\n{code}"
 
 # Error debugging prompt template - provides a structured conversation for error debugging
@@ -429,9 +514,6 @@ def debug_error(error: str) -> list[base.Message]:
 # MAIN ENTRY POINT
 # =============================================================================
 if __name__ == "__main__":
-    # Check if running with mcp dev command
-    print("STARTING")
-    if len(sys.argv) > 1 and sys.argv[1] == "dev":
-        mcp.run()  # Run without transport for dev server mode
-    else:
-        mcp.run(transport="stdio")  # Run with stdio transport for production use
+    logger.info("STARTING")
+    # Transport from the command line: stdio (default), dev, http or sse
+    run_server(mcp)
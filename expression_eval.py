@@ -0,0 +1,383 @@
+"""
+Safe Expression Evaluation
+
+This module implements the evaluator behind the `evaluate` MCP tool. Instead of
+chaining add, multiply, mine, etc. one agent iteration (and one LLM round-trip)
+at a time, the LLM can send a whole formula such as
+
+    mine(add(5, 3), 2) * power(2, 3)
+
+and get the answer back in a single tool call.
+
+Expressions are parsed with the `ast` module and only a small whitelist of node
+types is accepted (numbers, strings, list literals, indexing, arithmetic,
+variables and calls to registered functions), so nothing in the expression can reach Python
+builtins, attributes or imports. Several statements can be separated with `;`
+or new lines, and `name = expression` statements define variables that later
+statements can use. The value of the last statement is returned.
+
+Parsed and validated expressions are compiled into nested closures and cached
+by expression text, so re-evaluating the same formula (for example with
+different variables) skips parsing entirely.
+
+Evaluation runs in the server, so the size of every value is bounded before
+it is built: `**` and power() refuse results of more than MAX_RESULT_BITS
+bits (this also catches nested powers like (9 ** 9999) ** 9999), `*` and
+multiply() refuse larger products and strings or lists of more than
+MAX_SEQUENCE_LENGTH items, factorial() and fibonacci_numbers() refuse
+arguments above their limits, and the arithmetic tools and sum/min/max only
+accept numbers (so multiply("ab", 10 ** 8) or sum(lists, []) cannot build
+large values either). The result of every operation and call is checked
+against the same limits, and complex results are refused.
+"""
+
+import ast
+import math
+import operator
+from functools import lru_cache
+
+# Maximum number of compiled expressions kept in the cache
+EXPRESSION_CACHE_SIZE = 256
+
+# Largest exponent accepted by `**` and power()
+MAX_EXPONENT = 10000
+
+# Largest integer produced by an operation or call, in bits (about 30,000 digits);
+# checked before a power or product is computed, so "9 ** 9 ** 9" cannot hang the server
+MAX_RESULT_BITS = 100000
+
+# Longest string or list produced by an operation or call, e.g. by "a" * n or [0] * n
+MAX_SEQUENCE_LENGTH = 100000
+
+# Largest argument of factorial() (3000! has about 9,000 digits)
+MAX_FACTORIAL = 3000
+
+# Largest count of fibonacci_numbers() (the numbers grow by about 0.7 bits each)
+MAX_FIBONACCI = 10000
+
+# Longest expression accepted, to keep parsing cheap and bounded
+MAX_EXPRESSION_LENGTH = 2000
+
+# Functions and constants that are always available in expressions,
+# in addition to the math tools registered by the server
+SAFE_BUILTINS = {
+    "abs": abs,
+    "min": min,
+    "max": max,
+    "sum": sum,
+    "len": len,
+    "round": round,
+    "int": int,
+    "float": float,
+}
+CONSTANTS = {
+    "pi": math.pi,
+    "e": math.e,
+}
+
+BINARY_OPERATORS = {
+    ast.Add: operator.add,
+    ast.Sub: operator.sub,
+    ast.Mult: operator.mul,
+    ast.Div: operator.truediv,
+    ast.FloorDiv: operator.floordiv,
+    ast.Mod: operator.mod,
+    ast.Pow: operator.pow,
+}
+
+UNARY_OPERATORS = {
+    ast.UAdd: operator.pos,
+    ast.USub: operator.neg,
+}
+
+
+class ExpressionError(ValueError):
+    """Raised when an expression is invalid or uses something that is not allowed"""
+
+
+def _is_int(value):
+    return isinstance(value, int) and not isinstance(value, bool)
+
+
+def _is_number(value):
+    return isinstance(value, (int, float)) and not isinstance(value, bool)
+
+
+def _size(value, limit=MAX_SEQUENCE_LENGTH):
+    """Items in a string or (nested) list, counted up to just past limit
+
+    Counting stops as soon as limit is passed, so a list holding the same
+    large list many times is measured without walking all of it.
+    """
+    if isinstance(value, str):
+        return len(value)
+    if not isinstance(value, list):
+        return 0
+    total = 0
+    pending = [value]
+    while pending and total <= limit:
+        items = pending.pop()
+        total += len(items)
+        pending.extend(item for item in items if isinstance(item, list))
+        total += sum(len(item) for item in items if isinstance(item, str))
+    return total
+
+
+def _check_numbers(*args):
+    """Refuse anything but int and float arguments (arithmetic tools)"""
+    if not all(_is_number(arg) for arg in args):
+        raise ExpressionError("This function only accepts numbers")
+
+
+def _check_number_list(*args):
+    """Refuse anything but numbers, or a single list of numbers (sum, min, max, add_list, ...)"""
+    values = args[0] if len(args) == 1 and isinstance(args[0], list) else args
+    _check_numbers(*values)
+
+
+def _check_power(base, exponent):
+    """Refuse a power whose exponent or result is too large, before computing it"""
+    if isinstance(exponent, (int, float)) and abs(exponent) > MAX_EXPONENT:
+        raise ExpressionError(f"The exponent is too large (limit is {MAX_EXPONENT})")
+    # An integer power has at least exponent * (bits(base) - 1) bits; floats overflow on their own
+    if _is_int(base) and _is_int(exponent) and exponent > 0:
+        if exponent * (abs(base).bit_length() - 1) > MAX_RESULT_BITS:
+            raise ExpressionError(f"The power is too large (limit is {MAX_RESULT_BITS} bits)")
+
+
+def _check_multiply(left, right):
+    """Refuse a product or repeated sequence larger than the limits, before computing it"""
+    for sequence, count in ((left, right), (right, left)):
+        if isinstance(sequence, (str, list)) and _is_int(count) and _size(sequence) * count > MAX_SEQUENCE_LENGTH:
+            raise ExpressionError("Repeating the sequence makes it too long "
+                                  f"(limit is {MAX_SEQUENCE_LENGTH} items)")
+    if _is_int(left) and _is_int(right) and left.bit_length() + right.bit_length() > MAX_RESULT_BITS + 1:
+        raise ExpressionError(f"The product is too large (limit is {MAX_RESULT_BITS} bits)")
+
+
+def _check_power_tool(base, exponent):
+    _check_numbers(base, exponent)
+    _check_power(base, exponent)
+
+
+def _check_multiply_tool(left, right):
+    _check_numbers(left, right)
+    _check_multiply(left, right)
+
+
+def _check_factorial(n):
+    _check_numbers(n)
+    if n > MAX_FACTORIAL:
+        raise ExpressionError(f"The factorial argument is too large (limit is {MAX_FACTORIAL})")
+
+
+def _check_fibonacci(n):
+    _check_numbers(n)
+    if n > MAX_FIBONACCI:
+        raise ExpressionError(f"The fibonacci_numbers count is too large (limit is {MAX_FIBONACCI})")
+
+
+# Argument checks, run before the function is called, of the server's math tools
+# and the builtins; a function without an entry accepts any value (len, int, ...)
+ARGUMENT_CHECKS = {
+    "add": _check_numbers,
+    "subtract": _check_numbers,
+    "multiply": _check_multiply_tool,
+    "divide": _check_numbers,
+    "power": _check_power_tool,
+    "sqrt": _check_numbers,
+    "cbrt": _check_numbers,
+    "factorial": _check_factorial,
+    "log": _check_numbers,
+    "remainder": _check_numbers,
+    "sin": _check_numbers,
+    "cos": _check_numbers,
+    "tan": _check_numbers,
+    "mine": _check_numbers,
+    "fibonacci_numbers": _check_fibonacci,
+    "add_list": _check_number_list,
+    "int_list_to_exponential_sum": _check_number_list,
+    "abs": _check_numbers,
+    "round": _check_numbers,
+    "sum": _check_number_list,
+    "min": _check_number_list,
+    "max": _check_number_list,
+}
+
+
+def _check_result(value):
+    """Return value, or raise ExpressionError if it is larger than the limits or not serializable"""
+    if isinstance(value, complex):
+        raise ExpressionError("The result is a complex number (e.g. a fractional power of a negative number)")
+    if _is_int(value) and value.bit_length() > MAX_RESULT_BITS:
+        raise ExpressionError(f"The result is too large (limit is {MAX_RESULT_BITS} bits)")
+    if _size(value) > MAX_SEQUENCE_LENGTH:
+        raise ExpressionError(f"The result is too long (limit is {MAX_SEQUENCE_LENGTH} items)")
+    return value
+
+
+def _checked_power(base, exponent):
+    """Raise base to exponent, refusing powers large enough to stall the server"""
+    _check_power(base, exponent)
+    return base ** exponent
+
+
+def _checked_multiply(left, right):
+    """Multiply, refusing products and repeated sequences larger than the limits"""
+    _check_multiply(left, right)
+    return left * right
+
+
+def _compile_node(node):
+    """Compile one AST node into a closure that takes (env, functions)
+
+    Args:
+        node: The AST node to compile
+
+    Returns:
+        A callable evaluating the node against a variable environment and function table
+    """
+    if isinstance(node, ast.Constant):
+        if isinstance(node.value, bool) or not isinstance(node.value, (int, float, str)):
+            raise ExpressionError(f"Unsupported constant: {node.value!r}")
+        value = node.value
+        return lambda env, functions: value
+
+    if isinstance(node, ast.Name):
+        name = node.id
+
+        def load_name(env, functions):
+            if name in env:
+                return env[name]
+            if name in CONSTANTS:
+                return CONSTANTS[name]
+            raise ExpressionError(f"Unknown variable: {name}")
+        return load_name
+
+    if isinstance(node, (ast.List, ast.Tuple)):
+        items = [_compile_node(item) for item in node.elts]
+        return lambda env, functions: [item(env, functions) for item in items]
+
+    if isinstance(node, ast.UnaryOp):
+        op = UNARY_OPERATORS.get(type(node.op))
+        if op is None:
+            raise ExpressionError(f"Unsupported operator: {type(node.op).__name__}")
+        operand = _compile_node(node.operand)
+        return lambda env, functions: op(operand(env, functions))
+
+    if isinstance(node, ast.BinOp):
+        op = BINARY_OPERATORS.get(type(node.op))
+        if op is None:
+            raise ExpressionError(f"Unsupported operator: {type(node.op).__name__}")
+        if op is operator.pow:
+            op = _checked_power
+        elif op is operator.mul:
+            op = _checked_multiply
+        left = _compile_node(node.left)
+        right = _compile_node(node.right)
+        return lambda env, functions: _check_result(op(left(env, functions), right(env, functions)))
+
+    if isinstance(node, ast.Subscript):
+        if isinstance(node.slice, ast.Slice):
+            raise ExpressionError("Slices are not supported, use a single index like x[0]")
+        value = _compile_node(node.value)
+        index = _compile_node(node.slice)
+        return lambda env, functions: value(env, functions)[index(env, functions)]
+
+    if isinstance(node, ast.Call):
+        if not isinstance(node.func, ast.Name):
+            raise ExpressionError("Only direct calls like add(1, 2) are allowed")
+        if node.keywords:
+            raise ExpressionError("Keyword arguments are not supported")
+        if any(isinstance(arg, ast.Starred) for arg in node.args):
+            raise ExpressionError("Star arguments are not supported")
+        name = node.func.id
+        args = [_compile_node(arg) for arg in node.args]
+        check = ARGUMENT_CHECKS.get(name)
+
+        def call(env, functions):
+            func = functions.get(name) or SAFE_BUILTINS.get(name)
+            if func is None:
+                raise ExpressionError(f"Unknown function: {name}")
+            values = [arg(env, functions) for arg in args]
+            if check is not None:
+                try:
+                    check(*values)
+                except TypeError:  # Wrong number of arguments; reported by the call below
+                    pass
+            return _check_result(func(*values))
+        return call
+
+    raise ExpressionError(f"Unsupported syntax: {type(node).__name__}")
+
+
+@lru_cache(maxsize=EXPRESSION_CACHE_SIZE)
+def compile_expression(expression):
+    """Parse, validate and compile an expression (cached by expression text)
+
+    Args:
+        expression (str): One or more statements separated by ';' or new lines
+
+    Returns:
+        A callable taking (variables, functions) and returning the value of the last statement
+
+    Raises:
+        ExpressionError: If the expression is empty, too long or uses unsupported syntax
+    """
+    if len(expression) > MAX_EXPRESSION_LENGTH:
+        raise ExpressionError(f"Expression is longer than {MAX_EXPRESSION_LENGTH} characters")
+    try:
+        tree = ast.parse(expression.strip(), mode="exec")
+    except SyntaxError as e:
+        raise ExpressionError(f"Invalid expression: {e.msg}") from None
+    if not tree.body:
+        raise ExpressionError("Expression is empty")
+
+    steps = []
+    for statement in tree.body:
+        if isinstance(statement, ast.Assign):
+            if len(statement.targets) != 1 or not isinstance(statement.targets[0], ast.Name):
+                raise ExpressionError("Only simple assignments like x = 1 + 2 are allowed")
+            steps.append((statement.targets[0].id, _compile_node(statement.value)))
+        elif isinstance(statement, ast.Expr):
+            steps.append((None, _compile_node(statement.value)))
+        else:
+            raise ExpressionError(f"Unsupported statement: {type(statement).__name__}")
+
+    def run(variables, functions):
+        env = dict(variables)
+        value = None
+        for target, step in steps:
+            value = step(env, functions)
+            if target is not None:
+                env[target] = value
+        return value
+    return run
+
+
+def evaluate_expression(expression, functions, variables=None):
+    """Evaluate an expression using the given function table
+
+    Args:
+        expression (str): The expression to evaluate, e.g. "n = add(2, 3); fibonacci_numbers(n)"
+        functions (dict): Mapping of function names usable in the expression (the server's math tools)
+        variables (dict): Optional initial variable values
+
+    Returns:
+        The value of the last statement (number, string or list)
+
+    Raises:
+        ExpressionError: If the expression is invalid or evaluation fails
+    """
+    compiled = compile_expression(expression)
+    try:
+        return compiled(variables or {}, functions)
+    except ExpressionError:
+        raise
+    except (ArithmeticError, IndexError, TypeError, ValueError) as e:
+        raise ExpressionError(f"Error evaluating expression: {e}") from e
+
+
+def cache_info():
+    """Return hit/miss statistics for the compiled-expression cache"""
+    return compile_expression.cache_info()
@@ -0,0 +1,152 @@
+"""
+History Compaction
+
+Keeps the history part of the agent loop's prompt under a token budget, so
+runs with many iterations do not send ever-growing prompts to the LLM.
+
+Every iteration is recorded in three forms:
+    full     the verbatim line ("In the 3 iteration you called ... and the function returned ...")
+    summary  the same call with long arguments and results shortened: lists show
+             their length, first and last items and the handle ($r3) that still
+             passes the whole list to a tool; long text is cut
+    elided   just which tool was called ("Iteration 3: called fibonacci_numbers.")
+
+The last HISTORY_KEEP_RECENT iterations are sent in full and older ones as
+summaries. If that is still over HISTORY_TOKEN_BUDGET, older summaries are
+elided (oldest first), then the recent iterations are summarized and elided
+(oldest first, the latest one stays in full), and as a last resort the oldest
+iterations are left out altogether.
+
+Tokens are estimated as characters / 4, which is close enough for English
+text and JSON and needs no tokenizer.
+
+Configuration (environment variables, e.g. in .env):
+    HISTORY_TOKEN_BUDGET  Estimated tokens the history may use in a prompt (default: 1000)
+    HISTORY_KEEP_RECENT   Iterations kept verbatim when the budget allows (default: 3)
+"""
+
+import json
+import os
+from dataclasses import dataclass
+
+HISTORY_TOKEN_BUDGET = int(os.getenv("HISTORY_TOKEN_BUDGET", "1000"))
+HISTORY_KEEP_RECENT = int(os.getenv("HISTORY_KEEP_RECENT", "3"))
+
+# Rough characters per token of English text and JSON
+CHARS_PER_TOKEN = 4
+
+# Items shown at each end of a list in a summary; longer lists are shortened
+SUMMARY_LIST_ITEMS = 3
+
+# Longest argument or result text kept in a summary
+SUMMARY_TEXT_CHARS = 60
+
+
+def estimate_tokens(text):
+    """Estimated number of tokens of a text"""
+    return (len(text) + CHARS_PER_TOKEN - 1) // CHARS_PER_TOKEN
+
+
+@dataclass
+class HistoryEntry:
+    """One iteration of the history in its full, summarized and elided forms"""
+    full: str
+    summary: str
+    elided: str
+
+
+def brief(value, handle=None):
+    """Short description of an argument or result value
+
+    Args:
+        value: The native value
+        handle (str): Handle under which a long list is stored, shown so the
+            LLM can still pass the whole list on
+
+    Returns:
+        str: The value itself if it is short, otherwise a shortened description
+    """
+    if isinstance(value, dict) and str(value.get('handle', '')).startswith("res://"):
+        return f"a list of {value.get('length')} values stored on the server as {value['handle']}"
+    if isinstance(value, list) and len(value) > 2 * SUMMARY_LIST_ITEMS:
+        head = json.dumps(value[:SUMMARY_LIST_ITEMS])[:-1]
+        tail = json.dumps(value[-SUMMARY_LIST_ITEMS:])[1:]
+        text = f"a list of {len(value)} values ({head}, ..., {tail})"
+        return f"{text} stored as {handle}" if handle else text
+    text = json.dumps(value) if isinstance(value, (list, dict)) else str(value)
+    if len(text) <= SUMMARY_TEXT_CHARS:
+        return text
+    return f"{text[:SUMMARY_TEXT_CHARS - 3]}..."
+
+
+def tool_call_entry(iteration, func_name, full, arguments, value, handle=None):
+    """Build the history entry of one tool call
+
+    Args:
+        iteration (int): The iteration number
+        func_name (str): The tool that was called
+        full (str): The verbatim history line
+        arguments (dict): The arguments the tool was called with
+        value: The native result value
+        handle (str): Handle of the result, if it is a stored list
+
+    Returns:
+        HistoryEntry: The entry in all three forms
+    """
+    shown = ", ".join(f"{name}={brief(argument)}" for name, argument in arguments.items())
+    summary = f"In the {iteration} iteration you called {func_name}({shown}), which returned {brief(value, handle)}."
+    if len(summary) >= len(full):
+        summary = full
+    return HistoryEntry(full=full, summary=summary, elided=f"Iteration {iteration}: called {func_name}.")
+
+
+def compact_history(entries, budget=HISTORY_TOKEN_BUDGET, keep_recent=HISTORY_KEEP_RECENT):
+    """Join the history entries into prompt text that fits the token budget
+
+    Args:
+        entries (list): HistoryEntry objects, oldest first
+        budget (int): Estimated tokens the text may use
+        keep_recent (int): Iterations kept verbatim when the budget allows
+
+    Returns:
+        tuple: (history text, estimated tokens of the full history, estimated tokens of the text)
+    """
+    count = len(entries)
+    first_recent = max(0, count - keep_recent)
+    forms = [entry.full if i >= first_recent else entry.summary for i, entry in enumerate(entries)]
+    # +1 per entry for the separating space
+    sizes = [estimate_tokens(form) + 1 for form in forms]
+    full_tokens = sum(estimate_tokens(entry.full) + 1 for entry in entries)
+    total = sum(sizes)
+
+    def use(i, form):
+        nonlocal total
+        size = estimate_tokens(form) + 1
+        total += size - sizes[i]
+        forms[i], sizes[i] = form, size
+
+    # Elide old summaries, then summarize and elide the recent iterations (never the latest)
+    for i in range(first_recent):
+        if total <= budget:
+            break
+        use(i, entries[i].elided)
+    for i in range(first_recent, count - 1):
+        if total <= budget:
+            break
+        use(i, entries[i].summary)
+    for i in range(first_recent, count - 1):
+        if total <= budget:
+            break
+        use(i, entries[i].elided)
+
+    # Still too long: leave out the oldest iterations, behind a note saying so
+    dropped = 0
+    note = ""
+    while total + (estimate_tokens(note) + 1 if note else 0) > budget and dropped < count - 1:
+        total -= sizes[dropped]
+        dropped += 1
+        note = f"({dropped} earlier iterations omitted.)"
+    if dropped:
+        forms = [note] + forms[dropped:]
+        total += estimate_tokens(note) + 1
+    return " ".join(forms), full_tokens, total
@@ -0,0 +1,527 @@
+"""
+Job Queue
+
+A durable queue of agent runs in a local SQLite database (WAL mode), worked
+off by several worker processes. Every worker process holds its own MCP
+server session, LLM gateway and checkpoint connection and runs up to
+--concurrency jobs at once, so the runs spread over all cores instead of one
+asyncio process. Workers on other hosts can share the queue through a
+network file system later; nothing in it is tied to one process.
+
+Jobs are leased, not popped:
+
+- a worker leases the oldest ready job for JOB_LEASE_SECONDS (the visibility
+  timeout) and keeps extending the lease while the run is going;
+- if the worker dies, the lease runs out and another worker takes the job,
+  which resumes from its run checkpoint (see run_checkpoint.py);
+- a run that fails (it raised, or stopped early because the LLM or a tool
+  failed) is retried after an exponential backoff, continuing from its
+  checkpoint, up to JOB_MAX_ATTEMPTS attempts; then the job is marked failed;
+- completing or failing a job only counts while the worker still holds its
+  lease, so a worker whose lease ran out cannot overwrite the new owner's result;
+  a run whose lease is lost is stopped, so it does not repeat the new owner's
+  tool calls.
+
+Commands:
+    python job_queue.py enqueue queries.jsonl        # same input format as main.py; ids already queued are ignored
+    python job_queue.py work --workers 4             # until the queue is drained (--forever to keep polling)
+    python job_queue.py dashboard                    # throughput, per-worker progress and ETA (--once for one report)
+    python job_queue.py results -o results.jsonl     # finished jobs as main.py result lines
+
+The LLM rate limits (LLM_RPM, LLM_TPM) are for the whole job: each of the
+worker processes gets an equal share.
+
+Configuration (environment variables, e.g. in .env):
+    JOB_QUEUE_DB         SQLite file of the queue (default: agent_jobs.db)
+    JOB_WORKERS          Worker processes started by "work" (default: the number of CPUs)
+    JOB_LEASE_SECONDS    Visibility timeout of a leased job (default: 120)
+    JOB_MAX_ATTEMPTS     Runs of a job before it is marked failed (default: 3)
+    JOB_RETRY_BACKOFF    Seconds before the first retry, doubled for every further one (default: 5)
+    JOB_POLL_SECONDS     Wait between polls when no job is ready (default: 1)
+"""
+
+# Import necessary libraries
+import argparse
+import os
+from dotenv import load_dotenv
+# Load environment variables from .env file before the local modules below read
+# their settings from the environment
+load_dotenv()
+import asyncio
+import json
+import multiprocessing
+import socket
+import sqlite3
+import sys
+import time
+from dataclasses import dataclass
+
+from agent_logging import setup_logging
+
+JOB_QUEUE_DB = os.getenv("JOB_QUEUE_DB", "agent_jobs.db")
+JOB_WORKERS = int(os.getenv("JOB_WORKERS", "0")) or os.cpu_count() or 1
+JOB_LEASE_SECONDS = float(os.getenv("JOB_LEASE_SECONDS", "120"))
+JOB_MAX_ATTEMPTS = int(os.getenv("JOB_MAX_ATTEMPTS", "3"))
+JOB_RETRY_BACKOFF = float(os.getenv("JOB_RETRY_BACKOFF", "5"))
+JOB_POLL_SECONDS = float(os.getenv("JOB_POLL_SECONDS", "1"))
+
+# Longest wait before a retry, however many attempts a job has had
+RETRY_BACKOFF_CAP = 300
+
+# Run statuses (see main.py) that are retried; "interrupted" runs resume from their checkpoint
+RETRY_STATUSES = ("error", "interrupted")
+
+# Window of the dashboard's current throughput
+THROUGHPUT_WINDOW = 60
+
+# Jobs inserted per transaction by enqueue
+ENQUEUE_CHUNK = 1000
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS jobs (
+    job_id INTEGER PRIMARY KEY,
+    job_key TEXT NOT NULL UNIQUE,
+    query TEXT NOT NULL,
+    status TEXT NOT NULL,
+    attempts INTEGER NOT NULL DEFAULT 0,
+    available REAL NOT NULL,
+    lease_owner TEXT,
+    lease_expires REAL,
+    result TEXT,
+    error TEXT,
+    created REAL NOT NULL,
+    started REAL,
+    finished REAL
+);
+CREATE INDEX IF NOT EXISTS jobs_ready ON jobs (status, available);
+CREATE INDEX IF NOT EXISTS jobs_finished ON jobs (status, finished);
+"""
+
+logger = setup_logging("job-queue")
+
+
+@dataclass
+class Job:
+    """A leased job
+
+    Attributes:
+        job_id (int): Row id in the queue
+        key (str): JSON of the query's id (unique in the queue)
+        query (str): The query to run
+        attempts (int): Runs of the job so far, including this one
+    """
+    job_id: int
+    key: str
+    query: str
+    attempts: int
+
+
+class JobQueue:
+    """SQLite-backed queue of agent runs with leases, retries and visibility timeouts
+
+    Every operation is one short transaction, so any number of worker processes
+    can share the database.
+    """
+
+    def __init__(self, path=JOB_QUEUE_DB, lease_seconds=JOB_LEASE_SECONDS, max_attempts=JOB_MAX_ATTEMPTS,
+                 retry_backoff=JOB_RETRY_BACKOFF):
+        self.path = path
+        self.lease_seconds = lease_seconds
+        self.max_attempts = max_attempts
+        self.retry_backoff = retry_backoff
+        # Autocommit mode: transactions are opened explicitly with BEGIN IMMEDIATE, so
+        # two workers can never lease the same job; busy writers wait up to 30s
+        self._db = sqlite3.connect(path, timeout=30, isolation_level=None)
+        self._db.execute("PRAGMA journal_mode=WAL")
+        self._db.execute("PRAGMA synchronous=NORMAL")
+        self._db.executescript(SCHEMA)
+
+    def _transaction(self):
+        self._db.execute("BEGIN IMMEDIATE")
+        return self._db
+
+    def _commit(self):
+        self._db.execute("COMMIT")
+
+    def enqueue(self, items):
+        """Add jobs; ids that are already in the queue are left alone
+
+        Args:
+            items: (id, query) pairs, e.g. from main.parse_query()
+
+        Returns:
+            int: Jobs added
+        """
+        added = 0
+        chunk = []
+        for run_id, query in items:
+            chunk.append((json.dumps(run_id), query))
+            if len(chunk) >= ENQUEUE_CHUNK:
+                added += self._insert(chunk)
+                chunk = []
+        if chunk:
+            added += self._insert(chunk)
+        return added
+
+    def _insert(self, chunk):
+        now = time.time()
+        db = self._transaction()
+        before = db.total_changes
+        db.executemany(
+            "INSERT OR IGNORE INTO jobs (job_key, query, status, available, created) VALUES (?, ?, 'queued', ?, ?)",
+            [(key, query, now, now) for key, query in chunk],
+        )
+        added = db.total_changes - before
+        self._commit()
+        return added
+
+    def lease(self, owner):
+        """Lease the oldest ready job: queued and past its retry backoff, or leased by a worker that went silent
+
+        Args:
+            owner (str): The leasing worker
+
+        Returns:
+            Job: The leased job, or None if no job is ready
+        """
+        now = time.time()
+        db = self._transaction()
+        try:
+            # Abandoned jobs that used up their attempts fail instead of being leased again
+            db.execute(
+                "UPDATE jobs SET status = 'failed', error = 'Lease expired on the last attempt', finished = ? "
+                "WHERE status = 'leased' AND lease_expires < ? AND attempts >= ?",
+                (now, now, self.max_attempts),
+            )
+            row = db.execute(
+                "SELECT job_id, job_key, query, attempts FROM jobs "
+                "WHERE (status = 'queued' AND available <= ?) OR (status = 'leased' AND lease_expires < ?) "
+                "ORDER BY job_id LIMIT 1", (now, now)
+            ).fetchone()
+            if row is not None:
+                db.execute(
+                    "UPDATE jobs SET status = 'leased', attempts = attempts + 1, lease_owner = ?, "
+                    "lease_expires = ?, started = ? WHERE job_id = ?",
+                    (owner, now + self.lease_seconds, now, row[0]),
+                )
+        except BaseException:
+            db.execute("ROLLBACK")
+            raise
+        self._commit()
+        if row is None:
+            return None
+        if row[3]:
+            logger.info("Job %s: attempt %s", row[1], row[3] + 1)
+        return Job(job_id=row[0], key=row[1], query=row[2], attempts=row[3] + 1)
+
+    def _update_leased(self, sql, parameters, job, owner):
+        """Run an update of a job that only applies while owner holds its lease"""
+        db = self._transaction()
+        changed = db.execute(f"{sql} WHERE job_id = ? AND status = 'leased' AND lease_owner = ?",
+                             (*parameters, job.job_id, owner)).rowcount
+        self._commit()
+        if not changed:
+            logger.warning("Job %s: lease lost to another worker, update dropped", job.key)
+        return bool(changed)
+
+    def extend(self, job, owner):
+        """Push the lease of a running job out by another lease period"""
+        return self._update_leased("UPDATE jobs SET lease_expires = ?", (time.time() + self.lease_seconds,),
+                                   job, owner)
+
+    def complete(self, job, owner, result):
+        """Mark a job done with its result record"""
+        return self._update_leased("UPDATE jobs SET status = 'done', result = ?, error = NULL, finished = ?",
+                                   (json.dumps(result, default=str), time.time()), job, owner)
+
+    def fail(self, job, owner, error, result=None):
+        """Queue a failed job for a retry after a backoff, or mark it failed after its last attempt"""
+        now = time.time()
+        if job.attempts >= self.max_attempts:
+            return self._update_leased(
+                "UPDATE jobs SET status = 'failed', result = ?, error = ?, finished = ?",
+                (json.dumps(result, default=str) if result else None, error, now), job, owner)
+        delay = min(self.retry_backoff * 2 ** (job.attempts - 1), RETRY_BACKOFF_CAP)
+        logger.info("Job %s failed (%s), retrying in %.0fs", job.key, error, delay)
+        return self._update_leased(
+            "UPDATE jobs SET status = 'queued', error = ?, available = ?, lease_owner = NULL, lease_expires = NULL",
+            (error, now + delay), job, owner)
+
+    def pending(self):
+        """Jobs that are queued or leased"""
+        return self._db.execute("SELECT COUNT(*) FROM jobs WHERE status IN ('queued', 'leased')").fetchone()[0]
+
+    def results(self):
+        """The result records of finished jobs, in queue order"""
+        for status, key, query, result, error in self._db.execute(
+                "SELECT status, job_key, query, result, error FROM jobs WHERE status IN ('done', 'failed') "
+                "ORDER BY job_id"):
+            record = (json.loads(result) if result else None) or {"id": json.loads(key), "query": query,
+                                                                  "status": "error"}
+            if status == "failed":
+                record["error"] = error
+            yield record
+
+    def stats(self, window=THROUGHPUT_WINDOW):
+        """Queue counts, throughput and per-worker progress, for the dashboard"""
+        now = time.time()
+        counts = dict(self._db.execute("SELECT status, COUNT(*) FROM jobs GROUP BY status").fetchall())
+        first_started, last_finished, mean_run = self._db.execute(
+            "SELECT MIN(started), MAX(finished), AVG(finished - started) FROM jobs WHERE status = 'done'"
+        ).fetchone()
+        recent = self._db.execute(
+            "SELECT COUNT(*) FROM jobs WHERE status = 'done' AND finished >= ?", (now - window,)
+        ).fetchone()[0]
+        workers = {}
+        for owner, status, count in self._db.execute(
+                "SELECT lease_owner, status, COUNT(*) FROM jobs WHERE lease_owner IS NOT NULL "
+                "AND (status = 'leased' OR finished >= ?) GROUP BY lease_owner, status", (now - window,)):
+            workers.setdefault(owner, {"leased": 0, "done": 0, "failed": 0})[status] = count
+        elapsed = (last_finished - first_started) if first_started and last_finished else 0.0
+        done = counts.get("done", 0)
+        recent_rate = recent / window
+        remaining = counts.get("queued", 0) + counts.get("leased", 0)
+        return {
+            "counts": {status: counts.get(status, 0) for status in ("queued", "leased", "done", "failed")},
+            "overall_per_s": done / elapsed if elapsed else 0.0,
+            "recent_per_s": recent_rate,
+            "mean_run_s": mean_run or 0.0,
+            "eta_s": remaining / recent_rate if recent_rate else None,
+            "workers": workers,
+        }
+
+    def close(self):
+        self._db.close()
+
+
+def worker_name(index):
+    """A worker name that is unique across hosts and processes"""
+    return f"{socket.gethostname()}-{os.getpid()}-{index}"
+
+
+async def run_worker(queue_path, index, workers, concurrency, server, max_iterations, forever=False,
+                     provider=None):
+    """Work off jobs in this process until the queue is drained (or forever)
+
+    Args:
+        queue_path (str): The queue database
+        index (int): Number of this worker, for its name
+        workers (int): Worker processes sharing the LLM rate limits
+        concurrency (int): Jobs run at once in this process
+        server (str): MCP server script started over stdio
+        max_iterations (int): Iterations per run
+        forever (bool): Keep polling when the queue is empty
+        provider (LLMProvider): LLM backend (default: create_provider())
+    """
+    # Imported here: the dashboard and enqueue commands need none of the agent modules
+    from mcp import ClientSession, StdioServerParameters
+    from llm_client import ResilientLLM
+    from llm_gateway import LLM_RPM, LLM_TPM, LLMGateway
+    from llm_providers import create_provider
+    from main import BatchRunner
+    from run_checkpoint import AGENT_CHECKPOINT_DB, CheckpointStore
+    from server_transport import connect_server
+
+    name = worker_name(index)
+    queue = JobQueue(queue_path)
+    provider = provider or create_provider()
+    # This process's share of the job's rate limits
+    rpm = provider.requests_per_minute if LLM_RPM is None else LLM_RPM
+    gateway = LLMGateway(provider, requests_per_minute=rpm / workers, tokens_per_minute=LLM_TPM / workers)
+    llm = ResilientLLM(gateway.generate)
+    store = CheckpointStore(AGENT_CHECKPOINT_DB) if AGENT_CHECKPOINT_DB else None
+    completed = 0
+
+    async def keep_leased(job, run):
+        # Extend the lease well before it runs out, so a long run keeps its job.
+        # Once the lease is lost the job belongs to another worker: stop the run
+        # instead of repeating its tool calls next to the new owner's
+        while True:
+            await asyncio.sleep(queue.lease_seconds / 3)
+            if not queue.extend(job, name):
+                logger.warning("Worker %s lost the lease of job %s; stopping its run", name, job.key)
+                run.cancel()
+                return
+
+    async def slot(runner):
+        nonlocal completed
+        while True:
+            job = queue.lease(name)
+            if job is None:
+                if not forever and not queue.pending():
+                    return
+                await asyncio.sleep(JOB_POLL_SECONDS)
+                continue
+            run = asyncio.create_task(runner.run_query(json.loads(job.key), job.query))
+            heartbeat = asyncio.create_task(keep_leased(job, run))
+            try:
+                record = await run
+            except asyncio.CancelledError:
+                # Stopped by keep_leased: leave the job to its new owner. Any other
+                # cancellation is the worker shutting down
+                if heartbeat.done() and not heartbeat.cancelled():
+                    continue
+                run.cancel()
+                raise
+            except Exception as e:
+                # One failing run must not take down the other slots of the worker
+                logger.exception("Job %s failed: %s", job.key, e)
+                queue.fail(job, name, f"{type(e).__name__}: {e}")
+                continue
+            finally:
+                heartbeat.cancel()
+            record["attempts"] = job.attempts
+            record["worker"] = name
+            if record["status"] in RETRY_STATUSES:
+                queue.fail(job, name, record["error"] or "The run stopped early without an answer", record)
+            elif queue.complete(job, name, record):
+                completed += 1
+
+    server_params = StdioServerParameters(command=sys.executable, args=[server])
+    try:
+        async with connect_server(server_params) as (read, write):
+            async with ClientSession(read, write) as session:
+                await session.initialize()
+                tools = (await session.list_tools()).tools
+                runner = BatchRunner(session, tools, llm, None, concurrency, max_iterations, store=store)
+                logger.info("Worker %s started: %s jobs at once", name, concurrency)
+                await asyncio.gather(*(slot(runner) for _ in range(concurrency)))
+    finally:
+        await gateway.close()
+        if store is not None:
+            store.close()
+        queue.close()
+    logger.info("Worker %s done: %s jobs completed, LLM calls: %s", name, completed, llm.stats())
+
+
+def worker_process(*args):
+    """Entry point of a worker process"""
+    asyncio.run(run_worker(*args))
+
+
+def work(queue_path, workers, concurrency, server, max_iterations, forever=False):
+    """Start the worker processes and wait for them"""
+    # Spawned, not forked: every worker starts clean, with its own event loop and connections
+    context = multiprocessing.get_context("spawn")
+    processes = [
+        context.Process(target=worker_process, name=f"job-worker-{index}",
+                        args=(queue_path, index, workers, concurrency, server, max_iterations, forever))
+        for index in range(workers)
+    ]
+    start = time.perf_counter()
+    for process in processes:
+        process.start()
+    try:
+        for process in processes:
+            process.join()
+    except KeyboardInterrupt:
+        # Workers get the interrupt too; their leased jobs come back after the visibility timeout
+        for process in processes:
+            process.join()
+    elapsed = time.perf_counter() - start
+    queue = JobQueue(queue_path)
+    counts = queue.stats()["counts"]
+    queue.close()
+    logger.info("%s workers finished in %.1fs: %s", workers, elapsed, counts)
+
+
+def format_duration(seconds):
+    """Seconds as h:mm:ss"""
+    seconds = int(seconds)
+    return f"{seconds // 3600}:{seconds % 3600 // 60:02d}:{seconds % 60:02d}"
+
+
+def print_dashboard(stats, path):
+    """Print a queue's throughput dashboard"""
+    counts = stats["counts"]
+    total = sum(counts.values())
+    print("=" * 78)
+    print(f"Job queue {path} at {time.strftime('%H:%M:%S')}: {total} jobs")
+    print("=" * 78)
+    print("  ".join(f"{status}: {count}" for status, count in counts.items()))
+    eta = format_duration(stats["eta_s"]) if stats["eta_s"] is not None else "-"
+    print(f"throughput: {stats['recent_per_s']:.2f} jobs/s (last {THROUGHPUT_WINDOW}s), "
+          f"{stats['overall_per_s']:.2f} jobs/s overall, mean run {stats['mean_run_s']:.2f}s, ETA {eta}")
+    if stats["workers"]:
+        print(f"\n{'worker':<40}{'leased':>8}{'done':>8}{'failed':>8}{'jobs/s':>10}")
+        for owner, row in sorted(stats["workers"].items()):
+            print(f"{owner:<40}{row['leased']:>8}{row['done']:>8}{row['failed']:>8}"
+                  f"{row['done'] / THROUGHPUT_WINDOW:>10.2f}")
+    print()
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Durable queue of agent runs with worker processes")
+    parser.add_argument("--db", default=JOB_QUEUE_DB, help=f"Queue database (default: {JOB_QUEUE_DB})")
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    enqueue = commands.add_parser("enqueue", help="Add the queries of a JSON lines file (or - for stdin)")
+    enqueue.add_argument("input", nargs="?", default="-")
+
+    worker = commands.add_parser("work", help="Run worker processes until the queue is drained")
+    worker.add_argument("--workers", "-w", type=int, default=JOB_WORKERS,
+                        help=f"Worker processes (default: {JOB_WORKERS})")
+    worker.add_argument("--concurrency", "-c", type=int, default=None,
+                        help="Jobs run at once per worker (default: BATCH_CONCURRENCY)")
+    worker.add_argument("--server", default=None, help="MCP server script (default: BATCH_SERVER)")
+    worker.add_argument("--max-iterations", type=int, default=None, help="Iterations per run")
+    worker.add_argument("--forever", action="store_true", help="Keep polling when the queue is empty")
+
+    dashboard = commands.add_parser("dashboard", help="Show queue throughput and worker progress")
+    dashboard.add_argument("--interval", type=float, default=5.0, help="Seconds between refreshes (default: 5)")
+    dashboard.add_argument("--once", action="store_true", help="Print one report and exit")
+
+    results = commands.add_parser("results", help="Write the finished jobs as JSON lines")
+    results.add_argument("--output", "-o", default="-", help="Output file, or - for stdout (default: -)")
+
+    args = parser.parse_args(argv)
+
+    if args.command == "work":
+        from agent_loop import MAX_ITERATIONS
+        from main import BATCH_CONCURRENCY, BATCH_SERVER
+        work(args.db, max(1, args.workers), args.concurrency or BATCH_CONCURRENCY, args.server or BATCH_SERVER,
+             args.max_iterations or MAX_ITERATIONS, args.forever)
+        return
+
+    queue = JobQueue(args.db)
+    try:
+        if args.command == "enqueue":
+            from main import parse_query
+            source = sys.stdin if args.input == "-" else open(args.input, encoding="utf-8")
+            read = {"queries": 0}
+
+            def queries():
+                # Streamed into the queue in chunks, so inputs of any size fit
+                for number, line in enumerate(source, 1):
+                    if not line.strip():
+                        continue
+                    run_id, query = parse_query(line, number)
+                    if query is None:
+                        logger.warning("Skipping line %s: not a JSON string or object with a query", number)
+                        continue
+                    read["queries"] += 1
+                    yield run_id, query
+
+            added = queue.enqueue(queries())
+            logger.info("Queued %s of %s queries (%s already in the queue)",
+                        added, read["queries"], read["queries"] - added)
+        elif args.command == "dashboard":
+            while True:
+                print_dashboard(queue.stats(), args.db)
+                if args.once:
+                    break
+                time.sleep(args.interval)
+        elif args.command == "results":
+            output = sys.stdout if args.output == "-" else open(args.output, "w", encoding="utf-8")
+            for record in queue.results():
+                output.write(json.dumps(record, default=str) + "\n")
+            if output is not sys.stdout:
+                output.close()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        queue.close()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,347 @@
+"""
+Large Image Input
+
+Scanned inputs can be hundreds of megapixels, and decoding one of them in full
+(PILImage.open(...).load()) can take gigabytes of memory and bring down the
+server that also handles email. This module computes thumbnails and crops of
+large images without decoding the whole image at full resolution:
+
+- Uncompressed images (BMP, PPM/PGM, uncompressed TIFF strips and tiles) are
+  memory-mapped and read band by band (or tile by tile) with Image.frombuffer,
+  so only the rows being processed are ever paged in.
+- JPEG images are decoded with Image.draft, which scales them down by up to 8x
+  inside the JPEG decoder.
+- Anything else (PNG, compressed TIFF, ...) is decoded in full, but only if it
+  is below MAX_DECODE_PIXELS; bigger files are refused instead of risking an
+  out-of-memory crash.
+
+Every operation returns statistics with the strategy used, the largest block of
+pixels decoded at once and the process's peak resident memory (RSS).
+
+Before images are shrunk they are converted to a display mode (L, LA, P, RGB
+or RGBA, see to_display_mode): 16-bit greyscale scans (I;16, I) cannot be
+resized by Pillow and are scaled down to 8 bits, CMYK and other colour spaces
+become RGB.
+
+Pillow's decompression-bomb limit stays in place for the rest of the process;
+only the files opened here (with open_image) are exempt from it.
+
+Configuration (environment variables, e.g. in .env):
+    LARGE_IMAGE_PIXELS   Images above this many pixels use the streaming path (default: 25000000)
+    MAX_DECODE_PIXELS    Largest image decoded in full at once (default: 100000000)
+    IMAGE_BAND_BYTES     Bytes of raw pixel data processed per band (default: 67108864)
+"""
+
+import mmap
+import os
+import sys
+import threading
+from contextlib import contextmanager
+
+from PIL import Image as PILImage
+
+LARGE_IMAGE_PIXELS = int(os.getenv("LARGE_IMAGE_PIXELS", "25000000"))
+MAX_DECODE_PIXELS = int(os.getenv("MAX_DECODE_PIXELS", "100000000"))
+IMAGE_BAND_BYTES = int(os.getenv("IMAGE_BAND_BYTES", str(64 * 1024 * 1024)))
+
+# Pillow's decompression-bomb check (PILImage.MAX_IMAGE_PIXELS) refuses to even
+# open very large scans. open_image() lifts it while a file is opened, under this
+# lock so that other threads' opens never see the lifted limit.
+_PIXEL_LIMIT_LOCK = threading.Lock()
+
+
+def peak_rss_bytes():
+    """Return the peak resident set size of the current process in bytes (0 if unknown)"""
+    if sys.platform == "win32":
+        import ctypes
+        from ctypes import wintypes
+
+        class PROCESS_MEMORY_COUNTERS(ctypes.Structure):
+            _fields_ = [
+                ("cb", wintypes.DWORD),
+                ("PageFaultCount", wintypes.DWORD),
+                ("PeakWorkingSetSize", ctypes.c_size_t),
+                ("WorkingSetSize", ctypes.c_size_t),
+                ("QuotaPeakPagedPoolUsage", ctypes.c_size_t),
+                ("QuotaPagedPoolUsage", ctypes.c_size_t),
+                ("QuotaPeakNonPagedPoolUsage", ctypes.c_size_t),
+                ("QuotaNonPagedPoolUsage", ctypes.c_size_t),
+                ("PagefileUsage", ctypes.c_size_t),
+                ("PeakPagefileUsage", ctypes.c_size_t),
+            ]
+
+        counters = PROCESS_MEMORY_COUNTERS()
+        counters.cb = ctypes.sizeof(counters)
+        process = ctypes.windll.kernel32.GetCurrentProcess()
+        if ctypes.windll.psapi.GetProcessMemoryInfo(process, ctypes.byref(counters), counters.cb):
+            return counters.PeakWorkingSetSize
+        return 0
+
+    try:
+        import resource
+    except ImportError:
+        return 0
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # Linux reports kilobytes, macOS reports bytes
+    return peak if sys.platform == "darwin" else peak * 1024
+
+
+@contextmanager
+def open_image(image_path):
+    """Open an image of any size, without Pillow's decompression-bomb check
+
+    Only use this where what is decoded is bounded otherwise: the streaming path
+    reads bands of raw images and refuses full decodes above MAX_DECODE_PIXELS.
+
+    Args:
+        image_path (str): Path of the image file
+
+    Yields:
+        PIL.Image.Image: The opened (not yet loaded) image
+    """
+    with _PIXEL_LIMIT_LOCK:
+        limit = PILImage.MAX_IMAGE_PIXELS
+        PILImage.MAX_IMAGE_PIXELS = None
+        try:
+            img = PILImage.open(image_path)
+        finally:
+            PILImage.MAX_IMAGE_PIXELS = limit
+    with img:
+        yield img
+
+
+# Modes that Pillow can shrink and PNG can store (P is resized with NEAREST by _shrink)
+DISPLAY_MODES = ("L", "LA", "P", "RGB", "RGBA")
+
+
+def display_mode(mode):
+    """The display mode an image of this mode is converted to by to_display_mode()"""
+    if mode in DISPLAY_MODES:
+        return mode
+    if mode in ("1", "F") or mode.startswith("I"):
+        return "L"
+    if mode.endswith(("A", "a")):  # PA, La, RGBa
+        return "LA" if mode.startswith("L") else "RGBA"
+    return "RGB"  # CMYK, YCbCr, LAB, HSV, RGBX
+
+
+def to_display_mode(img):
+    """Convert an image to its display mode (L, LA, P, RGB or RGBA)
+
+    Integer greyscale (I;16 and I) is taken to hold 16-bit samples and scaled
+    to 8 bits; a plain convert("L") would clip everything above 255 to white.
+    """
+    mode = display_mode(img.mode)
+    if img.mode == mode:
+        return img
+    if img.mode.startswith("I"):
+        if img.mode != "I":
+            img = img.convert("I")
+        return img.point(lambda value: value * (1 / 256)).convert("L")
+    return img.convert(mode)
+
+
+def is_large_image(img):
+    """Return True if an opened (not yet loaded) image should use the streaming path"""
+    return img.width * img.height > LARGE_IMAGE_PIXELS
+
+
+def _raw_tiles(img):
+    """Return the image's tiles as (extents, offset, rawmode, stride, orientation), or None
+
+    None means the image is not stored as uncompressed raw data that can be
+    memory-mapped, so the streaming path cannot be used for it.
+    """
+    tiles = []
+    for tile in img.tile:
+        decoder_name, extents, offset, args = tile[:4]
+        if decoder_name != "raw":
+            return None
+        if isinstance(args, str):
+            args = (args, 0, 1)
+        rawmode = args[0]
+        stride = args[1] if len(args) > 1 else 0
+        orientation = args[2] if len(args) > 2 else 1
+        if not stride:
+            # Packed rows: measure the row size by packing one blank row
+            width = extents[2] - extents[0]
+            try:
+                stride = len(PILImage.new(img.mode, (width, 1)).tobytes("raw", rawmode))
+            except (ValueError, OSError):
+                return None
+        tiles.append((extents, offset, rawmode, stride, orientation))
+    return tiles or None
+
+
+def _iter_raw_blocks(image_path, img, tiles, band_rows, rows=None):
+    """Yield (box, image) blocks of a raw image read through a memory map of the file
+
+    Args:
+        image_path (str): Path of the image file
+        img: The opened image (used for mode and palette)
+        tiles: Result of _raw_tiles
+        band_rows (int): Maximum rows per block for tiles that span many rows
+        rows (tuple): Optional (top, bottom) rows; blocks outside it are skipped
+    """
+    with open(image_path, 'rb') as f, mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mapped:
+        for (x0, y0, x1, y1), offset, rawmode, stride, orientation in tiles:
+            top, bottom = (y0, y1) if rows is None else (max(y0, rows[0]), min(y1, rows[1]))
+            band_top = top
+            while band_top < bottom:
+                band_bottom = min(band_top + band_rows, bottom)
+                if orientation < 0:
+                    # Bottom-up rows (BMP): the last image row comes first in the file
+                    start = offset + (y1 - band_bottom) * stride
+                else:
+                    start = offset + (band_top - y0) * stride
+                end = start + (band_bottom - band_top) * stride
+                if end > len(mapped):
+                    raise ValueError("Image file is truncated")
+                with memoryview(mapped)[start:end] as band_data:
+                    block = PILImage.frombuffer(
+                        img.mode, (x1 - x0, band_bottom - band_top), band_data,
+                        "raw", rawmode, stride, orientation
+                    )
+                    if block.readonly:
+                        # Zero-copy view of the map: copy this one band so the map can be closed later
+                        block = block.copy()
+                if img.mode == "P" and img.palette is not None:
+                    block.putpalette(img.getpalette())
+                yield (x0, band_top, x1, band_bottom), block
+                band_top = band_bottom
+
+
+def _band_rows(img, tiles, align=1):
+    """Number of rows per band so that each band stays around IMAGE_BAND_BYTES"""
+    stride = max(tile[3] for tile in tiles)
+    rows = max(1, IMAGE_BAND_BYTES // max(stride, 1))
+    return max(align, rows // align * align)
+
+
+def _check_full_decode(img, pixels=None):
+    """Refuse full decodes that would exceed MAX_DECODE_PIXELS"""
+    pixels = pixels if pixels is not None else img.width * img.height
+    if pixels > MAX_DECODE_PIXELS:
+        raise ValueError(
+            f"Image is {img.width}x{img.height} ({pixels:,} pixels) in {img.format} format, which cannot "
+            f"be streamed and is above MAX_DECODE_PIXELS ({MAX_DECODE_PIXELS:,}). "
+            f"Convert it to JPEG or uncompressed TIFF first."
+        )
+
+
+def _stats(strategy, decoded_pixels):
+    return {
+        "strategy": strategy,
+        "max_decoded_pixels": decoded_pixels,
+        "peak_rss_mb": round(peak_rss_bytes() / (1024 * 1024), 1),
+    }
+
+
+def _shrink(block, factor, target, aligned):
+    """Shrink a block (in its display mode) by an integer factor to the target size"""
+    if block.mode == "P":
+        return block.resize(target, PILImage.Resampling.NEAREST)
+    if aligned:
+        return block.reduce(factor)
+    return block.resize(target, PILImage.Resampling.BOX)
+
+
+def stream_thumbnail(image_path, size):
+    """Create a thumbnail of a (large) image without decoding it in full
+
+    Args:
+        image_path (str): Path of the source image
+        size (tuple): Maximum (width, height) of the thumbnail
+
+    Returns:
+        tuple: (thumbnail as a PIL image, statistics dict)
+    """
+    with open_image(image_path) as img:
+        width, height = img.size
+        tiles = _raw_tiles(img)
+
+        if tiles is not None:
+            # Box-average by an integer factor band by band, then finish with thumbnail()
+            factor = max(1, min(width // size[0], height // size[1]))
+            band_rows = _band_rows(img, tiles, align=factor)
+            # Blocks are shrunk in the display mode, e.g. bilevel scans are averaged to grey levels
+            reduced_mode = display_mode(img.mode)
+            reduced = PILImage.new(reduced_mode, (-(-width // factor), -(-height // factor)))
+            if img.mode == "P" and img.palette is not None:
+                reduced.putpalette(img.getpalette())
+            max_block = 0
+            for (x0, y0, x1, y1), block in _iter_raw_blocks(image_path, img, tiles, band_rows):
+                max_block = max(max_block, block.width * block.height)
+                target = (-(-(x1 - x0) // factor), -(-(y1 - y0) // factor))
+                block = to_display_mode(block)
+                reduced.paste(_shrink(block, factor, target, aligned=not (x0 % factor or y0 % factor)),
+                              (x0 // factor, y0 // factor))
+            reduced.thumbnail(size)
+            return reduced, _stats("memory-mapped bands", max_block)
+
+        if img.format == "JPEG":
+            img.draft(None, size)
+            decoded_pixels = img.width * img.height
+            _check_full_decode(img, decoded_pixels)
+            strategy = f"jpeg draft (1/{round(width / img.width)} scale decode)"
+            thumbnail = to_display_mode(img)
+            thumbnail.thumbnail(size)
+            return thumbnail.copy(), _stats(strategy, decoded_pixels)
+
+        _check_full_decode(img)
+        thumbnail = to_display_mode(img)
+        thumbnail.thumbnail(size)
+        return thumbnail.copy(), _stats("full decode", width * height)
+
+
+def crop_region(image_path, box):
+    """Crop a region out of a (large) image, decoding only the rows that are needed when possible
+
+    Args:
+        image_path (str): Path of the source image
+        box (tuple): (left, top, right, bottom) in pixels
+
+    Returns:
+        tuple: (cropped PIL image, statistics dict)
+    """
+    left, top, right, bottom = box
+    with open_image(image_path) as img:
+        if not (0 <= left < right <= img.width and 0 <= top < bottom <= img.height):
+            raise ValueError(f"Crop box {box} is outside the {img.width}x{img.height} image")
+
+        tiles = _raw_tiles(img)
+        if tiles is not None:
+            result = PILImage.new(img.mode, (right - left, bottom - top))
+            if img.mode == "P" and img.palette is not None:
+                result.putpalette(img.getpalette())
+            max_block = 0
+            band_rows = _band_rows(img, tiles)
+            for (x0, y0, x1, y1), block in _iter_raw_blocks(image_path, img, tiles, band_rows, rows=(top, bottom)):
+                if x1 <= left or x0 >= right:
+                    continue
+                max_block = max(max_block, block.width * block.height)
+                part = block.crop((max(left, x0) - x0, 0, min(right, x1) - x0, y1 - y0))
+                result.paste(part, (max(left, x0) - left, y0 - top))
+            return result, _stats("memory-mapped rows", max_block)
+
+        _check_full_decode(img)
+        return img.crop(box), _stats("full decode", img.width * img.height)
+
+
+def crop_to_file(image_path, box, output_path=None):
+    """Crop a region out of a (large) image and save it as PNG
+
+    Args:
+        image_path (str): Path of the source image
+        box (tuple): (left, top, right, bottom) in pixels
+        output_path (str): Where to save the crop (default: next to the source image)
+
+    Returns:
+        dict: Output path, crop size and read statistics (strategy, peak RSS)
+    """
+    cropped, stats = crop_region(image_path, box)
+    if not output_path:
+        base_name = os.path.splitext(image_path)[0]
+        output_path = f"{base_name}_crop_{'_'.join(str(v) for v in box)}.png"
+    cropped.save(output_path, format="PNG")
+    return {"output_path": output_path, "width": cropped.width, "height": cropped.height, **stats}
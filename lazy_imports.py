@@ -0,0 +1,43 @@
+"""
+Lazy Imports
+
+Some dependencies take tens of milliseconds to import but are only needed on
+some code paths: requests for the local LLM server and the Gmail API. Every
+client and server start paid for them anyway, and cold start is paid on
+every invocation (cron jobs, batch workers, each spawned server).
+
+lazy_import() returns such a module without executing it; it is imported the
+first time one of its attributes is used. Whether the module is installed is
+still checked at once, so a missing dependency fails at startup as before.
+
+Profile the import cost of a script with `python -m bench.importtime`.
+"""
+
+import importlib.util
+import sys
+
+
+def lazy_import(name):
+    """Return a module that is only imported when one of its attributes is first used
+
+    Args:
+        name (str): Module name, e.g. "requests"
+
+    Returns:
+        module: The module (already imported if something imported it before)
+
+    Raises:
+        ModuleNotFoundError: If the module is not installed
+    """
+    module = sys.modules.get(name)
+    if module is not None:
+        return module
+    spec = importlib.util.find_spec(name)
+    if spec is None:
+        raise ModuleNotFoundError(f"No module named {name!r}", name=name)
+    loader = importlib.util.LazyLoader(spec.loader)
+    spec.loader = loader
+    module = importlib.util.module_from_spec(spec)
+    sys.modules[name] = module
+    loader.exec_module(module)
+    return module
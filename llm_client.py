@@ -0,0 +1,219 @@
+"""
+Resilient LLM Calls
+
+Wraps the call that sends a prompt to the LLM (the gateway in the clients) with:
+
+- Adaptive timeouts: once a few calls have been observed, the timeout is the
+  p95 of the recent latencies times LLM_TIMEOUT_FACTOR (clamped between
+  LLM_TIMEOUT_MIN and LLM_TIMEOUT_MAX), instead of a fixed number of seconds.
+- Retries with jittered exponential backoff on transient errors (timeouts,
+  connection errors, HTTP 429/5xx from the Google API or a local model).
+  Other errors, such as an invalid API key or a rejected prompt, are raised
+  at once.
+- Optional hedging (LLM_HEDGE=1): if the first request is still running after
+  the p90 latency, an identical second request is sent and whichever answers
+  first wins. This cuts the latency tail at the cost of a few extra requests.
+
+A blocking call (like model.generate_content) runs in a thread; a request
+that lost a hedge or timed out cannot be stopped there, its answer is just
+ignored when it arrives.
+
+Usage:
+    llm = ResilientLLM(lambda prompt: model.generate_content(contents=prompt).text)
+    text = await llm(prompt)
+
+Configuration (environment variables, e.g. in .env):
+    LLM_TIMEOUT          Timeout in seconds until enough latencies are known (default: 10)
+    LLM_TIMEOUT_FACTOR   Adaptive timeout = p95 latency times this (default: 3)
+    LLM_TIMEOUT_MIN      Lower bound of the adaptive timeout (default: 2)
+    LLM_TIMEOUT_MAX      Upper bound of the adaptive timeout (default: 60)
+    LLM_MAX_RETRIES      Retries after a transient error (default: 3)
+    LLM_BACKOFF_BASE     First backoff in seconds, doubled per retry (default: 0.5)
+    LLM_BACKOFF_CAP      Longest backoff in seconds (default: 8)
+    LLM_HEDGE            1 to send a hedged request after the p90 latency (default: 0)
+"""
+
+import asyncio
+import inspect
+import logging
+import os
+import random
+import sys
+import time
+from collections import deque
+
+from llm_providers import TransientProviderError
+from tracing import percentile
+
+# Errors worth retrying; anything else will fail the same way again
+TRANSIENT_ERRORS = (TimeoutError, ConnectionError, TransientProviderError)
+
+
+def transient_errors():
+    """TRANSIENT_ERRORS plus Google's API errors, once the Gemini SDK has imported them
+
+    Only the Gemini provider can raise them, so other providers do not pay for
+    importing google.api_core at startup.
+    """
+    google_exceptions = sys.modules.get("google.api_core.exceptions")
+    if google_exceptions is None:
+        return TRANSIENT_ERRORS
+    return TRANSIENT_ERRORS + (
+        google_exceptions.TooManyRequests,      # 429
+        google_exceptions.ResourceExhausted,    # 429 (quota)
+        google_exceptions.InternalServerError,  # 500
+        google_exceptions.BadGateway,           # 502
+        google_exceptions.ServiceUnavailable,   # 503
+        google_exceptions.GatewayTimeout,       # 504
+        google_exceptions.DeadlineExceeded,
+    )
+
+LLM_TIMEOUT = float(os.getenv("LLM_TIMEOUT", "10"))
+LLM_TIMEOUT_FACTOR = float(os.getenv("LLM_TIMEOUT_FACTOR", "3"))
+LLM_TIMEOUT_MIN = float(os.getenv("LLM_TIMEOUT_MIN", "2"))
+LLM_TIMEOUT_MAX = float(os.getenv("LLM_TIMEOUT_MAX", "60"))
+LLM_MAX_RETRIES = int(os.getenv("LLM_MAX_RETRIES", "3"))
+LLM_BACKOFF_BASE = float(os.getenv("LLM_BACKOFF_BASE", "0.5"))
+LLM_BACKOFF_CAP = float(os.getenv("LLM_BACKOFF_CAP", "8"))
+LLM_HEDGE = os.getenv("LLM_HEDGE", "0").lower() in ("1", "true", "yes")
+
+# Latencies needed before the timeout and hedge delay are derived from them
+MIN_SAMPLES = 5
+# Number of recent latencies the percentiles are computed from
+LATENCY_WINDOW = 100
+
+logger = logging.getLogger(__name__)
+
+
+class ResilientLLM:
+    """Async callable that sends a prompt with adaptive timeouts, retries and hedging
+
+    Attributes:
+        calls (int): Prompts sent through this caller
+        retries (int): Retries after transient errors
+        timeouts (int): Attempts that ran into the timeout
+        hedges (int): Hedged (duplicate) requests sent
+        hedge_wins (int): Hedged requests that answered before the original
+    """
+
+    def __init__(self, call, timeout=None, max_retries=None, hedge=None):
+        """
+        Args:
+            call (callable): Takes a prompt and returns the response text; a plain
+                function is run in a thread, a coroutine function is awaited
+            timeout (float): Timeout until enough latencies are known (default: LLM_TIMEOUT)
+            max_retries (int): Retries after a transient error (default: LLM_MAX_RETRIES)
+            hedge (bool): Send hedged requests (default: LLM_HEDGE)
+        """
+        self.call = call
+        self.initial_timeout = LLM_TIMEOUT if timeout is None else timeout
+        self.max_retries = LLM_MAX_RETRIES if max_retries is None else max_retries
+        self.hedge = LLM_HEDGE if hedge is None else hedge
+        self._latencies = deque(maxlen=LATENCY_WINDOW)
+        self.calls = 0
+        self.retries = 0
+        self.timeouts = 0
+        self.hedges = 0
+        self.hedge_wins = 0
+
+    def timeout(self):
+        """Current timeout in seconds: a multiple of the observed p95, or the initial timeout"""
+        if len(self._latencies) < MIN_SAMPLES:
+            return self.initial_timeout
+        adaptive = percentile(self._latencies, 0.95) * LLM_TIMEOUT_FACTOR
+        return min(max(adaptive, LLM_TIMEOUT_MIN), LLM_TIMEOUT_MAX)
+
+    def hedge_delay(self):
+        """Seconds after which a hedged request is sent, or None if hedging is off (or too early)"""
+        if not self.hedge or len(self._latencies) < MIN_SAMPLES:
+            return None
+        return percentile(self._latencies, 0.90)
+
+    def stats(self):
+        """Counters and the current latency percentiles, for logging at the end of a run"""
+        latencies = list(self._latencies)
+        return {
+            "calls": self.calls,
+            "retries": self.retries,
+            "timeouts": self.timeouts,
+            "hedges": self.hedges,
+            "hedge_wins": self.hedge_wins,
+            "p50_s": round(percentile(latencies, 0.50), 3) if latencies else None,
+            "p95_s": round(percentile(latencies, 0.95), 3) if latencies else None,
+            "timeout_s": round(self.timeout(), 3),
+        }
+
+    async def __call__(self, prompt, declarations=None):
+        """Send the prompt and return the response text
+
+        With function declarations (native function calling) they are passed on
+        to the call, whose response may then be a FunctionCall instead of text.
+
+        Raises:
+            The last error if every attempt failed, or the first non-transient error
+        """
+        self.calls += 1
+        for attempt in range(self.max_retries + 1):
+            # A retry after a timeout gets more time, in case the estimate was too tight
+            timeout = min(self.timeout() * 2 ** attempt, max(LLM_TIMEOUT_MAX, self.initial_timeout))
+            try:
+                return await self._attempt(prompt, declarations, timeout)
+            except transient_errors() as e:
+                if attempt == self.max_retries:
+                    raise
+                # Full jitter: spread the retries of concurrent runs over the whole backoff window
+                delay = random.uniform(0, min(LLM_BACKOFF_CAP, LLM_BACKOFF_BASE * 2 ** attempt))
+                self.retries += 1
+                logger.warning("LLM call failed (%s: %s), retry %s/%s in %.2fs",
+                               type(e).__name__, e, attempt + 1, self.max_retries, delay)
+                await asyncio.sleep(delay)
+
+    def _start(self, prompt, declarations):
+        """Start one request and return its future"""
+        args = (prompt,) if declarations is None else (prompt, declarations)
+        if inspect.iscoroutinefunction(self.call):
+            return asyncio.ensure_future(self.call(*args))
+        return asyncio.get_running_loop().run_in_executor(None, self.call, *args)
+
+    async def _attempt(self, prompt, declarations, timeout):
+        """One attempt: the request, plus a hedged duplicate if it is slow"""
+        started = {}
+        first = self._start(prompt, declarations)
+        started[first] = time.perf_counter()
+        deadline = started[first] + timeout
+        pending = {first}
+        error = None
+        try:
+            hedge_after = self.hedge_delay()
+            if hedge_after is not None and hedge_after < timeout:
+                done, _ = await asyncio.wait(pending, timeout=hedge_after)
+                if not done:
+                    hedge = self._start(prompt, declarations)
+                    started[hedge] = time.perf_counter()
+                    pending.add(hedge)
+                    self.hedges += 1
+                    logger.debug("LLM call slower than p90 (%.2fs), sent a hedged request", hedge_after)
+
+            while pending:
+                remaining = deadline - time.perf_counter()
+                if remaining <= 0:
+                    break
+                done, pending = await asyncio.wait(pending, timeout=remaining,
+                                                   return_when=asyncio.FIRST_COMPLETED)
+                for future in done:
+                    if future.exception() is not None:
+                        error = future.exception()
+                        continue
+                    # Each request's own latency, so hedging does not skew the estimate
+                    self._latencies.append(time.perf_counter() - started[future])
+                    if future is not first:
+                        self.hedge_wins += 1
+                    return future.result()
+        finally:
+            for future in pending:
+                future.cancel()  # A request running in a thread finishes anyway; its answer is dropped
+
+        if error is not None and not pending:
+            raise error
+        self.timeouts += 1
+        raise TimeoutError(f"LLM call timed out after {timeout:.1f}s")
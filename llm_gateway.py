@@ -0,0 +1,290 @@
+"""
+LLM Gateway
+
+Sits between the agent runs and an LLM provider (see llm_providers.py):
+
+- Batching: prompts that arrive within LLM_BATCH_WINDOW_MS of each other (from
+  concurrent agent runs) are sent as one batch request when the provider
+  supports it. While the rate limit holds requests back, new prompts keep
+  queueing, so batches grow exactly when capacity is short.
+- Rate limiting: token buckets for requests per minute (LLM_RPM) and prompt
+  tokens per minute (LLM_TPM) keep the request rate under the provider's
+  quota instead of running into 429 errors. When the provider still reports
+  a transient error (429/5xx), the request bucket is emptied so every run
+  backs off together.
+- At most LLM_MAX_CONCURRENCY requests are in flight; the blocking provider
+  calls run in the gateway's own threads.
+- Prompts with function declarations (native function calling) share the
+  rate limits but are sent one per request.
+- Every prompt gets an answer or an error: a prompt a batch response has no
+  completion for fails with a TransientProviderError (so the LLM client
+  retries it), and if the dispatcher itself fails, the queued prompts and
+  every later one fail with its error instead of waiting forever.
+
+A gateway belongs to one event loop. It is an async callable, like the
+generate function run_agent() expects:
+
+    gateway = LLMGateway(create_provider())
+    text = await gateway.generate(prompt)
+
+Configuration (environment variables, e.g. in .env):
+    LLM_RPM              Requests per minute (default: the provider's limit, 0 = unlimited)
+    LLM_TPM              Prompt tokens per minute (default: 0 = unlimited)
+    LLM_BATCH_WINDOW_MS  How long a prompt waits for others to join its batch (default: 10)
+    LLM_MAX_CONCURRENCY  Requests in flight at once (default: 8)
+"""
+
+import asyncio
+import logging
+import os
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from history_compactor import estimate_tokens
+from llm_client import transient_errors
+from llm_providers import TransientProviderError
+
+_rpm_setting = os.getenv("LLM_RPM", "")
+LLM_RPM = float(_rpm_setting) if _rpm_setting else None
+LLM_TPM = float(os.getenv("LLM_TPM", "0"))
+LLM_BATCH_WINDOW_MS = float(os.getenv("LLM_BATCH_WINDOW_MS", "10"))
+LLM_MAX_CONCURRENCY = int(os.getenv("LLM_MAX_CONCURRENCY", "8"))
+
+logger = logging.getLogger(__name__)
+
+
+class TokenBucket:
+    """Async token bucket: refills at rate_per_minute, holds at most capacity tokens"""
+
+    def __init__(self, rate_per_minute, capacity=None):
+        self.rate = rate_per_minute / 60.0
+        # A minute's worth by default, matching how providers count their quotas
+        self.capacity = max(1.0, capacity or rate_per_minute)
+        self.tokens = self.capacity
+        self.updated = time.monotonic()
+        self._lock = asyncio.Lock()
+
+    def _refill(self):
+        now = time.monotonic()
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    async def acquire(self, amount=1.0):
+        """Wait until amount tokens are available and take them
+
+        Returns:
+            float: Seconds spent waiting
+        """
+        # More than the bucket holds could never be granted; take a full bucket instead
+        amount = min(amount, self.capacity)
+        waited = 0.0
+        async with self._lock:  # Waiters are served in arrival order
+            while True:
+                self._refill()
+                if self.tokens >= amount:
+                    self.tokens -= amount
+                    return waited
+                delay = (amount - self.tokens) / self.rate
+                await asyncio.sleep(delay)
+                waited += delay
+
+    def drain(self):
+        """Empty the bucket, e.g. after the provider reported it is overloaded"""
+        self._refill()
+        self.tokens = 0.0
+
+
+class LLMGateway:
+    """Batches and rate-limits the prompts of many concurrent agent runs for one provider
+
+    Attributes:
+        prompts (int): Prompts received
+        requests (int): Requests sent to the provider
+        largest_batch (int): Most prompts sent in one request
+        throttled_seconds (float): Time the dispatcher waited for the rate limit
+    """
+
+    def __init__(self, provider, requests_per_minute=None, tokens_per_minute=None,
+                 batch_window_ms=None, max_concurrency=None):
+        """
+        Args:
+            provider (LLMProvider): The backend
+            requests_per_minute (float): Request rate limit (default: LLM_RPM or the
+                provider's own limit; 0 = unlimited)
+            tokens_per_minute (float): Prompt token rate limit (default: LLM_TPM; 0 = unlimited)
+            batch_window_ms (float): Batch collection window (default: LLM_BATCH_WINDOW_MS)
+            max_concurrency (int): Requests in flight (default: LLM_MAX_CONCURRENCY)
+        """
+        self.provider = provider
+        if requests_per_minute is None:
+            requests_per_minute = provider.requests_per_minute if LLM_RPM is None else LLM_RPM
+        if tokens_per_minute is None:
+            tokens_per_minute = LLM_TPM
+        self._request_bucket = TokenBucket(requests_per_minute) if requests_per_minute > 0 else None
+        self._token_bucket = TokenBucket(tokens_per_minute) if tokens_per_minute > 0 else None
+        self.batch_window = (LLM_BATCH_WINDOW_MS if batch_window_ms is None else batch_window_ms) / 1000
+        self.max_concurrency = max_concurrency or LLM_MAX_CONCURRENCY
+        self._executor = ThreadPoolExecutor(max_workers=self.max_concurrency, thread_name_prefix="llm")
+        self._queue = None
+        self._slots = None
+        self._dispatcher = None
+        self._held = None
+        self._failure = None  # Why the dispatcher stopped, if it failed
+        self._in_flight = set()
+        self.prompts = 0
+        self.requests = 0
+        self.largest_batch = 0
+        self.throttled_seconds = 0.0
+
+    async def generate(self, prompt, declarations=None):
+        """Queue a prompt and return its response once its batch is answered
+
+        Args:
+            prompt (str): The prompt
+            declarations (list): Function declarations for native function calling;
+                the response is then a FunctionCall or text
+
+        Returns:
+            The response text, or a FunctionCall
+        """
+        if self._failure is not None:
+            raise RuntimeError(f"The LLM gateway stopped: {self._failure}") from self._failure
+        if self._dispatcher is None:
+            self._queue = asyncio.Queue()
+            self._slots = asyncio.Semaphore(self.max_concurrency)
+            self._dispatcher = asyncio.create_task(self._dispatch())
+            self._dispatcher.add_done_callback(self._dispatcher_done)
+        future = asyncio.get_running_loop().create_future()
+        self._queue.put_nowait((prompt, declarations, future))
+        self.prompts += 1
+        return await future
+
+    async def __call__(self, prompt, declarations=None):
+        return await self.generate(prompt, declarations)
+
+    def stats(self):
+        """Counters for logging at the end of a run"""
+        return {
+            "provider": self.provider.name,
+            "prompts": self.prompts,
+            "requests": self.requests,
+            "mean_batch": round(self.prompts / self.requests, 2) if self.requests else 0.0,
+            "largest_batch": self.largest_batch,
+            "throttled_s": round(self.throttled_seconds, 3),
+        }
+
+    async def close(self):
+        """Stop the dispatcher and wait for the requests in flight"""
+        if self._dispatcher is not None:
+            self._dispatcher.cancel()
+            await asyncio.gather(self._dispatcher, *self._in_flight, return_exceptions=True)
+            self._dispatcher = None
+        self._executor.shutdown(wait=False)
+
+    def _dispatcher_done(self, task):
+        """Fail the queued prompts if the dispatcher died, so their callers do not wait forever"""
+        if task.cancelled() or task.exception() is None:
+            return
+        self._failure = task.exception()
+        logger.error("LLM gateway dispatcher failed: %r", self._failure)
+        pending = [self._held] if self._held is not None else []
+        self._held = None
+        while not self._queue.empty():
+            pending.append(self._queue.get_nowait())
+        self._fail(pending, self._failure)
+
+    @staticmethod
+    def _fail(batch, failure):
+        """Fail the prompts of a batch the dispatcher cannot send (cancel them if it was cancelled)"""
+        error = RuntimeError(f"The LLM gateway stopped: {failure}")
+        error.__cause__ = failure
+        for _, _, future in batch:
+            if future.done():
+                continue
+            if isinstance(failure, asyncio.CancelledError):
+                future.cancel()
+            else:
+                future.set_exception(error)
+
+    async def _collect(self):
+        """Wait for a prompt, then gather more for up to the batch window"""
+        loop = asyncio.get_running_loop()
+        if self._held is not None:
+            batch, self._held = [self._held], None
+        else:
+            batch = [await self._queue.get()]
+        deadline = loop.time() + self.batch_window
+        # Function-calling requests carry their declarations and go out alone
+        while batch[0][1] is None and len(batch) < self.provider.max_batch_size:
+            if not self._queue.empty():
+                item = self._queue.get_nowait()
+            else:
+                remaining = deadline - loop.time()
+                if remaining <= 0:
+                    break
+                try:
+                    item = await asyncio.wait_for(self._queue.get(), remaining)
+                except asyncio.TimeoutError:
+                    break
+            if item[1] is not None:
+                self._held = item  # Starts the next request
+                break
+            batch.append(item)
+        # Prompts whose caller gave up (timeout, lost hedge) are not sent
+        return [item for item in batch if not item[2].done()]
+
+    async def _dispatch(self):
+        while True:
+            batch = await self._collect()
+            if not batch:
+                continue
+            try:
+                if self._request_bucket is not None:
+                    self.throttled_seconds += await self._request_bucket.acquire()
+                if self._token_bucket is not None:
+                    tokens = sum(estimate_tokens(prompt) for prompt, _, _ in batch)
+                    self.throttled_seconds += await self._token_bucket.acquire(tokens)
+                await self._slots.acquire()
+            except BaseException as e:
+                self._fail(batch, e)  # Taken off the queue, so _dispatcher_done cannot see them
+                raise
+            task = asyncio.create_task(self._send(batch))
+            self._in_flight.add(task)
+            task.add_done_callback(self._in_flight.discard)
+
+    async def _send(self, batch):
+        loop = asyncio.get_running_loop()
+        prompts = [prompt for prompt, _, _ in batch]
+        declarations = batch[0][1]
+        self.requests += 1
+        self.largest_batch = max(self.largest_batch, len(prompts))
+        try:
+            if declarations is not None:
+                texts = [await loop.run_in_executor(self._executor, self.provider.generate_call,
+                                                    prompts[0], declarations)]
+            elif len(prompts) == 1:
+                texts = [await loop.run_in_executor(self._executor, self.provider.generate, prompts[0])]
+            else:
+                texts = await loop.run_in_executor(self._executor, self.provider.generate_batch, prompts)
+        except Exception as e:
+            if isinstance(e, transient_errors()) and self._request_bucket is not None:
+                # Over the provider's real limit: make every run back off together
+                self._request_bucket.drain()
+            logger.warning("%s request with %s prompt(s) failed: %s", self.provider.name, len(prompts), e)
+            for _, _, future in batch:
+                if not future.done():
+                    future.set_exception(e)
+        else:
+            if len(texts) != len(prompts):
+                logger.warning("%s returned %s completion(s) for %s prompt(s)",
+                               self.provider.name, len(texts), len(prompts))
+            for index, (_, _, future) in enumerate(batch):
+                if future.done():
+                    continue
+                if index < len(texts):
+                    future.set_result(texts[index])
+                else:
+                    future.set_exception(TransientProviderError(
+                        f"{self.provider.name} returned no completion for prompt {index + 1} of {len(prompts)}"))
+        finally:
+            self._slots.release()
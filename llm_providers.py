@@ -0,0 +1,229 @@
+"""
+LLM Providers
+
+One interface for the LLM backends the agent clients can use, so the clients
+are no longer tied to google.generativeai and gemini-2.0-flash:
+
+    gemini   Google Gemini through google.generativeai (default)
+    local    A local model behind an OpenAI-compatible completions endpoint
+             (llama.cpp server, vLLM, Ollama, LM Studio, ...). Several prompts
+             are sent in one request, which these servers batch on the GPU.
+    stub     Canned answers without any model, for offline runs and benchmarks
+
+A provider's generate() and generate_batch() are blocking; llm_gateway.py
+runs them in threads, batches concurrent prompts and applies rate limits.
+
+generate_call() is the native function-calling variant: the tools are passed
+as function declarations and the model answers with a structured FunctionCall
+(name plus JSON arguments) instead of a FUNCTION_CALL text line, or with text
+when it has the final answer.
+
+Configuration (environment variables, e.g. in .env):
+    LLM_PROVIDER    gemini, local or stub (default: gemini)
+    LLM_MODEL       Model name (default: gemini-2.0-flash for gemini, "local" for local)
+    LLM_LOCAL_URL   Base URL of the local server (default: http://127.0.0.1:8080/v1)
+    LLM_MAX_TOKENS  Longest answer requested from the local server (default: 256)
+    GEMINI_API_KEY  API key for gemini
+"""
+
+import json
+import os
+import time
+from dataclasses import dataclass, field
+
+from lazy_imports import lazy_import
+
+# Only the local provider uses requests; imported on first use (see lazy_imports.py)
+requests = lazy_import("requests")
+
+LLM_PROVIDER = os.getenv("LLM_PROVIDER", "gemini")
+LLM_MODEL = os.getenv("LLM_MODEL", "")
+LLM_LOCAL_URL = os.getenv("LLM_LOCAL_URL", "http://127.0.0.1:8080/v1")
+LLM_MAX_TOKENS = int(os.getenv("LLM_MAX_TOKENS", "256"))
+
+
+class TransientProviderError(Exception):
+    """A provider error worth retrying (rate limited, overloaded, unreachable)"""
+
+
+@dataclass
+class FunctionCall:
+    """A structured function call from the model"""
+    name: str
+    args: dict = field(default_factory=dict)
+
+
+class LLMProvider:
+    """Base class of the LLM backends
+
+    Attributes:
+        name (str): Provider name, used for logging and per-provider rate limits
+        max_batch_size (int): Prompts generate_batch() accepts per request; 1 if
+            the backend has no batch requests
+        requests_per_minute (float): Default request rate limit (0 = unlimited)
+    """
+
+    name = "base"
+    max_batch_size = 1
+    requests_per_minute = 0
+
+    def generate(self, prompt):
+        """Return the response text for one prompt (blocking)"""
+        raise NotImplementedError
+
+    def generate_batch(self, prompts):
+        """Return the response texts for several prompts, in order (blocking)
+
+        Providers without batch requests answer them one by one.
+        """
+        return [self.generate(prompt) for prompt in prompts]
+
+    def generate_call(self, prompt, declarations):
+        """Return a FunctionCall or the response text for a prompt with function declarations (blocking)
+
+        Args:
+            prompt (str): The prompt
+            declarations (list): Function declarations: dicts with name, description
+                and parameters (a JSON schema), see agent_loop.function_declarations()
+
+        Providers without function calling answer in text; the agent loop then
+        falls back to parsing a FUNCTION_CALL line.
+        """
+        return self.generate(prompt)
+
+    def warmup(self):
+        """Prepare for the first request, e.g. open the connection (blocking, best effort)"""
+
+
+class GeminiProvider(LLMProvider):
+    """Google Gemini through google.generativeai (one prompt per request)"""
+
+    name = "gemini"
+    # Free-tier limit of gemini-2.0-flash; raise LLM_RPM on a paid plan
+    requests_per_minute = 15
+
+    def __init__(self, model=None, api_key=None):
+        import google.generativeai as genai  # Only needed for this provider
+
+        genai.configure(api_key=api_key or os.getenv("GEMINI_API_KEY"))
+        self.model_name = model or "gemini-2.0-flash"
+        self.model = genai.GenerativeModel(self.model_name)
+
+    def generate(self, prompt):
+        return self.model.generate_content(contents=prompt).text
+
+    def generate_call(self, prompt, declarations):
+        response = self.model.generate_content(
+            contents=prompt,
+            tools=[{"function_declarations": declarations}],
+            # The model may still answer in text (the FINAL_ANSWER)
+            tool_config={"function_calling_config": {"mode": "AUTO"}},
+        )
+        for part in response.candidates[0].content.parts:
+            if part.function_call and part.function_call.name:
+                call = type(part.function_call).to_dict(part.function_call)
+                return FunctionCall(name=call["name"], args=call.get("args") or {})
+        return response.text
+
+
+class LocalProvider(LLMProvider):
+    """A local model behind an OpenAI-compatible /completions endpoint
+
+    The endpoint accepts a list of prompts and returns one choice per prompt,
+    so a whole batch goes out as a single request. Function calls use the
+    /chat/completions endpoint with tools (llama.cpp needs --jinja for it).
+    """
+
+    name = "local"
+    max_batch_size = 16
+
+    def __init__(self, base_url=LLM_LOCAL_URL, model=None, max_tokens=LLM_MAX_TOKENS, timeout=120):
+        self.base_url = base_url.rstrip('/')
+        self.model_name = model or "local"
+        self.max_tokens = max_tokens
+        self.timeout = timeout
+        self._http = requests.Session()  # Keep-alive across requests
+
+    def generate(self, prompt):
+        return self.generate_batch([prompt])[0]
+
+    def warmup(self):
+        # Open the keep-alive connection, so the first prompt does not wait for it
+        try:
+            self._http.get(f"{self.base_url}/models", timeout=2)
+        except requests.RequestException:
+            pass
+
+    def _post(self, path, payload):
+        try:
+            response = self._http.post(f"{self.base_url}/{path}", json=payload, timeout=self.timeout)
+        except (requests.ConnectionError, requests.Timeout) as e:
+            raise TransientProviderError(f"local model unreachable: {e}") from e
+        if response.status_code == 429 or response.status_code >= 500:
+            raise TransientProviderError(f"local model returned HTTP {response.status_code}")
+        response.raise_for_status()
+        return response.json()
+
+    def generate_batch(self, prompts):
+        payload = {"model": self.model_name, "prompt": prompts, "max_tokens": self.max_tokens, "temperature": 0}
+        choices = sorted(self._post("completions", payload)["choices"], key=lambda choice: choice.get("index", 0))
+        return [choice["text"] for choice in choices]
+
+    def generate_call(self, prompt, declarations):
+        # Function calling goes through the chat endpoint (one prompt per request)
+        payload = {
+            "model": self.model_name,
+            "messages": [{"role": "user", "content": prompt}],
+            "tools": [{"type": "function", "function": declaration} for declaration in declarations],
+            "max_tokens": self.max_tokens,
+            "temperature": 0,
+        }
+        message = self._post("chat/completions", payload)["choices"][0]["message"]
+        for tool_call in message.get("tool_calls") or []:
+            function = tool_call["function"]
+            return FunctionCall(name=function["name"], args=json.loads(function.get("arguments") or "{}"))
+        return message.get("content") or ""
+
+
+class StubProvider(LLMProvider):
+    """Answers without a model: respond(prompt) or a fixed FINAL_ANSWER
+
+    respond may return a FunctionCall, which generate_call() passes on.
+
+    Each request takes latency seconds however many prompts it carries, like
+    a batching model server, so batching effects show up in benchmarks.
+    """
+
+    name = "stub"
+    max_batch_size = 16
+
+    def __init__(self, respond=None, latency=0.0):
+        self.respond = respond or (lambda prompt: "FINAL_ANSWER: [stub]")
+        self.latency = latency
+        self.requests = 0
+
+    def generate(self, prompt):
+        return self.generate_batch([prompt])[0]
+
+    def generate_batch(self, prompts):
+        self.requests += 1
+        if self.latency:
+            time.sleep(self.latency)
+        return [self.respond(prompt) for prompt in prompts]
+
+
+PROVIDERS = {"gemini": GeminiProvider, "local": LocalProvider, "stub": StubProvider}
+
+
+def create_provider(name=None, model=None):
+    """Create the provider named by name (default: LLM_PROVIDER)
+
+    Raises:
+        ValueError: For an unknown provider name
+    """
+    name = name or LLM_PROVIDER
+    if name not in PROVIDERS:
+        raise ValueError(f"Unknown LLM provider {name!r}, expected one of: {', '.join(PROVIDERS)}")
+    if name == "stub":
+        return StubProvider()
+    return PROVIDERS[name](model=model or LLM_MODEL or None)
@@ -1,6 +1,320 @@
-def main():
-    print("Hello from agentic-ai-mcppaint-tool!")
+"""
+Batch Runner
+
+Runs many queries through the agent loop against one MCP server connection.
+Queries are read from a JSON lines file (or stdin), one per line, either as a
+JSON string or as an object with a "query" and an optional "id":
+
+    {"id": "q1", "query": "Add 2 and 3, then multiply the result by 4."}
+    "Find the ASCII values of characters in INDIA."
+
+Up to --concurrency runs are in flight at once. They share the server session
+and the LLM gateway, so their prompts are batched and rate limited together.
+Each result is written to the output as one JSON line as soon as its run
+completes (in completion order, not input order) and flushed, so a job that
+is killed keeps every result it finished:
+
+    {"id": "q1", "query": "...", "status": "answered", "final_answer": "[20]",
+     "iterations": 3, "llm_calls": 3, "completed_by": null, "error": null,
+     "timings": {"run_s": 1.92, "llm_s": 1.71, "tool_s": 0.05}}
+
+status is "answered", "no_answer" (the run used up its iterations or stopped
+making progress without a FINAL_ANSWER), "interrupted" (the run stopped early
+because the LLM or a tool failed), "error" (the run raised) or "invalid" (the
+input line is not a query). A line without an "id" gets its line number as id.
+
+With --resume, queries whose id is already in the output file are skipped and
+new results are appended, so a job can simply be started again after it was
+interrupted; failed runs ("interrupted" and "error") are run again. Runs that
+were cut off mid-way continue from their checkpoint (AGENT_CHECKPOINT_DB),
+keyed by id.
+
+Usage:
+    python main.py queries.jsonl --output results.jsonl --concurrency 8
+    cat queries.jsonl | python main.py - > results.jsonl
+    python main.py queries.jsonl --output results.jsonl --resume
+
+Configuration (environment variables, e.g. in .env):
+    BATCH_CONCURRENCY  Runs in flight at once (default: 4, overridden by --concurrency)
+    BATCH_SERVER       Server script started over stdio (default: example2-3_Gmail_2.py)
+    MCP_SERVER_URL     Use a running http/sse server instead (see server_transport.py)
+"""
+
+# Import necessary libraries
+import argparse
+import os
+from dotenv import load_dotenv
+# Load environment variables from .env file before the local modules below read
+# their settings from the environment
+load_dotenv()
+from mcp import ClientSession, StdioServerParameters
+import asyncio
+import json
+import sys
+import time
+from agent_loop import MAX_ITERATIONS, describe_tools, run_agent, run_finished
+from llm_client import ResilientLLM
+from llm_gateway import LLMGateway
+from llm_providers import create_provider
+from planner import AGENT_MODE, run_planned
+from tool_selector import select_tools
+from run_checkpoint import AGENT_CHECKPOINT_DB, CheckpointStore
+from tracing import Tracer
+from agent_logging import setup_logging
+from server_transport import connect_server
+
+# Leveled logging through a background queue; logs go to stderr, so stdout can carry the results
+logger = setup_logging("batch")
+
+BATCH_CONCURRENCY = int(os.getenv("BATCH_CONCURRENCY", "4"))
+BATCH_SERVER = os.getenv("BATCH_SERVER", "example2-3_Gmail_2.py")
+
+# Post-tool delays (seconds) that give slow side effects time to complete
+POST_TOOL_DELAYS = {"send_email": 2}
+
+# Tools that finish the run once they succeed with the answer known
+TERMINAL_TOOLS = {"send_email"}
+
+# Runs that are done and skipped by --resume ("interrupted" and "error" runs are run again)
+DONE_STATUSES = ("answered", "no_answer", "invalid")
+
+SYSTEM_PROMPT = """You are an agent that solves text-based and mathematical problems in iterations, using the tools below.
+
+Available tools:
+{tools_description}
+
+You must respond with EXACTLY ONE line in one of these formats (no additional text):
+1. For function calls:
+   FUNCTION_CALL: function_name|param1|param2|...
+
+2. For final answers:
+   FINAL_ANSWER: [your answer]
+
+CRITICAL INSTRUCTIONS:
+- Provide ONLY ONE function call per iteration; its result is returned before your next action
+- Only call functions whose output is needed to answer the query
+- Prefer 'evaluate' when several arithmetic steps can be combined into one formula - it accepts the math tools as functions
+- For array parameters, pass all values in a single parameter separated by commas
+- Long lists are returned as a handle like res://4 or $r2 with a short preview - pass the handle itself as the parameter
+- Do not repeat function calls with the same parameters - if a call gives an error, try a different format
+- Only give FINAL_ANSWER when all necessary steps are done
+
+Examples:
+- FUNCTION_CALL: add|5|3
+- FUNCTION_CALL: strings_to_chars_to_int|INDIA
+- FUNCTION_CALL: evaluate|mine(add(5, 3), 2) * power(2, 3)
+- FUNCTION_CALL: int_list_to_exponential_sum|73,78,68,73,65
+- FUNCTION_CALL: int_list_to_exponential_sum|res://4
+- FINAL_ANSWER: [Delhi]
+- FINAL_ANSWER: [0, 1, 1, 2, 3, 5]
+
+DO NOT include any explanations or additional text.
+Your entire response should be a single line starting with either FUNCTION_CALL: or FINAL_ANSWER:"""
+
+
+def parse_args(argv=None):
+    """Parse the command line"""
+    parser = argparse.ArgumentParser(description="Run a JSON lines file of queries through the MCP agent")
+    parser.add_argument("input", nargs="?", default="-",
+                        help="JSON lines file of queries, or - for stdin (default: -)")
+    parser.add_argument("--output", "-o", default="-",
+                        help="JSON lines file the results are appended to, or - for stdout (default: -)")
+    parser.add_argument("--concurrency", "-c", type=int, default=BATCH_CONCURRENCY,
+                        help=f"Runs in flight at once (default: {BATCH_CONCURRENCY})")
+    parser.add_argument("--server", default=BATCH_SERVER,
+                        help=f"MCP server script started over stdio (default: {BATCH_SERVER})")
+    parser.add_argument("--max-iterations", type=int, default=MAX_ITERATIONS,
+                        help=f"Iterations per run (default: {MAX_ITERATIONS})")
+    parser.add_argument("--resume", action="store_true",
+                        help="Skip queries whose id is already in the output file and append to it")
+    return parser.parse_args(argv)
+
+
+def parse_query(line, line_number):
+    """Turn an input line into (id, query); query is None if the line is not a valid query"""
+    try:
+        record = json.loads(line)
+    except json.JSONDecodeError:
+        return line_number, None
+    if isinstance(record, str):
+        return line_number, record
+    if isinstance(record, dict) and isinstance(record.get("query"), str):
+        return record.get("id", line_number), record["query"]
+    return line_number, None
+
+
+def completed_ids(path):
+    """Ids of the finished runs in an earlier output file (a cut-off last line is ignored)"""
+    done = set()
+    if path == "-" or not os.path.exists(path):
+        return done
+    with open(path, encoding="utf-8") as f:
+        for line in f:
+            try:
+                record = json.loads(line)
+            except json.JSONDecodeError:
+                continue
+            if record.get("status") in DONE_STATUSES:
+                done.add(json.dumps(record.get("id")))
+    return done
+
+
+def open_output(path, resume):
+    """Open the output for appending (stdout for -), completing a cut-off last line first"""
+    if path == "-":
+        return sys.stdout
+    if not resume and os.path.exists(path) and os.path.getsize(path):
+        raise SystemExit(f"{path} already has results; pass --resume to continue it, or choose another file")
+    f = open(path, "a+", encoding="utf-8")
+    if f.tell():
+        f.seek(f.tell() - 1)
+        if f.read(1) != "\n":
+            f.write("\n")  # The job was killed mid-write; keep the broken line separate
+    return f
+
+
+def span_seconds(tracer, name):
+    """Total seconds of a run's spans with the given name"""
+    return round(sum(record["duration_ms"] for record in tracer.spans if record["span"] == name) / 1000, 3)
+
+
+class BatchRunner:
+    """Runs queries with a bounded number in flight and writes each result as it completes"""
+
+    def __init__(self, session, tools, generate, output, concurrency, max_iterations, store=None, skip=()):
+        self.session = session
+        self.tools = tools
+        self.generate = generate
+        self.output = output
+        self.concurrency = max(1, concurrency)
+        self.max_iterations = max_iterations
+        self.store = store
+        self.skip = set(skip)
+        self.counts = {"answered": 0, "no_answer": 0, "interrupted": 0, "error": 0, "invalid": 0, "skipped": 0}
+
+    def write(self, record):
+        """Append one result line and flush it, so it survives the job being killed"""
+        self.output.write(json.dumps(record, default=str) + "\n")
+        self.output.flush()
+        self.counts[record["status"]] += 1
+
+    async def run_query(self, run_id, query):
+        """Run one query and return its result record"""
+        record = {"id": run_id, "query": query, "status": "error", "final_answer": None,
+                  "iterations": 0, "llm_calls": 0, "completed_by": None, "error": None}
+        # A tracer per run (spans still go to AGENT_TRACE_FILE), without the per-run summary table
+        tracer = Tracer()
+        start = time.perf_counter()
+        try:
+            catalog = select_tools(self.tools, query)
+            system_prompt = SYSTEM_PROMPT.format(tools_description=describe_tools(catalog))
+            # Keyed by id, so the same query under two ids is two runs
+            checkpoint = self.store.open_run(query, key=json.dumps(run_id)) if self.store else None
+            run = run_planned if AGENT_MODE == "plan" else run_agent
+            state = await run(
+                self.session, self.tools, system_prompt, query, self.generate,
+                post_tool_delays=POST_TOOL_DELAYS, max_iterations=self.max_iterations, tracer=tracer,
+                catalog=catalog, terminal_tools=TERMINAL_TOOLS, checkpoint=checkpoint
+            )
+            if state.final_answer is not None:
+                status = "answered"
+            else:
+                # Stopped early by an LLM or tool failure: --resume continues it from its checkpoint
+                status = "no_answer" if run_finished(state, self.max_iterations) else "interrupted"
+            record.update(
+                status=status,
+                # state.iteration counts completed iterations; the one that answered breaks out first
+                final_answer=state.final_answer, iterations=min(state.iteration + 1, self.max_iterations),
+                llm_calls=state.llm_calls, completed_by=state.completed_by,
+            )
+        except Exception as e:
+            logger.exception("Run %s failed: %s", run_id, e)
+            record["error"] = f"{type(e).__name__}: {e}"
+        finally:
+            tracer.close()
+        record["timings"] = {
+            "run_s": round(time.perf_counter() - start, 3),
+            "llm_s": span_seconds(tracer, "llm_call"),
+            "tool_s": span_seconds(tracer, "tool_call") + span_seconds(tracer, "plan_step"),
+        }
+        return record
+
+    async def worker(self, queue):
+        """Take queries off the queue until the None sentinel"""
+        while (item := await queue.get()) is not None:
+            self.write(await self.run_query(*item))
+
+    async def run(self, lines):
+        """Run every query read from lines (an iterator of input lines)
+
+        Reading stays at most a few lines ahead of the workers, so inputs of any
+        size are streamed instead of loaded into memory.
+        """
+        queue = asyncio.Queue(maxsize=2 * self.concurrency)
+        workers = [asyncio.create_task(self.worker(queue)) for _ in range(self.concurrency)]
+        try:
+            line_number = 0
+            # Read in a thread, so a slow stdin does not block the runs in flight
+            while line := await asyncio.to_thread(next, lines, ""):
+                line_number += 1
+                if not line.strip():
+                    continue
+                run_id, query = parse_query(line, line_number)
+                if json.dumps(run_id) in self.skip:
+                    self.counts["skipped"] += 1
+                    continue
+                if query is None:
+                    self.write({"id": run_id, "query": None, "status": "invalid",
+                                "error": f"Line {line_number} is not a JSON string or object with a query"})
+                    continue
+                await queue.put((run_id, query))
+            for _ in workers:
+                await queue.put(None)
+            await asyncio.gather(*workers)
+        finally:
+            for task in workers:
+                task.cancel()
+
+
+async def main(argv=None):
+    args = parse_args(argv)
+    skip = completed_ids(args.output) if args.resume else set()
+    if skip:
+        logger.info("Resuming: %s queries already have results in %s", len(skip), args.output)
+    output = open_output(args.output, args.resume)
+    source = sys.stdin if args.input == "-" else open(args.input, encoding="utf-8")
+
+    # LLM backend (LLM_PROVIDER) behind the gateway that batches the concurrent runs' prompts
+    gateway = LLMGateway(create_provider())
+    llm = ResilientLLM(gateway.generate)
+    store = CheckpointStore(AGENT_CHECKPOINT_DB) if AGENT_CHECKPOINT_DB else None
+
+    server_params = StdioServerParameters(command=sys.executable, args=[args.server])
+    start = time.perf_counter()
+    try:
+        async with connect_server(server_params) as (read, write):
+            async with ClientSession(read, write) as session:
+                await session.initialize()
+                tools = (await session.list_tools()).tools
+                logger.info("Connected: %s tools, %s runs in flight", len(tools), args.concurrency)
+                runner = BatchRunner(session, tools, llm, output, args.concurrency, args.max_iterations,
+                                     store=store, skip=skip)
+                await runner.run(iter(source))
+    finally:
+        await gateway.close()
+        if store is not None:
+            store.close()
+        if source is not sys.stdin:
+            source.close()
+        if output is not sys.stdout:
+            output.close()
+
+    elapsed = time.perf_counter() - start
+    finished = sum(count for status, count in runner.counts.items() if status != "skipped")
+    logger.info("Batch done in %.1fs (%.2f runs/s): %s", elapsed, finished / elapsed if elapsed else 0.0,
+                runner.counts)
+    logger.info("LLM calls: %s, gateway: %s", llm.stats(), gateway.stats())
 
 
 if __name__ == "__main__":
-    main()
+    asyncio.run(main())
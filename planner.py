@@ -0,0 +1,378 @@
+"""
+Plan-Then-Execute Mode
+
+The iterative loop (agent_loop.py) asks the LLM for one FUNCTION_CALL per
+round trip, even when the whole sequence of tool calls is known up front.
+In plan mode the LLM is asked once for the complete plan:
+
+    PLAN:
+    1. length_string|New Delhi
+    2. strings_to_chars_to_int|INDIA
+    3. fibonacci_numbers|$1
+    4. int_list_to_exponential_sum|$2
+    5. send_email|me@example.com|Results|Fibonacci: $3, exponential sum: $4
+    FINAL_ANSWER: [$3]
+
+$N stands for the result of step N, either as a whole parameter (the native
+value is passed on, a server-side list by its res:// handle) or inside text.
+The steps form a small DAG that is executed locally against the MCP session:
+a step starts as soon as the steps it refers to are done, so independent
+steps (1 and 2 above, 3 and 4) run in parallel. Tools with a post-tool delay
+(Paint operations, email) have side effects whose order matters; they wait
+for every earlier step, and every later step waits for them.
+
+If the response is not a usable plan or a step fails, the steps that did
+complete are added to the history and the run continues in the iterative
+loop, so a plan that goes wrong costs one extra LLM call, not the run. A
+response with a single FUNCTION_CALL instead of a plan costs nothing extra:
+the loop starts with that call.
+
+With a checkpoint (see run_checkpoint.py) the plan is saved before it runs and
+the run is saved after every completed step, so a resumed run continues the
+same plan and skips the steps that already ran (an email is not sent twice).
+A run that had already fallen back continues in the iterative loop.
+
+Configuration (environment variables, e.g. in .env):
+    AGENT_MODE   plan or iterative (default: iterative); read by the clients
+"""
+
+import asyncio
+import json
+import logging
+import os
+import re
+from dataclasses import dataclass, field
+
+from agent_loop import (
+    MAX_ITERATIONS,
+    SERVER_HANDLE_PATTERN,
+    RunState,
+    call_fingerprint,
+    coerce_argument,
+    decode_tool_result,
+    format_value,
+    remember_call,
+    run_agent,
+)
+from history_compactor import HISTORY_TOKEN_BUDGET, SUMMARY_LIST_ITEMS, HistoryEntry, estimate_tokens, tool_call_entry
+from tracing import Tracer
+
+AGENT_MODE = os.getenv("AGENT_MODE", "iterative")
+
+# "3. fibonacci_numbers|$1" (also "3)" and "3:")
+STEP_LINE = re.compile(r"(\d+)\s*[.):]\s*(.+)")
+
+# $1, $2, ... (but not the $r1 result handles of the iterative loop)
+STEP_REFERENCE = re.compile(r"\$(\d+)\b")
+
+PLAN_INSTRUCTIONS = """Plan the whole task at once. Instead of a single line, reply with the complete plan:
+PLAN:
+1. function_name|param1|param2|...
+2. function_name|$1|...
+FINAL_ANSWER: [$2]
+
+$N stands for the result of step N; use it as a whole parameter or inside a text parameter.
+Steps that do not depend on each other run in parallel. Only use the tools listed above.
+If the task cannot be planned up front, reply with a single FUNCTION_CALL line instead."""
+
+logger = logging.getLogger(__name__)
+
+
+class PlanError(Exception):
+    """The LLM's response is not a usable plan"""
+
+
+@dataclass
+class PlanStep:
+    """One tool call of a plan"""
+    number: int
+    tool: str
+    params: list
+    depends_on: set = field(default_factory=set)
+
+
+def parse_plan(response_text, tools_by_name):
+    """Parse a PLAN: response into its steps and final answer line
+
+    Args:
+        response_text (str): The LLM's response
+        tools_by_name (dict): The available tools
+
+    Returns:
+        tuple: (list of PlanStep, the FINAL_ANSWER line or None)
+
+    Raises:
+        PlanError: If the response is not a plan, or a step is malformed, uses an
+            unknown tool or refers to a step that does not come before it
+    """
+    lines = [line.strip() for line in response_text.strip().splitlines() if line.strip()]
+    start = next((i for i, line in enumerate(lines) if line.startswith("PLAN:")), None)
+    if start is None:
+        raise PlanError("the response is not a PLAN")
+
+    steps = []
+    final_answer = None
+    for line in lines[start + 1:]:
+        if line.startswith("FINAL_ANSWER:"):
+            final_answer = line
+            break
+        match = STEP_LINE.fullmatch(line)
+        if not match:
+            raise PlanError(f"cannot parse plan line: {line}")
+        number = int(match.group(1))
+        if number != len(steps) + 1:
+            raise PlanError(f"expected step {len(steps) + 1}, got step {number}")
+        parts = [part.strip() for part in match.group(2).split("|")]
+        if parts[0] not in tools_by_name:
+            raise PlanError(f"step {number} uses an unknown tool: {parts[0]}")
+        depends_on = {int(ref) for part in parts[1:] for ref in STEP_REFERENCE.findall(part)}
+        if any(ref < 1 or ref >= number for ref in depends_on):
+            raise PlanError(f"step {number} refers to a step that does not come before it")
+        steps.append(PlanStep(number=number, tool=parts[0], params=parts[1:], depends_on=depends_on))
+
+    if not steps:
+        raise PlanError("the plan has no steps")
+    return steps, final_answer
+
+
+def order_side_effects(steps, ordered_tools):
+    """Make steps of tools with ordered side effects wait for, and block, their neighbours"""
+    barrier = None
+    for step in steps:
+        if step.tool in ordered_tools:
+            step.depends_on |= {earlier.number for earlier in steps[:step.number - 1]}
+            barrier = step.number
+        elif barrier is not None:
+            step.depends_on.add(barrier)
+
+
+def _reference_value(value):
+    """What $N passes on: a server-side list by its handle, anything else as is"""
+    if isinstance(value, dict) and SERVER_HANDLE_PATTERN.fullmatch(str(value.get('handle', ''))):
+        return value['handle']
+    return value
+
+
+def substitute_references(text, results):
+    """Replace every $N inside text with the result of step N (text as is, other values as JSON)"""
+    def replace(match):
+        value = _reference_value(results[int(match.group(1))])
+        return value if isinstance(value, str) else json.dumps(value)
+    return STEP_REFERENCE.sub(replace, text)
+
+
+def build_step_arguments(tool, params, results, state):
+    """Build the call_tool arguments of a plan step, resolving $N references
+
+    Raises:
+        ValueError: If a required parameter is missing
+    """
+    arguments = {}
+    schema_properties = tool.inputSchema.get('properties', {})
+    required_params = tool.inputSchema.get('required', [])
+    params = list(params)
+    for param_name, param_info in schema_properties.items():
+        if not params:
+            if param_name not in required_params:
+                continue
+            raise ValueError(f"Not enough parameters provided for {tool.name}")
+        raw = params.pop(0)
+        reference = STEP_REFERENCE.fullmatch(raw.strip())
+        value = _reference_value(results[int(reference.group(1))]) if reference else None
+        if isinstance(value, (list, dict)):
+            # Native lists and objects go to the tool as they are, without a text round trip
+            arguments[param_name] = value
+        elif reference:
+            arguments[param_name] = coerce_argument(str(value), param_info, state)
+        else:
+            arguments[param_name] = coerce_argument(substitute_references(raw, results), param_info, state)
+    return arguments
+
+
+async def execute_plan(session, tools_by_name, steps, state, tracer, post_tool_delays, checkpoint=None):
+    """Run the steps of a plan, each as soon as the steps it depends on are done
+
+    Each step is recorded in the run state (results, handles and history, one
+    iteration per step) as soon as it completes, and checkpointed before its
+    post-tool sleep. Steps already in state.plan_results (a resumed run) are
+    not run again; their saved results are used.
+
+    Returns:
+        dict: Step number -> result value
+
+    Raises:
+        The error of the first step that failed
+    """
+    results = {int(number): value for number, value in state.plan_results.items()}
+    tasks = {}
+    # Tools that change state outside the run (Paint, email) are never answered from the memo
+    side_effect_tools = set(post_tool_delays)
+
+    async def run_step(step):
+        if step.number in results:
+            return  # Completed before the run was interrupted
+        if step.depends_on:
+            await asyncio.gather(*(tasks[number] for number in step.depends_on))
+        tool = tools_by_name[step.tool]
+        with tracer.span("plan_step", step=step.number, tool=step.tool):
+            step_arguments = build_step_arguments(tool, step.params, results, state)
+            result = await session.call_tool(step.tool, arguments=step_arguments)
+            value = decode_tool_result(result)
+            if getattr(result, 'isError', False):
+                raise RuntimeError(f"{step.tool} failed: {value}")
+        logger.debug("Step %s (%s) returned %s", step.number, step.tool, value)
+        results[step.number] = value
+        _record_step(step, value, step_arguments, state, side_effect_tools)
+        if checkpoint is not None:
+            # The step is done: a resumed run does not call it (e.g. send the email) again
+            checkpoint.log_call(state.iteration, step.tool, step_arguments, value)
+            checkpoint.save(state)
+        if step.tool in post_tool_delays:
+            with tracer.span("post_tool_sleep", step=step.number, tool=step.tool):
+                await asyncio.sleep(post_tool_delays[step.tool])
+
+    for step in steps:
+        tasks[step.number] = asyncio.ensure_future(run_step(step))
+    try:
+        await asyncio.gather(*tasks.values())
+    finally:
+        for task in tasks.values():
+            task.cancel()
+        await asyncio.gather(*tasks.values(), return_exceptions=True)
+    return results
+
+
+def _record_step(step, value, arguments, state, side_effect_tools=()):
+    """Add a completed step to the run state as one iteration
+
+    Steps that failed or never ran do not count against max_iterations of the
+    fallback loop, whose iterations continue after the completed steps (so
+    they do not reuse the steps' handle numbers either).
+    """
+    # format_value and store_handle name handles after the current iteration
+    state.results.append(value)
+    result_str = format_value(value, state)
+    full = (f"In step {step.number} of the plan you called {step.tool} with "
+            f"{arguments} parameters, and the function returned {result_str}.")
+    handle = None
+    if isinstance(value, list) and len(value) > 2 * SUMMARY_LIST_ITEMS:
+        handle = state.store_handle(value)
+    state.history.append(tool_call_entry(step.number, step.tool, full, arguments, value, handle))
+    state.last_response = value
+    state.plan_results[str(step.number)] = value
+    # After a fallback, the loop answers a repeat of a completed step from the memo
+    remember_call(state, step.tool, call_fingerprint(step.tool, arguments), value, False, side_effect_tools)
+    state.iteration += 1
+
+
+async def _plan_and_execute(session, tools_by_name, system_prompt, generate, post_tool_delays, state, tracer,
+                            checkpoint=None):
+    """Get the plan (or continue the saved one) and run it; return True if the run is finished, False to fall back"""
+    if state.plan is not None:
+        logger.info("Continuing the saved plan after %s completed steps", len(state.plan_results))
+        try:
+            steps, final_answer = parse_plan(state.plan, tools_by_name)
+        except PlanError as e:  # The server's tools changed since the plan was made
+            logger.warning("Cannot continue the saved plan (%s), continuing step by step", e)
+            state.plan = None
+            return False
+        return await _execute(session, tools_by_name, steps, final_answer, post_tool_delays, state, tracer,
+                              checkpoint)
+
+    prompt = f"{system_prompt}\n\n{PLAN_INSTRUCTIONS}\n\nQuery: {state.query}"
+    try:
+        with tracer.span("llm_call", iteration=0, mode="plan") as attributes:
+            response_text = (await generate(prompt)).strip()
+            attributes["response_chars"] = len(response_text)
+        state.llm_calls += 1
+        state.output_tokens += estimate_tokens(response_text)
+    except Exception as e:
+        logger.error("Failed to get a plan from the LLM: %s", e)
+        return False
+    logger.info("Plan: %s", response_text)
+
+    if response_text.startswith("FINAL_ANSWER:"):
+        state.final_answer = response_text  # Nothing to call
+        return True
+    try:
+        with tracer.span("plan_parse"):
+            steps, final_answer = parse_plan(response_text, tools_by_name)
+    except PlanError as e:
+        if any(line.strip().startswith("FUNCTION_CALL:") for line in response_text.splitlines()):
+            # The instructions allow a single FUNCTION_CALL instead of a plan: the
+            # loop starts with it instead of asking the LLM again
+            logger.info("No plan, continuing step by step with the response's FUNCTION_CALL")
+            state.pending_response = response_text
+        else:
+            logger.warning("Cannot use the plan (%s), continuing step by step", e)
+        return False
+    state.plan = response_text
+    if checkpoint is not None:
+        checkpoint.save(state)  # A resumed run continues this plan instead of asking for a new one
+    return await _execute(session, tools_by_name, steps, final_answer, post_tool_delays, state, tracer, checkpoint)
+
+
+async def _execute(session, tools_by_name, steps, final_answer, post_tool_delays, state, tracer, checkpoint):
+    """Run the parsed plan and set the final answer; return True if the run is finished, False to fall back"""
+    order_side_effects(steps, set(post_tool_delays))
+    try:
+        results = await execute_plan(session, tools_by_name, steps, state, tracer, post_tool_delays, checkpoint)
+    except Exception as e:
+        logger.warning("Plan failed (%s: %s), continuing step by step", type(e).__name__, e)
+        error = f"Executing the plan failed: {e}. Continue the task from here."
+        state.history.append(HistoryEntry(full=error, summary=error, elided=error))
+        state.plan = None  # A resumed run continues in the iterative loop
+        if checkpoint is not None:
+            checkpoint.save(state)
+        return False
+
+    if final_answer is None:
+        final_answer = f"FINAL_ANSWER: [{format_value(results[len(steps)], state)}]"
+    state.final_answer = state.expand_handles(substitute_references(final_answer, results))
+    logger.info("=== Agent Execution Complete ===")
+    logger.info("Final answer: %s", state.final_answer)
+    return True
+
+
+async def run_planned(session, tools, system_prompt, query, generate,
+                      post_tool_delays=None, max_iterations=MAX_ITERATIONS, tracer=None,
+                      history_token_budget=HISTORY_TOKEN_BUDGET, catalog=None, terminal_tools=(),
+                      checkpoint=None):
+    """Solve a query with one planning LLM call, falling back to run_agent on failure
+
+    Takes the same arguments as agent_loop.run_agent(). A run resumed from a
+    checkpoint continues its saved plan, or the iterative loop if it had
+    already fallen back to it.
+
+    Returns:
+        RunState: The finished run; each completed plan step counts as one iteration
+    """
+    resumed = checkpoint.state if checkpoint is not None else None
+    if resumed is not None and resumed.plan is None:
+        return await run_agent(session, tools, system_prompt, query, generate, post_tool_delays,
+                               max_iterations, tracer=tracer, state=resumed, catalog=catalog,
+                               terminal_tools=terminal_tools, checkpoint=checkpoint)
+    state = resumed or RunState(query=query, history_token_budget=history_token_budget)
+    post_tool_delays = post_tool_delays or {}
+    tools_by_name = {tool.name: tool for tool in tools}
+    owns_tracer = tracer is None
+    if owns_tracer:
+        tracer = Tracer()
+
+    try:
+        with tracer.span("run", query=query, mode="plan") as run_attributes:
+            planned = await _plan_and_execute(session, tools_by_name, system_prompt, generate,
+                                              post_tool_delays, state, tracer, checkpoint)
+            run_attributes["planned"] = planned
+            run_attributes["steps"] = state.iteration
+        if planned and checkpoint is not None:
+            checkpoint.finish(state)
+        if not planned:
+            await run_agent(session, tools, system_prompt, query, generate, post_tool_delays,
+                            max_iterations, tracer=tracer, state=state, catalog=catalog,
+                            terminal_tools=terminal_tools, checkpoint=checkpoint)
+    finally:
+        if owns_tracer:
+            tracer.print_summary()
+            tracer.close()
+    return state
@@ -0,0 +1,178 @@
+"""
+Server-Side Result Store
+
+Large intermediate values such as fibonacci_numbers(n) or strings_to_chars_to_int
+on a long text used to travel in full over the stdio pipe, get pasted into the
+LLM prompt, and then come back again as the argument of the next tool. With the
+result store, a large list result stays on the server and the tool returns a
+short handle instead:
+
+    {"handle": "res://42", "length": 500, "preview": {"head": [...], "tail": [...]}}
+
+Every list-accepting tool accepts such a handle in place of the list, and text
+parameters (like an email body) have handles replaced with the stored values.
+
+Each MCP session gets its own bounded LRU store, so clients never see each
+other's results and memory stays capped.
+
+Configuration (environment variables, e.g. in .env):
+    RESULT_HANDLE_THRESHOLD    Lists longer than this are returned as handles (default: 20)
+    RESULT_STORE_MAX_ENTRIES   Maximum stored results per session (default: 256)
+    RESULT_STORE_MAX_ITEMS     Maximum list items stored per session (default: 1000000)
+"""
+
+import functools
+import inspect
+import os
+import re
+import weakref
+from collections import OrderedDict
+
+from mcp.server.fastmcp import Context
+
+RESULT_HANDLE_THRESHOLD = int(os.getenv("RESULT_HANDLE_THRESHOLD", "20"))
+RESULT_STORE_MAX_ENTRIES = int(os.getenv("RESULT_STORE_MAX_ENTRIES", "256"))
+RESULT_STORE_MAX_ITEMS = int(os.getenv("RESULT_STORE_MAX_ITEMS", "1000000"))
+
+# Number of items shown at each end of a preview
+PREVIEW_ITEMS = 5
+
+HANDLE_PREFIX = "res://"
+HANDLE_PATTERN = re.compile(r"res://(\d+)")
+
+
+class ResultStore:
+    """A bounded LRU store of large tool results for one session"""
+
+    def __init__(self, max_entries=RESULT_STORE_MAX_ENTRIES, max_items=RESULT_STORE_MAX_ITEMS):
+        self.max_entries = max_entries
+        self.max_items = max_items
+        self._values = OrderedDict()
+        self._items = 0
+        self._next_id = 1
+
+    def put(self, value):
+        """Store a list and return its handle, evicting the least recently used results if needed"""
+        handle = f"{HANDLE_PREFIX}{self._next_id}"
+        self._next_id += 1
+        self._values[handle] = value
+        self._items += len(value)
+        while len(self._values) > 1 and (len(self._values) > self.max_entries or self._items > self.max_items):
+            _, evicted = self._values.popitem(last=False)
+            self._items -= len(evicted)
+        return handle
+
+    def get(self, handle):
+        """Return the value stored under a handle
+
+        Raises:
+            KeyError: If the handle is unknown or has been evicted
+        """
+        handle = handle.strip()
+        if handle not in self._values:
+            raise KeyError(f"Unknown or expired result handle: {handle}")
+        self._values.move_to_end(handle)
+        return self._values[handle]
+
+    def resolve(self, value):
+        """Replace a handle (or handles inside a dict of values) with the stored values"""
+        if isinstance(value, str) and HANDLE_PATTERN.fullmatch(value.strip()):
+            return self.get(value)
+        if isinstance(value, dict):
+            return {key: self.resolve(item) for key, item in value.items()}
+        return value
+
+    def expand(self, text):
+        """Replace every handle inside a piece of text with the stored list"""
+        def replace(match):
+            try:
+                return str(self.get(match.group(0)))
+            except KeyError:
+                return match.group(0)
+        return HANDLE_PATTERN.sub(replace, text)
+
+    def wrap(self, value):
+        """Return large lists as a handle with a preview, anything else unchanged"""
+        if not isinstance(value, list) or len(value) <= RESULT_HANDLE_THRESHOLD:
+            return value
+        return {
+            "handle": self.put(value),
+            "length": len(value),
+            "preview": {"head": value[:PREVIEW_ITEMS], "tail": value[-PREVIEW_ITEMS:]},
+        }
+
+    def stats(self):
+        """Return the number of stored results and list items"""
+        return {"entries": len(self._values), "items": self._items}
+
+
+# One store per MCP session; entries disappear together with their session
+_session_stores = weakref.WeakKeyDictionary()
+# Used when a tool is called without a session (e.g. directly from Python)
+_default_store = ResultStore()
+
+
+def store_for(ctx):
+    """Return the result store of the session behind a FastMCP Context"""
+    session = None
+    if ctx is not None:
+        try:
+            session = ctx.session
+        except (ValueError, LookupError, AttributeError):
+            session = None
+    if session is None:
+        return _default_store
+    store = _session_stores.get(session)
+    if store is None:
+        store = _session_stores[session] = ResultStore()
+    return store
+
+
+def with_result_store(lists=(), texts=(), store_output=False):
+    """Let a tool accept result handles and/or return large lists as handles
+
+    Apply it directly below @mcp.tool(). The tool's schema is extended so the
+    given list parameters also accept a handle string, and a FastMCP Context
+    parameter is added so the tool can find its session's store.
+
+    Args:
+        lists (tuple): Names of list (or dict) parameters that may be passed as handles
+        texts (tuple): Names of text parameters in which handles are expanded
+        store_output (bool): Return large list results as a handle with a preview
+
+    Returns:
+        A decorator producing an async tool function
+    """
+    def decorator(func):
+        signature = inspect.signature(func)
+
+        @functools.wraps(func)
+        async def wrapper(*args, ctx=None, **kwargs):
+            store = store_for(ctx)
+            bound = signature.bind(*args, **kwargs)
+            for name in lists:
+                if name in bound.arguments:
+                    bound.arguments[name] = store.resolve(bound.arguments[name])
+            for name in texts:
+                if isinstance(bound.arguments.get(name), str):
+                    bound.arguments[name] = store.expand(bound.arguments[name])
+            result = func(*bound.args, **bound.kwargs)
+            if inspect.isawaitable(result):
+                result = await result
+            return store.wrap(result) if store_output else result
+
+        # Advertise the handle-accepting parameter types and the Context parameter to FastMCP
+        parameters = [
+            param.replace(annotation=param.annotation | str) if param.name in lists else param
+            for param in signature.parameters.values()
+        ]
+        parameters.append(inspect.Parameter("ctx", inspect.Parameter.KEYWORD_ONLY, default=None, annotation=Context))
+        return_annotation = signature.return_annotation
+        if store_output and return_annotation is not inspect.Signature.empty:
+            return_annotation = return_annotation | dict
+        wrapper.__signature__ = signature.replace(parameters=parameters, return_annotation=return_annotation)
+        wrapper.__annotations__ = {param.name: param.annotation for param in parameters}
+        if return_annotation is not inspect.Signature.empty:
+            wrapper.__annotations__["return"] = return_annotation
+        return wrapper
+    return decorator
@@ -0,0 +1,206 @@
+"""
+Run Checkpoints
+
+Saves the state of every agent run (history, results, handles, the memo of
+tool calls and the counters of RunState) to a local SQLite database as it
+goes, so a run that is interrupted - the LLM keeps timing out, the server
+crashes, the client is killed - can pick up where it stopped instead of
+starting over:
+
+- after each LLM response, before the tool call it asks for, so a resumed
+  run uses the saved response instead of calling the LLM again;
+- after each tool result, before the post-tool sleep, so a resumed run does
+  not call a side-effecting tool (Paint, email) again;
+- in plan mode, after the plan is parsed and after each completed step, so a
+  resumed run continues the same plan and skips the steps that already ran;
+- at the end of each iteration, and when the run ends.
+
+Memoized results that hold res:// handles are not saved: the handles belong
+to the session of the server that made them, so a resumed run calls those
+tools again instead of replaying handles that no longer exist, and the LLM is
+told that the handles in its history are gone. Plan steps whose results hold
+res:// handles run again for the same reason.
+
+Runs are looked up by their query: running a client again with the same
+query resumes its latest interrupted run. Runs that gave a final answer,
+used up their iterations or stopped making progress are done and are not
+resumed. Every tool call is also appended to a tool_calls table, as a log
+of what each run did.
+
+The database uses WAL mode, so a checkpoint costs one small write and
+other processes can read the runs while they are written.
+
+Configuration (environment variables, e.g. in .env):
+    AGENT_CHECKPOINT_DB   SQLite file (default: agent_runs.db, empty disables checkpoints)
+"""
+
+import dataclasses
+import hashlib
+import json
+import logging
+import os
+import sqlite3
+import time
+import uuid
+
+from agent_loop import SERVER_HANDLE_PATTERN, RunState
+from history_compactor import HistoryEntry
+from llm_providers import FunctionCall
+
+AGENT_CHECKPOINT_DB = os.getenv("AGENT_CHECKPOINT_DB", "agent_runs.db")
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS runs (
+    run_id TEXT PRIMARY KEY,
+    run_key TEXT NOT NULL,
+    status TEXT NOT NULL,
+    iteration INTEGER NOT NULL,
+    state TEXT NOT NULL,
+    updated REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS runs_by_key ON runs (run_key, status, updated);
+CREATE TABLE IF NOT EXISTS tool_calls (
+    run_id TEXT NOT NULL,
+    iteration INTEGER NOT NULL,
+    tool TEXT NOT NULL,
+    arguments TEXT NOT NULL,
+    result TEXT NOT NULL,
+    created REAL NOT NULL
+);
+"""
+
+logger = logging.getLogger(__name__)
+
+
+def _references_server(value):
+    """True if a value holds a res:// handle of the server's session store"""
+    if isinstance(value, str):
+        return SERVER_HANDLE_PATTERN.search(value) is not None
+    if isinstance(value, (list, dict)):
+        return SERVER_HANDLE_PATTERN.search(json.dumps(value, default=str)) is not None
+    return False
+
+
+def _replayable_memo(memo):
+    """The memo entries (or plan step results) a resumed run may reuse
+
+    res:// handles live in the server's session and are gone once the server
+    restarts, so a memoized result holding one must not be replayed; a repeat
+    of that call runs the tool again.
+    """
+    return {fingerprint: value for fingerprint, value in memo.items() if not _references_server(value)}
+
+
+def state_to_json(state, **overrides):
+    """Serialize a RunState (overrides replace fields, e.g. the iteration)"""
+    data = dataclasses.asdict(state)
+    data["memo"] = _replayable_memo(state.memo)
+    data.update(overrides)
+    response = state.pending_response
+    if isinstance(response, FunctionCall):
+        data["pending_response"] = {"function_call": dataclasses.asdict(response)}
+    elif response is not None:
+        data["pending_response"] = {"text": response}
+    return json.dumps(data, default=str)
+
+
+def state_from_json(text):
+    """Rebuild a RunState saved by state_to_json()"""
+    data = json.loads(text)
+    fields = {field.name for field in dataclasses.fields(RunState)}
+    data = {key: value for key, value in data.items() if key in fields}
+    data["history"] = [HistoryEntry(**entry) for entry in data.get("history", [])]
+    data["memo"] = _replayable_memo(data.get("memo", {}))  # Also for states saved before handles were dropped
+    data["plan_results"] = _replayable_memo(data.get("plan_results", {}))  # Those steps run again
+    response = data.get("pending_response")
+    if response is not None:
+        data["pending_response"] = (FunctionCall(**response["function_call"]) if "function_call" in response
+                                    else response["text"])
+    return RunState(**data)
+
+
+class CheckpointStore:
+    """SQLite database of agent runs and their tool calls"""
+
+    def __init__(self, path=AGENT_CHECKPOINT_DB):
+        self.path = path
+        self._db = sqlite3.connect(path)
+        self._db.execute("PRAGMA journal_mode=WAL")
+        self._db.execute("PRAGMA synchronous=NORMAL")  # Durable at each WAL checkpoint, no fsync per write
+        self._db.executescript(SCHEMA)
+
+    def open_run(self, query, key=None):
+        """Resume the latest interrupted run of a query, or start a new one
+
+        Args:
+            query (str): The run's query
+            key (str): Identifies runs that may resume each other (default: the query)
+
+        Returns:
+            RunCheckpoint: Its state is the restored RunState, or None for a new run
+        """
+        run_key = hashlib.sha256((key or query).encode()).hexdigest()
+        row = self._db.execute(
+            "SELECT run_id, state FROM runs WHERE run_key = ? AND status = 'interrupted' "
+            "ORDER BY updated DESC LIMIT 1", (run_key,)
+        ).fetchone()
+        if row is None:
+            return RunCheckpoint(self, uuid.uuid4().hex, run_key, None)
+        state = state_from_json(row[1])
+        if any(SERVER_HANDLE_PATTERN.search(entry.full) for entry in state.history):
+            note = ("The run was interrupted: the res:// handles above belonged to the previous server session "
+                    "and no longer exist. Call the tools that returned them again instead of passing the handles.")
+            state.history.append(HistoryEntry(full=note, summary=note, elided=note))
+        logger.info("Resuming run %s after %s completed iterations", row[0], state.iteration)
+        return RunCheckpoint(self, row[0], run_key, state)
+
+    def _write(self, sql, parameters):
+        with self._db:  # One transaction per checkpoint
+            self._db.execute(sql, parameters)
+
+    def close(self):
+        self._db.close()
+
+
+class RunCheckpoint:
+    """Checkpoints of one run; passed to run_agent() or run_planned()
+
+    Attributes:
+        run_id (str): The run's id in the database
+        state (RunState): The state to resume from, or None for a new run
+    """
+
+    def __init__(self, store, run_id, run_key, state):
+        self.store = store
+        self.run_id = run_id
+        self.run_key = run_key
+        self.state = state
+
+    def save(self, state, status="interrupted", **overrides):
+        """Save the state; until the run finishes it counts as interrupted"""
+        self.store._write(
+            "INSERT INTO runs (run_id, run_key, status, iteration, state, updated) VALUES (?, ?, ?, ?, ?, ?) "
+            "ON CONFLICT (run_id) DO UPDATE SET status = excluded.status, iteration = excluded.iteration, "
+            "state = excluded.state, updated = excluded.updated",
+            (self.run_id, self.run_key, status, overrides.get("iteration", state.iteration),
+             state_to_json(state, **overrides), time.time()),
+        )
+
+    def log_call(self, iteration, tool, arguments, value):
+        """Append a tool call to the run's tool call log"""
+        self.store._write(
+            "INSERT INTO tool_calls (run_id, iteration, tool, arguments, result, created) VALUES (?, ?, ?, ?, ?, ?)",
+            (self.run_id, iteration, tool, json.dumps(arguments, default=str), json.dumps(value, default=str),
+             time.time()),
+        )
+
+    def finish(self, state, done=True):
+        """Save the final state; a run that is not done can be resumed"""
+        self.save(state, status="done" if done else "interrupted")
+
+
+def open_checkpoint(query, key=None):
+    """The RunCheckpoint for a query, or None if checkpoints are disabled (AGENT_CHECKPOINT_DB empty)"""
+    if not AGENT_CHECKPOINT_DB:
+        return None
+    return CheckpointStore(AGENT_CHECKPOINT_DB).open_run(query, key)
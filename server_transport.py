@@ -0,0 +1,119 @@
+"""
+Server Transports
+
+Runs the FastMCP servers over the transport picked on the command line, and
+connects the clients to either a server process of their own (stdio) or a
+shared server over the network:
+
+    python example2-3_Gmail_2.py          stdio: one server process per client (default)
+    python example2-3_Gmail_2.py dev      FastMCP dev mode
+    python example2-3_Gmail_2.py http     streamable HTTP, clients connect to http://MCP_HOST:MCP_PORT/mcp
+    python example2-3_Gmail_2.py sse      Server-Sent Events, clients connect to http://MCP_HOST:MCP_PORT/sse
+
+With a network transport one warm server (imports done, worker pool started,
+OAuth token cached) is shared by any number of clients; a client uses it when
+MCP_SERVER_URL is set instead of spawning its own server.
+
+The http transport can run several server processes (MCP_HTTP_WORKERS) behind
+one port. Requests of one client may then reach different processes, so the
+workers run in stateless mode: every request is answered on its own, and large
+lists are returned in full because a res:// handle created in one worker would
+be unknown to the others. The CPU worker pool is split between the processes.
+The sse transport keeps a stream open per client and always runs in one process.
+
+Configuration (environment variables, e.g. in .env):
+    MCP_TRANSPORT     Transport when none is given on the command line (default: stdio)
+    MCP_HOST          Address the http/sse server listens on (default: 127.0.0.1)
+    MCP_PORT          Port of the http/sse server (default: 8000)
+    MCP_HTTP_WORKERS  Server processes for the http transport (default: 1)
+    MCP_SERVER_URL    Client side: URL of a running http/sse server (default: empty,
+                      the client starts its own server over stdio)
+"""
+
+import contextlib
+import os
+import sys
+
+from mcp.client.sse import sse_client
+from mcp.client.stdio import stdio_client
+from mcp.client.streamable_http import streamablehttp_client
+
+TRANSPORTS = ("stdio", "dev", "http", "sse")
+
+
+def run_server(mcp, argv=None):
+    """Run a FastMCP server over the transport named in argv[0] (or MCP_TRANSPORT)
+
+    Args:
+        mcp (FastMCP): The server with its tools registered
+        argv (list): Command line arguments after the script name (default: sys.argv[1:])
+    """
+    argv = sys.argv[1:] if argv is None else argv
+    transport = argv[0] if argv else os.getenv("MCP_TRANSPORT", "stdio")
+    if transport not in TRANSPORTS:
+        raise SystemExit(f"Unknown transport {transport!r}, expected one of: {', '.join(TRANSPORTS)}")
+
+    if transport == "dev":
+        mcp.run()  # Run without transport for dev server mode
+        return
+    if transport == "stdio":
+        mcp.run(transport="stdio")  # One client, talking over stdin/stdout
+        return
+
+    import uvicorn  # Only needed by the network transports
+
+    host = os.getenv("MCP_HOST", "127.0.0.1")
+    port = int(os.getenv("MCP_PORT", "8000"))
+    workers = int(os.getenv("MCP_HTTP_WORKERS", "1"))
+    # No per-request access log: it would be the hottest print() of the server
+    options = {"host": host, "port": port, "log_level": "warning", "access_log": False}
+
+    # Answer each http request with one JSON body instead of an SSE stream:
+    # the tools send no progress notifications, so the stream only adds framing
+    mcp.settings.json_response = True
+
+    if transport == "sse" or workers <= 1:
+        app = mcp.sse_app() if transport == "sse" else mcp.streamable_http_app()
+        uvicorn.run(app, **options)
+        return
+
+    # Several processes behind one port. uvicorn starts them with the spawn
+    # method, so each one re-imports the server script (as __mp_main__) and
+    # then asks create_worker_app() for the app. Settings for the workers go
+    # through the environment, which they inherit.
+    os.environ["RESULT_HANDLE_THRESHOLD"] = str(10 ** 9)  # Handles would not survive across workers
+    if not os.getenv("MCP_CPU_WORKERS"):
+        os.environ["MCP_CPU_WORKERS"] = str(max(1, (os.cpu_count() or 1) // workers))
+    uvicorn.run("server_transport:create_worker_app", factory=True, workers=workers, **options)
+
+
+def create_worker_app():
+    """Build the stateless streamable HTTP app inside one of several server processes"""
+    mcp = sys.modules["__mp_main__"].mcp
+    mcp.settings.stateless_http = True
+    mcp.settings.json_response = True
+    return mcp.streamable_http_app()
+
+
+@contextlib.asynccontextmanager
+async def connect_server(server_params, url=None):
+    """Open (read, write) streams to the MCP server
+
+    Connects to the shared server at url (default: MCP_SERVER_URL) if one is
+    given - over SSE if the URL ends in /sse, over streamable HTTP otherwise -
+    and starts a server process of our own over stdio if not.
+
+    Args:
+        server_params (StdioServerParameters): How to start the server over stdio
+        url (str): URL of a running http/sse server
+    """
+    url = url or os.getenv("MCP_SERVER_URL", "")
+    if not url:
+        async with stdio_client(server_params) as (read, write):
+            yield read, write
+    elif url.rstrip("/").endswith("/sse"):
+        async with sse_client(url) as (read, write):
+            yield read, write
+    else:
+        async with streamablehttp_client(url) as (read, write, _):
+            yield read, write
@@ -0,0 +1,72 @@
+"""Tests of the size and type limits of the evaluate tool (expression_eval.py)"""
+
+import math
+
+import pytest
+
+from expression_eval import ExpressionError, evaluate_expression
+
+# The math tools as the servers register them in MATH_FUNCTIONS
+FUNCTIONS = {
+    "add": lambda a, b: int(a + b),
+    "add_list": lambda l: sum(l),
+    "length_string": lambda string: len(string),
+    "subtract": lambda a, b: int(a - b),
+    "multiply": lambda a, b: int(a * b),
+    "divide": lambda a, b: float(a / b),
+    "power": lambda a, b: int(a ** b),
+    "sqrt": lambda a: float(a ** 0.5),
+    "factorial": lambda a: int(math.factorial(a)),
+    "mine": lambda a, b: int(a - b - b),
+    "strings_to_chars_to_int": lambda string: [int(ord(char)) for char in string],
+    "fibonacci_numbers": lambda n: [0, 1, 1, 2, 3, 5][:n],
+}
+
+
+def evaluate(expression):
+    return evaluate_expression(expression, FUNCTIONS)
+
+
+@pytest.mark.parametrize("expression, expected", [
+    ("mine(add(5, 3), 2) * power(2, 3)", 32),
+    ("n = length_string('Delhi'); fibonacci_numbers(n)", [0, 1, 1, 2, 3]),
+    ("'ab' * 3", "ababab"),
+    ("[0] * 3 + [1]", [0, 0, 0, 1]),
+    ("sum([1, 2, 3.5])", 6.5),
+    ("max(1, 4, 2)", 4),
+    ("add_list(strings_to_chars_to_int('AB'))", 131),
+    ("factorial(10)", 3628800),
+    ("length_string('a' * 1000)", 1000),
+])
+def test_allowed(expression, expected):
+    assert evaluate(expression) == expected
+
+
+@pytest.mark.parametrize("expression", [
+    # Powers and products refused before they are computed
+    "9 ** 9 ** 9",
+    "(9 ** 9999) ** 9999",
+    "power(9, 10 ** 8)",
+    "power(9999, 9999)",
+    "x = 9 ** 9999; x * x * x * x * x * x * x * x * x * x",
+    "factorial(10 ** 6)",
+    "fibonacci_numbers(10 ** 6)",
+    # Repetition of strings and lists
+    "[1] * 10 ** 9",
+    "'a' * 10 ** 9",
+    "10 ** 9 * [1]",
+    "x = [0] * 1000; [x] * 1000",
+    # The tools and builtins only take numbers
+    "multiply([0] * 100000, 100000)",
+    "multiply('ab', 10 ** 8)",
+    "add('a' * 1000, 'b')",
+    "sum([[0] * 100000] * 100000, [])",
+    "sum([[1], [2]], [])",
+    "max(['a'], ['b'])",
+    "add_list([[0] * 100000] * 2)",
+    # Not serializable
+    "(-8) ** 0.5",
+])
+def test_refused(expression):
+    with pytest.raises(ExpressionError):
+        evaluate(expression)
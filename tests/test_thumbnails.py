@@ -0,0 +1,72 @@
+"""Tests of thumbnails of unusual image modes, on the normal and the streaming path"""
+
+import io
+
+import pytest
+from PIL import Image
+
+import large_images
+from thumbnails import ENCODER_MODES, THUMBNAIL_FORMATS, make_thumbnail
+
+SIZE = 50
+
+
+def _gradient(mode):
+    """A 320x240 16-bit greyscale gradient converted to mode"""
+    img = Image.new("I", (320, 240))
+    img.putdata([(x * 7) % 65536 for x in range(320 * 240)])
+    return img if mode == "I" else img.convert(mode)
+
+
+def _palette():
+    img = Image.new("P", (320, 240))
+    img.putpalette([value % 256 for value in range(768)])
+    return img
+
+
+# file name -> image; the TIFF and BMP files are uncompressed, so they can be memory-mapped
+SOURCES = {
+    "grey16.png": lambda: _gradient("I;16"),
+    "grey16.tif": lambda: _gradient("I;16"),
+    "int32.tif": lambda: _gradient("I"),
+    "float.tif": lambda: _gradient("F"),
+    "cmyk.tif": lambda: Image.new("CMYK", (320, 240), (10, 20, 30, 0)),
+    "cmyk.jpg": lambda: Image.new("CMYK", (320, 240), (10, 20, 30, 0)),
+    "bilevel.tif": lambda: Image.new("1", (320, 240), 1),
+    "palette.bmp": _palette,
+    "alpha.png": lambda: Image.new("LA", (320, 240), (128, 200)),
+    "rgba.png": lambda: Image.new("RGBA", (320, 240), (10, 20, 30, 128)),
+}
+
+
+@pytest.fixture(params=["normal", "streaming"])
+def path(request, monkeypatch):
+    """Run make_thumbnail on the normal path or force every image onto the streaming path"""
+    if request.param == "streaming":
+        monkeypatch.setattr(large_images, "LARGE_IMAGE_PIXELS", 1000)
+    return request.param
+
+
+@pytest.mark.parametrize("name", sorted(SOURCES))
+@pytest.mark.parametrize("image_format", ["png", "jpeg", "webp"])
+def test_every_mode_and_format(tmp_path, path, name, image_format):
+    source = tmp_path / name
+    SOURCES[name]().save(source)
+
+    data, _ = make_thumbnail(str(source), SIZE, image_format, cache_dir=None)
+
+    thumbnail = Image.open(io.BytesIO(data))
+    assert thumbnail.format == THUMBNAIL_FORMATS[image_format][0]
+    assert thumbnail.mode in ENCODER_MODES[thumbnail.format]
+    assert max(thumbnail.size) == SIZE
+
+
+@pytest.mark.parametrize("name", ["grey16.png", "grey16.tif", "int32.tif"])
+def test_16_bit_grey_is_scaled_not_clipped(tmp_path, path, name):
+    source = tmp_path / name
+    SOURCES[name]().save(source)
+
+    data, _ = make_thumbnail(str(source), SIZE, "png", cache_dir=None)
+
+    low, high = Image.open(io.BytesIO(data)).convert("L").getextrema()
+    assert low < 128 < high
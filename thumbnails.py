@@ -0,0 +1,304 @@
+"""
+Thumbnail Generation
+
+This module implements the thumbnail tools of the MCP servers. Thumbnails are
+properly encoded (PNG, JPEG or WebP bytes, not raw pixel data) at a configurable
+size and quality, and are stored in an on-disk cache keyed by a hash of the
+source file's contents, so asking for the same thumbnail again never re-opens
+or re-decodes the source image.
+
+JPEG sources are decoded with `Image.draft`, which lets the JPEG decoder scale
+the image down by 1/2, 1/4 or 1/8 while decoding instead of decoding at full
+resolution and resizing afterwards. Very large images go through the streaming
+path in large_images.py.
+
+Every thumbnail is converted to a mode its output format can store (e.g. a
+CMYK scan to RGB for PNG). The cache is bounded: once it holds more than
+THUMBNAIL_CACHE_MAX_BYTES, the least recently used thumbnails are removed.
+
+Configuration (environment variables, e.g. in .env):
+    THUMBNAIL_CACHE_DIR         Directory for cached thumbnails (default: .thumbnail_cache)
+    THUMBNAIL_CACHE_MAX_BYTES   Size limit of the thumbnail cache (default: 268435456)
+"""
+
+import hashlib
+import io
+import logging
+import os
+import threading
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+
+from large_images import is_large_image, open_image, stream_thumbnail, to_display_mode
+
+logger = logging.getLogger(__name__)
+
+# Thumbnail defaults
+THUMBNAIL_CACHE_DIR = os.getenv("THUMBNAIL_CACHE_DIR", ".thumbnail_cache")
+THUMBNAIL_CACHE_MAX_BYTES = int(os.getenv("THUMBNAIL_CACHE_MAX_BYTES", str(256 * 1024 * 1024)))
+DEFAULT_THUMBNAIL_SIZE = 100
+DEFAULT_THUMBNAIL_QUALITY = 85
+
+# Output formats accepted by the tools, mapped to Pillow format names and file extensions
+THUMBNAIL_FORMATS = {
+    "png": ("PNG", "png"),
+    "jpeg": ("JPEG", "jpeg"),
+    "jpg": ("JPEG", "jpeg"),
+    "webp": ("WEBP", "webp"),
+}
+
+# Image modes each encoder can write; other modes are converted first
+ENCODER_MODES = {
+    "PNG": ("1", "L", "LA", "P", "RGB", "RGBA"),
+    "JPEG": ("L", "RGB"),
+    "WEBP": ("RGB", "RGBA"),
+}
+
+# A full cache is trimmed to this share of THUMBNAIL_CACHE_MAX_BYTES, so it is not trimmed on every write
+CACHE_TRIM_RATIO = 0.9
+
+# Source files picked up by thumbnail_directory
+IMAGE_EXTENSIONS = {".png", ".jpg", ".jpeg", ".gif", ".bmp", ".tif", ".tiff", ".webp", ".ppm"}
+
+# Bytes read at a time when hashing source files
+HASH_CHUNK_SIZE = 1024 * 1024
+
+# Source files whose digests are remembered (least recently used are forgotten first)
+DIGEST_MEMO_SIZE = 4096
+
+# (path, size, mtime) -> content digest, so unchanged files are not re-hashed;
+# shared by the threads of thumbnail_directory
+_digest_memo = OrderedDict()
+_digest_memo_lock = threading.Lock()
+
+# Cache directory -> bytes this process believes it holds (None until it is first scanned)
+_cache_bytes = {}
+_cache_lock = threading.Lock()
+
+
+def file_digest(path):
+    """Return the SHA-256 digest of a file's contents
+
+    The digest is remembered per (path, size, modification time), so repeated
+    requests for an unchanged file only cost a stat() call. Only the last
+    DIGEST_MEMO_SIZE files are remembered.
+
+    Args:
+        path (str): Path of the file to hash
+
+    Returns:
+        str: Hex digest of the file contents
+    """
+    stat = os.stat(path)
+    memo_key = (os.path.abspath(path), stat.st_size, stat.st_mtime_ns)
+    with _digest_memo_lock:
+        digest = _digest_memo.get(memo_key)
+        if digest is not None:
+            _digest_memo.move_to_end(memo_key)
+            return digest
+    sha = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(HASH_CHUNK_SIZE), b''):
+            sha.update(chunk)
+    digest = sha.hexdigest()
+    with _digest_memo_lock:
+        _digest_memo[memo_key] = digest
+        while len(_digest_memo) > DIGEST_MEMO_SIZE:
+            _digest_memo.popitem(last=False)
+    return digest
+
+
+def normalize_format(image_format):
+    """Validate an output format name
+
+    Args:
+        image_format (str): 'png', 'jpeg'/'jpg' or 'webp' (case-insensitive)
+
+    Returns:
+        tuple: (Pillow format name, file extension / MCP image format)
+
+    Raises:
+        ValueError: If the format is not supported
+    """
+    try:
+        return THUMBNAIL_FORMATS[image_format.lower()]
+    except KeyError:
+        supported = ", ".join(sorted(THUMBNAIL_FORMATS))
+        raise ValueError(f"Unsupported thumbnail format '{image_format}'. Use one of: {supported}") from None
+
+
+def _encodable(img, pil_format):
+    """Convert an image to a mode the encoder of pil_format can write (RGB, RGBA or L)"""
+    if img.mode in ENCODER_MODES[pil_format]:
+        return img
+    alpha = pil_format != "JPEG" and (
+        any(band in ("A", "a") for band in img.getbands()) or "transparency" in img.info
+    )
+    grey = img.mode != "P" and len(img.getbands()) == 1  # 1, I, I;16, F
+    if alpha:
+        return img.convert("RGBA")
+    return img.convert("L" if grey and pil_format != "WEBP" else "RGB")
+
+
+def encode_thumbnail(img, size, image_format="png", quality=DEFAULT_THUMBNAIL_QUALITY):
+    """Shrink an open image to fit in size and encode it
+
+    Args:
+        img (PIL.Image.Image): The source image (modified in place if it is in a display mode)
+        size (tuple): Maximum (width, height) of the thumbnail
+        image_format (str): Output format name
+        quality (int): Encoder quality for lossy formats (1-95)
+
+    Returns:
+        bytes: The encoded thumbnail
+    """
+    pil_format, _ = normalize_format(image_format)
+    img = to_display_mode(img)  # Pillow cannot shrink e.g. 16-bit greyscale (I;16)
+    img.thumbnail(size)
+    img = _encodable(img, pil_format)
+    buffer = io.BytesIO()
+    if pil_format == "PNG":
+        img.save(buffer, format=pil_format, optimize=True)
+    else:
+        img.save(buffer, format=pil_format, quality=quality)
+    return buffer.getvalue()
+
+
+def make_thumbnail(image_path, size=DEFAULT_THUMBNAIL_SIZE, image_format="png",
+                   quality=DEFAULT_THUMBNAIL_QUALITY, cache_dir=THUMBNAIL_CACHE_DIR):
+    """Create (or fetch from the cache) an encoded thumbnail of an image file
+
+    Args:
+        image_path (str): Path of the source image
+        size (int): Maximum width and height of the thumbnail in pixels
+        image_format (str): 'png', 'jpeg' or 'webp'
+        quality (int): Encoder quality for lossy formats (1-95)
+        cache_dir (str): Thumbnail cache directory, or None to disable caching
+
+    Returns:
+        tuple: (thumbnail bytes, format name for the MCP Image type)
+    """
+    _, extension = normalize_format(image_format)
+    cache_path = None
+    if cache_dir:
+        digest = file_digest(image_path)
+        cache_path = os.path.join(cache_dir, f"{digest}_{size}_q{quality}.{extension}")
+        try:
+            with open(cache_path, 'rb') as f:
+                data = f.read()
+            os.utime(cache_path)  # Marks it as recently used for the eviction
+            return data, extension
+        except FileNotFoundError:
+            pass  # Not cached yet, or just evicted
+
+    # Very large scans must not trip Pillow's decompression-bomb check before they get to the streaming path
+    with open_image(image_path) as img:
+        large = is_large_image(img)
+        if not large:
+            # JPEG only: let the decoder downscale by up to 8x while decoding
+            img.draft(None, (size, size))
+            data = encode_thumbnail(img, (size, size), image_format, quality)
+    if large:
+        # Very large scans are read band by band instead of being decoded in full
+        thumbnail, stats = stream_thumbnail(image_path, (size, size))
+        logger.info("Large image thumbnail for %s: %s", image_path, stats)
+        data = encode_thumbnail(thumbnail, (size, size), image_format, quality)
+
+    if cache_path:
+        os.makedirs(cache_dir, exist_ok=True)
+        # Write to a temporary file first so readers never see a partial thumbnail
+        temp_path = f"{cache_path}.{os.getpid()}.{threading.get_ident()}.tmp"
+        with open(temp_path, 'wb') as f:
+            f.write(data)
+        os.replace(temp_path, cache_path)
+        _trim_cache(cache_dir, len(data))
+    return data, extension
+
+
+def _trim_cache(cache_dir, added):
+    """Remove the least recently used thumbnails once the cache is over THUMBNAIL_CACHE_MAX_BYTES
+
+    The size of the cache is tracked in memory and the directory is only scanned
+    when it looks full, so most writes cost nothing extra. Other processes
+    writing to the same cache are seen at the next scan.
+    """
+    with _cache_lock:
+        total = _cache_bytes.get(cache_dir)
+        if total is not None and total + added <= THUMBNAIL_CACHE_MAX_BYTES:
+            _cache_bytes[cache_dir] = total + added
+            return
+        entries = []
+        for entry in os.scandir(cache_dir):
+            if entry.is_file() and not entry.name.endswith(".tmp"):
+                try:
+                    info = entry.stat()
+                except FileNotFoundError:
+                    continue
+                entries.append((info.st_mtime_ns, info.st_size, entry.path))
+        total = sum(size for _, size, _ in entries)
+        if total > THUMBNAIL_CACHE_MAX_BYTES:
+            removed = 0
+            for _, size, path in sorted(entries):
+                if total <= THUMBNAIL_CACHE_MAX_BYTES * CACHE_TRIM_RATIO:
+                    break
+                try:
+                    os.remove(path)
+                    removed += 1
+                except FileNotFoundError:
+                    pass  # Removed by another process
+                total -= size
+            logger.info("Thumbnail cache trimmed: %d files removed, %d bytes left", removed, total)
+        _cache_bytes[cache_dir] = total
+
+
+def thumbnail_directory(directory, size=DEFAULT_THUMBNAIL_SIZE, image_format="png",
+                        quality=DEFAULT_THUMBNAIL_QUALITY, output_dir=None, max_workers=None):
+    """Create thumbnails for every image in a directory using a thread pool
+
+    Pillow releases the GIL while decoding and encoding, so threads give a real
+    speedup here without the cost of starting processes.
+
+    Args:
+        directory (str): Directory containing the source images
+        size (int): Maximum width and height of the thumbnails in pixels
+        image_format (str): 'png', 'jpeg' or 'webp'
+        quality (int): Encoder quality for lossy formats (1-95)
+        output_dir (str): Where to write the thumbnails (default: <directory>/thumbnails),
+            named after the whole source file name, e.g. photo.jpg -> photo.jpg.png
+        max_workers (int): Number of threads (default: chosen by ThreadPoolExecutor)
+
+    Returns:
+        dict: Output directory, counts and a per-file list of results or errors
+    """
+    _, extension = normalize_format(image_format)
+    output_dir = output_dir or os.path.join(directory, "thumbnails")
+    os.makedirs(output_dir, exist_ok=True)
+
+    sources = sorted(
+        os.path.join(directory, name)
+        for name in os.listdir(directory)
+        if os.path.splitext(name)[1].lower() in IMAGE_EXTENSIONS
+        and os.path.isfile(os.path.join(directory, name))
+    )
+
+    def process(source):
+        try:
+            data, _ = make_thumbnail(source, size, image_format, quality)
+            # The source extension is kept (a.png.png, a.jpg.png) so a.png and a.jpg do not overwrite each other
+            target = os.path.join(output_dir, f"{os.path.basename(source)}.{extension}")
+            with open(target, 'wb') as f:
+                f.write(data)
+            return {"source": source, "thumbnail": target, "bytes": len(data)}
+        except Exception as e:
+            return {"source": source, "error": str(e)}
+
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        results = list(executor.map(process, sources))
+
+    failed = sum(1 for result in results if "error" in result)
+    return {
+        "output_dir": output_dir,
+        "created": len(results) - failed,
+        "failed": failed,
+        "results": results,
+    }
@@ -0,0 +1,318 @@
+"""
+Tool Execution Metrics
+
+Records per-tool call counts, error counts, latency histograms and payload
+sizes for an MCP server. Call instrument_tools(mcp) right after creating the
+FastMCP instance; from then on every function registered with @mcp.tool() is
+wrapped automatically:
+
+    mcp = FastMCP("Calculator")
+    instrument_tools(mcp)
+
+The numbers are returned by metrics_snapshot() (exposed by the servers as the
+server_stats tool and the stats://server resource) and can optionally be
+written to a Prometheus text file for the node_exporter textfile collector.
+
+Recording is kept cheap enough to leave on all the time: two perf_counter_ns()
+calls, a bit_length() to find the histogram bucket and a few integer additions
+per call - no locks, allocations or string formatting on the hot path. Payload
+sizes cost a pass over the arguments, so they are only measured on a sample
+of the calls (the first and then every MCP_METRICS_SIZE_SAMPLE-th); the size
+totals are estimated from the sample.
+
+Configuration (environment variables, e.g. in .env):
+    MCP_METRICS_FILE         Prometheus text file to write (default: off)
+    MCP_METRICS_INTERVAL     Seconds between writes of the metrics file (default: 15)
+    MCP_METRICS_SIZE_SAMPLE  Measure payload sizes on one call in this many, rounded up to a
+                             power of two (default: 16, 1 measures every call)
+"""
+
+import atexit
+import functools
+import inspect
+import logging
+import multiprocessing
+import os
+import threading
+import time
+
+logger = logging.getLogger(__name__)
+
+MCP_METRICS_FILE = os.getenv("MCP_METRICS_FILE", "")
+MCP_METRICS_INTERVAL = float(os.getenv("MCP_METRICS_INTERVAL", "15"))
+MCP_METRICS_SIZE_SAMPLE = int(os.getenv("MCP_METRICS_SIZE_SAMPLE", "16"))
+
+# Calls n with (n - 1) & mask == 0 are sampled: the first one, then one in every mask + 1
+SIZE_SAMPLE_MASK = (1 << (max(MCP_METRICS_SIZE_SAMPLE, 1) - 1).bit_length()) - 1
+
+# Latency histogram buckets: bucket i counts calls faster than 1024 * 2**i ns
+# (about 1us, 2us, 4us, ... 68s); the index is a single bit_length() call
+LATENCY_BUCKET_COUNT = 27
+LATENCY_BUCKETS_NS = [1024 * 2 ** k for k in range(LATENCY_BUCKET_COUNT)]
+# Counters kept per call: enough for any 64-bit duration, so the hot path needs no
+# bounds check; the ones past the last bucket are added up when the histogram is read
+_RAW_BUCKET_COUNT = 64
+
+# Types whose payload size is len(value); any other value (numbers, None, ...) counts as 1
+_SIZED_TYPES = frozenset((str, bytes, bytearray, list, tuple, dict, set))
+_SCALAR_TYPES = frozenset((int, float, bool, type(None)))
+
+
+def _payload_size(value):
+    """Cheap size estimate: len() of strings, bytes and containers, 1 for anything else"""
+    cls = type(value)
+    if cls in _SIZED_TYPES:
+        return len(value)
+    if cls in _SCALAR_TYPES:
+        return 1
+    data = getattr(value, "data", None)  # FastMCP Image
+    return len(data) if type(data) is bytes else 1
+
+
+class ToolMetrics:
+    """Counters and a latency histogram for one tool"""
+
+    __slots__ = ("name", "calls", "errors", "total_ns", "max_ns", "raw_buckets",
+                 "sampled_requests", "request_size", "sampled_responses", "response_size", "max_response_size")
+
+    def __init__(self, name):
+        self.name = name
+        self.calls = 0
+        self.errors = 0
+        self.total_ns = 0
+        self.max_ns = 0
+        self.raw_buckets = [0] * _RAW_BUCKET_COUNT
+        # Payload sizes of the sampled calls only
+        self.sampled_requests = 0
+        self.request_size = 0
+        self.sampled_responses = 0
+        self.response_size = 0
+        self.max_response_size = 0
+
+    def record(self, elapsed_ns):
+        """Record one call's latency
+
+        Args:
+            elapsed_ns (int): Duration of the call in nanoseconds
+
+        Returns:
+            bool: True if this call's payload sizes are sampled (see record_sizes)
+        """
+        calls = self.calls = self.calls + 1
+        self.total_ns += elapsed_ns
+        if elapsed_ns > self.max_ns:
+            self.max_ns = elapsed_ns
+        self.raw_buckets[(elapsed_ns >> 10).bit_length()] += 1
+        return not (calls - 1) & SIZE_SAMPLE_MASK
+
+    def record_sizes(self, kwargs, result, failed=False):
+        """Record the payload sizes of a sampled call
+
+        Args:
+            kwargs (dict): The call's arguments
+            result: The call's return value (ignored if failed)
+            failed (bool): Whether the call raised an exception
+        """
+        self.sampled_requests += 1
+        for value in kwargs.values():
+            self.request_size += len(value) if type(value) in _SIZED_TYPES else 1
+        if failed:
+            return
+        response_size = _payload_size(result)
+        self.sampled_responses += 1
+        self.response_size += response_size
+        if response_size > self.max_response_size:
+            self.max_response_size = response_size
+
+    @property
+    def buckets(self):
+        """Calls per latency bucket, plus a final overflow (+Inf) bucket"""
+        raw = self.raw_buckets
+        return raw[:LATENCY_BUCKET_COUNT] + [sum(raw[LATENCY_BUCKET_COUNT:])]
+
+    def request_size_total(self):
+        """Estimated sum of all request sizes, scaled up from the sampled calls"""
+        if not self.sampled_requests:
+            return 0
+        return round(self.request_size * self.calls / self.sampled_requests)
+
+    def response_size_total(self):
+        """Estimated sum of all response sizes, scaled up from the sampled calls"""
+        if not self.sampled_responses:
+            return 0
+        return round(self.response_size * (self.calls - self.errors) / self.sampled_responses)
+
+    def percentile_ms(self, fraction):
+        """Estimate a latency percentile (0-1) in milliseconds from the histogram"""
+        if not self.calls:
+            return 0.0
+        target = fraction * self.calls
+        cumulative = 0
+        for index, count in enumerate(self.buckets):
+            if count and cumulative + count >= target:
+                lower = LATENCY_BUCKETS_NS[index - 1] if index else 0
+                upper = LATENCY_BUCKETS_NS[index] if index < len(LATENCY_BUCKETS_NS) else self.max_ns
+                # Interpolate linearly inside the bucket, never beyond the slowest call seen
+                estimate = lower + (upper - lower) * (target - cumulative) / count
+                return round(min(estimate, self.max_ns) / 1e6, 3)
+            cumulative += count
+        return round(self.max_ns / 1e6, 3)
+
+    def snapshot(self):
+        """Return the tool's metrics as a plain dict"""
+        return {
+            "calls": self.calls,
+            "errors": self.errors,
+            "mean_ms": round(self.total_ns / self.calls / 1e6, 3) if self.calls else 0.0,
+            "p50_ms": self.percentile_ms(0.50),
+            "p95_ms": self.percentile_ms(0.95),
+            "p99_ms": self.percentile_ms(0.99),
+            "max_ms": round(self.max_ns / 1e6, 3),
+            "request_size_total": self.request_size_total(),
+            "response_size_total": self.response_size_total(),
+            "response_size_max": self.max_response_size,  # Of the sampled calls
+        }
+
+
+# Metrics of every instrumented tool, keyed by tool name
+_registry = {}
+_started_at = time.time()
+
+
+def metrics_for(name):
+    """Return (creating if needed) the metrics of a tool"""
+    metrics = _registry.get(name)
+    if metrics is None:
+        metrics = _registry[name] = ToolMetrics(name)
+    return metrics
+
+
+def instrument(func, name=None):
+    """Wrap a tool function so every call is recorded
+
+    The wrapper keeps the function's signature, annotations and sync/async
+    nature, so FastMCP builds the same tool schema as for the bare function.
+    Request sizes are taken from the keyword arguments, which is how FastMCP
+    passes tool arguments. Only the latency is recorded on every call; sizes
+    are measured on the sampled ones.
+    """
+    metrics = metrics_for(name or func.__name__)
+    perf_counter_ns = time.perf_counter_ns
+
+    if inspect.iscoroutinefunction(func):
+        @functools.wraps(func)
+        async def wrapper(*args, **kwargs):
+            start = perf_counter_ns()
+            try:
+                result = await func(*args, **kwargs)
+            except BaseException:
+                if metrics.record(perf_counter_ns() - start):
+                    metrics.record_sizes(kwargs, None, True)
+                metrics.errors += 1
+                raise
+            if metrics.record(perf_counter_ns() - start):
+                metrics.record_sizes(kwargs, result)
+            return result
+    else:
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            start = perf_counter_ns()
+            try:
+                result = func(*args, **kwargs)
+            except BaseException:
+                if metrics.record(perf_counter_ns() - start):
+                    metrics.record_sizes(kwargs, None, True)
+                metrics.errors += 1
+                raise
+            if metrics.record(perf_counter_ns() - start):
+                metrics.record_sizes(kwargs, result)
+            return result
+
+    return wrapper
+
+
+def instrument_tools(mcp):
+    """Make every later @mcp.tool() registration record metrics
+
+    Also starts the Prometheus text file writer when MCP_METRICS_FILE is set.
+
+    Args:
+        mcp: The FastMCP server instance
+    """
+    register = mcp.tool
+
+    @functools.wraps(register)
+    def tool(*args, **kwargs):
+        decorator = register(*args, **kwargs)
+
+        def instrumented(func):
+            decorator(instrument(func, kwargs.get("name") or func.__name__))
+            return func
+        return instrumented
+
+    mcp.tool = tool
+    # Worker processes re-import the server script; only the server itself writes the file
+    if MCP_METRICS_FILE and multiprocessing.parent_process() is None:
+        start_metrics_writer(MCP_METRICS_FILE, MCP_METRICS_INTERVAL)
+    return mcp
+
+
+def metrics_snapshot():
+    """Return the metrics of all tools
+
+    Returns:
+        dict: Server uptime and per-tool counters and latency percentiles
+    """
+    return {
+        "uptime_seconds": round(time.time() - _started_at, 1),
+        "tools": {name: metrics.snapshot() for name, metrics in sorted(_registry.items())},
+    }
+
+
+def prometheus_text():
+    """Render the metrics in the Prometheus text exposition format"""
+    lines = [
+        "# HELP mcp_tool_calls_total Tool calls.",
+        "# TYPE mcp_tool_calls_total counter",
+    ]
+    tools = sorted(_registry.items())
+    lines += [f'mcp_tool_calls_total{{tool="{name}"}} {m.calls}' for name, m in tools]
+    lines += ["# HELP mcp_tool_errors_total Tool calls that raised an exception.",
+              "# TYPE mcp_tool_errors_total counter"]
+    lines += [f'mcp_tool_errors_total{{tool="{name}"}} {m.errors}' for name, m in tools]
+    lines += ["# HELP mcp_tool_response_size_total Sum of tool response sizes (estimated from sampled calls).",
+              "# TYPE mcp_tool_response_size_total counter"]
+    lines += [f'mcp_tool_response_size_total{{tool="{name}"}} {m.response_size_total()}' for name, m in tools]
+    lines += ["# HELP mcp_tool_duration_seconds Tool call latency.",
+              "# TYPE mcp_tool_duration_seconds histogram"]
+    for name, m in tools:
+        cumulative = 0
+        for bound, count in zip(LATENCY_BUCKETS_NS, m.buckets):
+            cumulative += count
+            lines.append(f'mcp_tool_duration_seconds_bucket{{tool="{name}",le="{bound / 1e9:g}"}} {cumulative}')
+        lines.append(f'mcp_tool_duration_seconds_bucket{{tool="{name}",le="+Inf"}} {m.calls}')
+        lines.append(f'mcp_tool_duration_seconds_sum{{tool="{name}"}} {m.total_ns / 1e9:.9f}')
+        lines.append(f'mcp_tool_duration_seconds_count{{tool="{name}"}} {m.calls}')
+    return "\n".join(lines) + "\n"
+
+
+def write_prometheus_file(path):
+    """Write the metrics to a Prometheus text file (atomically, so scrapers never see a partial file)"""
+    temp_path = f"{path}.{os.getpid()}.tmp"
+    with open(temp_path, 'w', encoding='utf-8') as f:
+        f.write(prometheus_text())
+    os.replace(temp_path, path)
+
+
+def start_metrics_writer(path, interval=MCP_METRICS_INTERVAL):
+    """Write the Prometheus text file every interval seconds and once more at exit"""
+    def loop():
+        while True:
+            time.sleep(interval)
+            try:
+                write_prometheus_file(path)
+            except OSError as e:
+                logger.warning("Could not write metrics file %s: %s", path, e)
+
+    threading.Thread(target=loop, name="metrics-writer", daemon=True).start()
+    atexit.register(write_prometheus_file, path)
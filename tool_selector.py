@@ -0,0 +1,144 @@
+"""
+Tool Selection
+
+The system prompt used to list every tool the server has (around 25, with
+descriptions) on every LLM call, including Paint and email tools most
+queries never touch. select_tools() ranks the tools by how well their name,
+description and parameter names match the query (Okapi BM25 over keywords,
+no network or model needed) and keeps only the top TOOL_SELECTION_TOP_K, plus
+the tools a client always needs (e.g. the Paint tools of its workflow) and
+TOOL_SELECTION_ALWAYS. Every iteration's prompt shrinks by the left-out tool
+descriptions; the reduction is logged.
+
+Tools that are left out of the catalog can still be called: the agent loop
+executes any tool the server has, only the prompt lists fewer.
+
+Configuration (environment variables, e.g. in .env):
+    TOOL_SELECTION_TOP_K   Tools listed per query, besides the mandatory ones (default: 8, 0 = all)
+    TOOL_SELECTION_ALWAYS  Comma-separated tools that are always listed (default: evaluate)
+"""
+
+import logging
+import math
+import os
+import re
+from collections import Counter
+
+from agent_loop import describe_tools
+from history_compactor import estimate_tokens
+
+TOOL_SELECTION_TOP_K = int(os.getenv("TOOL_SELECTION_TOP_K", "8"))
+TOOL_SELECTION_ALWAYS = [name.strip() for name in os.getenv("TOOL_SELECTION_ALWAYS", "evaluate").split(",") if name.strip()]
+
+# BM25 term frequency saturation and document length normalization
+BM25_K1 = 1.2
+BM25_B = 0.75
+
+# The tool name says most about what it does, so its words count this many times
+NAME_WEIGHT = 3
+
+# Tools scoring below this fraction of the best match are weak matches (a shared
+# word like "number") and are left out even if fewer than top_k tools match
+MIN_RELATIVE_SCORE = 0.1
+
+# Filler words, including the ones every query uses ("find the result of ...")
+STOP_WORDS = frozenset(
+    "a an and answer are as at be by do does find first for from how i in into is it its me my "
+    "myself of on or previous question result return the then this to was what which with you your".split()
+)
+
+# Query words that mean the same as a word in the tool descriptions
+SYNONYMS = {
+    "sum": "add",
+    "plus": "add",
+    "total": "add",
+    "times": "multiply",
+    "product": "multiply",
+    "minus": "subtract",
+    "mail": "email",
+    "draw": "paint",
+    "show": "paint",
+    "visualize": "paint",
+}
+
+logger = logging.getLogger(__name__)
+
+
+def tokenize(text):
+    """Lowercase keywords of a text, with names like fibonacci_numbers split into words"""
+    words = re.findall(r"[a-z0-9]+", text.lower().replace("_", " "))
+    # Crude plural stemming, so "numbers" matches "number"
+    return [word[:-1] if len(word) > 3 and word.endswith("s") and not word.endswith("ss") else word
+            for word in words if word not in STOP_WORDS]
+
+
+class ToolIndex:
+    """BM25 index over the names, descriptions and parameter names of a tool list"""
+
+    def __init__(self, tools):
+        self.tools = list(tools)
+        self.documents = []
+        for tool in self.tools:
+            words = tokenize(tool.name) * NAME_WEIGHT + tokenize(tool.description or "")
+            words += tokenize(" ".join(tool.inputSchema.get('properties', {})))
+            self.documents.append(Counter(words))
+        lengths = [sum(document.values()) for document in self.documents]
+        self.average_length = sum(lengths) / len(lengths) if lengths else 0.0
+        self.lengths = lengths
+        document_frequency = Counter(word for document in self.documents for word in document)
+        count = len(self.documents)
+        self.idf = {word: math.log(1 + (count - frequency + 0.5) / (frequency + 0.5))
+                    for word, frequency in document_frequency.items()}
+
+    def scores(self, query):
+        """BM25 score of every tool for the query, in tool order"""
+        query_words = set(tokenize(query))
+        query_words |= {SYNONYMS[word] for word in query_words if word in SYNONYMS}
+        scores = []
+        for document, length in zip(self.documents, self.lengths):
+            score = 0.0
+            for word in query_words:
+                frequency = document.get(word, 0)
+                if frequency:
+                    norm = BM25_K1 * (1 - BM25_B + BM25_B * length / self.average_length)
+                    score += self.idf[word] * frequency * (BM25_K1 + 1) / (frequency + norm)
+            scores.append(score)
+        return scores
+
+    def select(self, query, top_k, always=()):
+        """The top_k matching tools plus the always-listed ones, in the server's order"""
+        scores = self.scores(query)
+        threshold = max(scores, default=0.0) * MIN_RELATIVE_SCORE
+        ranked = sorted((i for i, score in enumerate(scores) if score > threshold), key=lambda i: -scores[i])
+        keep = set(ranked[:top_k])
+        keep.update(i for i, tool in enumerate(self.tools) if tool.name in always)
+        return [tool for i, tool in enumerate(self.tools) if i in keep]
+
+
+def select_tools(tools, query, top_k=None, always=()):
+    """Choose the tools to list in the system prompt for a query
+
+    Args:
+        tools: Tools returned by session.list_tools()
+        query (str): The query the prompt is for
+        top_k (int): Matching tools to keep (default: TOOL_SELECTION_TOP_K; 0 = all tools)
+        always: Tool names that are always kept, in addition to TOOL_SELECTION_ALWAYS
+
+    Returns:
+        list: The selected tools, in the server's order; all tools if selection is
+            off or nothing matches the query
+    """
+    tools = list(tools)
+    top_k = TOOL_SELECTION_TOP_K if top_k is None else top_k
+    if top_k <= 0 or len(tools) <= top_k:
+        return tools
+    selected = ToolIndex(tools).select(query, top_k, set(always) | set(TOOL_SELECTION_ALWAYS))
+    if not selected:
+        return tools
+
+    full_tokens = estimate_tokens(describe_tools(tools))
+    tokens = estimate_tokens(describe_tools(selected))
+    logger.info("Tool catalog: %s of %s tools (%s), ~%s of ~%s tokens per prompt (%.0f%% smaller)",
+                len(selected), len(tools), ", ".join(tool.name for tool in selected),
+                tokens, full_tokens, 100 * (full_tokens - tokens) / full_tokens if full_tokens else 0)
+    return selected
@@ -0,0 +1,248 @@
+"""
+CPU-Bound Tool Workers
+
+FastMCP runs tool functions inside the server process, so one expensive call
+(factorial of a large number, a huge power, an exponential sum over a long list)
+blocks every other request on the session. This module lets a tool be marked as
+CPU-bound so that it runs in a pool of worker processes instead:
+
+    @mcp.tool()
+    @cpu_bound(timeout=10)
+    def factorial(a: int) -> int:
+        ...
+
+Cheap tools keep running inline. Every CPU-bound call gets a timeout; when it
+expires (or the client cancels the request) a call that is still waiting for a
+worker is simply dropped, and a call that is already running is stopped by
+terminating the one worker process that runs it. Calls running in the other
+workers are not affected, and a fresh worker takes the place of the killed one.
+Starting, terminating and joining worker processes can take a while, so it
+happens in threads, never on the server's event loop.
+
+Configuration (environment variables, e.g. in .env):
+    MCP_CPU_WORKERS       Number of worker processes (default: all CPU cores,
+                          0 runs CPU-bound tools inline like any other tool)
+    MCP_CPU_TOOL_TIMEOUT  Default per-call timeout in seconds (default: 30)
+"""
+
+import asyncio
+import functools
+import inspect
+import multiprocessing
+import os
+import sys
+from concurrent.futures.process import BrokenProcessPool
+
+# Worker pool settings from environment variables
+_workers_setting = os.getenv("MCP_CPU_WORKERS", "")
+CPU_WORKERS = int(_workers_setting) if _workers_setting else (os.cpu_count() or 1)
+CPU_TOOL_TIMEOUT = float(os.getenv("MCP_CPU_TOOL_TIMEOUT", "30"))
+
+# Registry of the original (undecorated) functions, keyed by name.
+# Worker processes look functions up here instead of pickling them, which works
+# for tools defined in a server script that runs as __main__: the spawned workers
+# rebuild the registry when they re-import the script.
+_CPU_FUNCTIONS = {}
+
+
+def _worker_init():
+    """Initialize a worker process
+
+    Tool functions print progress messages; in a worker those must not reach
+    stdout, which is the MCP protocol channel when the server uses stdio.
+    """
+    sys.stdout = sys.stderr
+
+
+def _worker_main(conn):
+    """Run calls sent over conn until the pool closes it (executed inside a worker process)
+
+    Each message is (name, args, kwargs) and is answered with (True, return
+    value) or (False, exception).
+    """
+    _worker_init()
+    while True:
+        try:
+            name, args, kwargs = conn.recv()
+        except EOFError:
+            return
+        try:
+            reply = (True, _CPU_FUNCTIONS[name](*args, **kwargs))
+        except Exception as e:
+            reply = (False, e)
+        try:
+            conn.send(reply)
+        except Exception as e:
+            # The result or exception cannot be pickled
+            conn.send((False, RuntimeError(f"{name}: cannot return the result: {type(e).__name__}: {e}")))
+
+
+class _Worker:
+    """One worker process and the pipe it receives calls on"""
+
+    def __init__(self, context):
+        self.conn, child_conn = context.Pipe()
+        self.process = context.Process(target=_worker_main, args=(child_conn,), daemon=True)
+        self.process.start()
+        child_conn.close()
+
+    def call(self, name, args, kwargs):
+        """Send a call and wait for its reply (blocking; run in a thread)"""
+        self.conn.send((name, args, kwargs))
+        return self.conn.recv()
+
+    def kill(self):
+        """Stop the process at once, whatever it is running
+
+        The pipe is left to be closed when it is garbage collected: a thread may
+        still be blocked receiving on it, and gets EOFError once the process is gone.
+        """
+        if self.process.is_alive():
+            self.process.terminate()
+        self.process.join(timeout=5)
+
+
+class CpuWorkerPool:
+    """A lazily started pool of worker processes that can stop a call which is already running
+
+    Each worker runs one call at a time, so a call that overruns is stopped by
+    terminating its own worker; the other workers keep running their calls.
+    """
+
+    def __init__(self, max_workers=None):
+        """Create the pool (worker processes are only started on first use)
+
+        Args:
+            max_workers (int): Number of worker processes (default: CPU_WORKERS)
+        """
+        self.max_workers = max_workers or CPU_WORKERS
+        # Always spawn (the only option on Windows anyway): a forked worker
+        # deadlocks closing the stdin it inherits while the stdio transport's
+        # reader thread is blocked on it
+        self._context = multiprocessing.get_context("spawn")
+        self._idle = []          # Started workers waiting for a call
+        self._workers = set()    # Every started worker
+        self._slots = None       # Semaphore of max_workers, for the running event loop
+        self._loop = None
+
+    def _get_slots(self):
+        loop = asyncio.get_running_loop()
+        if self._loop is not loop:
+            self._slots = asyncio.Semaphore(self.max_workers)
+            self._loop = loop
+        return self._slots
+
+    def _start_worker(self):
+        """Start a worker process (blocking; run in a thread)"""
+        worker = _Worker(self._context)
+        self._workers.add(worker)
+        return worker
+
+    async def _get_worker(self):
+        """An idle worker, or a new one started in a thread"""
+        if self._idle:
+            return self._idle.pop()
+        starting = asyncio.ensure_future(asyncio.to_thread(self._start_worker))
+        try:
+            return await asyncio.shield(starting)
+        except asyncio.CancelledError:
+            # The call was cancelled while the worker was starting: keep the worker for the next call
+            starting.add_done_callback(
+                lambda done: done.cancelled() or done.exception() or self._idle.append(done.result()))
+            raise
+
+    def _stop_worker(self, worker):
+        """Kill a worker in a thread, without waiting for it (terminate and join can block for seconds)"""
+        self._workers.discard(worker)
+        asyncio.get_running_loop().run_in_executor(None, worker.kill)
+
+    async def _call(self, name, args, kwargs):
+        """Run one call in an idle (or new) worker; the caller holds a slot"""
+        worker = await self._get_worker()
+        try:
+            ok, value = await asyncio.to_thread(worker.call, name, args, kwargs)
+        except BaseException as e:
+            # Timed out, cancelled by the client, or the worker died: only this
+            # worker is stopped, and the next call starts a new one in its place
+            self._stop_worker(worker)
+            if isinstance(e, (EOFError, OSError)):
+                raise BrokenProcessPool(f"The worker process running {name} died") from e
+            raise
+        self._idle.append(worker)
+        if not ok:
+            raise value
+        return value
+
+    async def run(self, name, args, kwargs, timeout):
+        """Run a registered function in a worker process
+
+        Args:
+            name (str): Registry name of the function (see cpu_bound)
+            args (tuple): Positional arguments (must be picklable)
+            kwargs (dict): Keyword arguments (must be picklable)
+            timeout (float): Seconds to wait (including for a free worker) before cancelling the call
+
+        Returns:
+            The function's return value
+
+        Raises:
+            TimeoutError: If the call did not finish within the timeout
+            BrokenProcessPool: If the worker process died while running the call
+        """
+        slots = self._get_slots()
+
+        async def acquire_and_call():
+            async with slots:
+                return await self._call(name, args, kwargs)
+
+        try:
+            return await asyncio.wait_for(acquire_and_call(), timeout)
+        except asyncio.TimeoutError:
+            raise TimeoutError(f"{name} did not finish within {timeout} seconds and was cancelled") from None
+
+    def shutdown(self):
+        """Stop all worker processes"""
+        for worker in list(self._workers):
+            worker.kill()
+        self._workers.clear()
+        self._idle.clear()
+
+
+# Shared pool used by the cpu_bound decorator
+default_pool = CpuWorkerPool()
+
+
+def cpu_bound(timeout=None):
+    """Mark a tool function as CPU-bound so it runs in the worker process pool
+
+    Apply it below @mcp.tool() so FastMCP registers the async wrapper; the
+    wrapper keeps the original signature and docstring for the tool schema.
+
+    Args:
+        timeout (float): Per-call timeout in seconds (default: CPU_TOOL_TIMEOUT)
+
+    Returns:
+        A decorator that turns the function into an async, pool-dispatched tool
+    """
+    def decorator(func):
+        name = func.__name__
+        _CPU_FUNCTIONS[name] = func
+
+        @functools.wraps(func)
+        async def wrapper(*args, **kwargs):
+            if CPU_WORKERS <= 0:
+                return func(*args, **kwargs)
+            return await default_pool.run(name, args, kwargs, timeout or CPU_TOOL_TIMEOUT)
+
+        wrapper.cpu_bound = True
+        return wrapper
+    return decorator
+
+
+def inline_function(func):
+    """Return the plain synchronous function behind a cpu_bound (or otherwise wrapped) tool
+
+    Useful when one tool calls another directly (for example inside evaluate),
+    where dispatching to the pool again is neither needed nor possible.
+    """
+    return inspect.unwrap(func)
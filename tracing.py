@@ -0,0 +1,174 @@
+"""
+Agent Loop Tracing
+
+Records a timed span for every phase of every agent iteration - prompt build,
+LLM call, response parse, argument coercion, the call_tool round-trip, result
+decoding and the post-tool sleep - so a slow run can be attributed to Gemini,
+the stdio transport or the fixed Paint/email sleeps.
+
+Spans are kept in memory for the end-of-run summary table (logged at INFO),
+appended to a JSON lines file, and optionally exported to an OpenTelemetry collector (this needs
+the optional opentelemetry-sdk and opentelemetry-exporter-otlp-proto-http
+packages).
+
+Several runs (and processes, see main.py and job_queue.py) append to the same
+file, so each span is written unbuffered as one complete line in a single
+write to a file opened for appending; lines of concurrent runs never split or
+interleave.
+
+Configuration (environment variables, e.g. in .env):
+    AGENT_TRACE_FILE        JSON lines file for spans (default: agent_trace.jsonl, empty disables)
+    AGENT_TRACE_OTLP_ENDPOINT  OTLP/HTTP collector, e.g. http://localhost:4318 (default: off)
+"""
+
+import json
+import logging
+import math
+import os
+import time
+import uuid
+from contextlib import contextmanager
+
+logger = logging.getLogger(__name__)
+
+AGENT_TRACE_FILE = os.getenv("AGENT_TRACE_FILE", "agent_trace.jsonl")
+AGENT_TRACE_OTLP_ENDPOINT = os.getenv("AGENT_TRACE_OTLP_ENDPOINT", "")
+
+
+def _otel_tracer(endpoint):
+    """Create an OpenTelemetry tracer exporting to an OTLP/HTTP collector, or None if unavailable"""
+    try:
+        from opentelemetry.exporter.otlp.proto.http.trace_exporter import OTLPSpanExporter
+        from opentelemetry.sdk.resources import Resource
+        from opentelemetry.sdk.trace import TracerProvider
+        from opentelemetry.sdk.trace.export import BatchSpanProcessor
+    except ImportError:
+        logger.warning("AGENT_TRACE_OTLP_ENDPOINT is set but the opentelemetry packages are not installed")
+        return None, None
+    provider = TracerProvider(resource=Resource.create({"service.name": "talk2mcp-agent"}))
+    provider.add_span_processor(BatchSpanProcessor(OTLPSpanExporter(endpoint=f"{endpoint.rstrip('/')}/v1/traces")))
+    return provider, provider.get_tracer("talk2mcp.agent_loop")
+
+
+def percentile(values, fraction):
+    """Return the given percentile (0-1) of a list of numbers using nearest rank"""
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    index = min(len(ordered) - 1, max(0, math.ceil(fraction * len(ordered)) - 1))
+    return ordered[index]
+
+
+class Tracer:
+    """Collects timed spans for one agent run"""
+
+    def __init__(self, jsonl_path=AGENT_TRACE_FILE, otlp_endpoint=AGENT_TRACE_OTLP_ENDPOINT, run_id=None):
+        """Create a tracer
+
+        Args:
+            jsonl_path (str): File the spans are appended to, or None/'' to disable
+            otlp_endpoint (str): OTLP/HTTP collector URL, or None/'' to disable
+            run_id (str): Identifier written with every span (default: random)
+        """
+        self.run_id = run_id or uuid.uuid4().hex[:12]
+        self.spans = []
+        # Unbuffered: every span is one write() of a whole line (O_APPEND keeps concurrent writers apart)
+        self._file = open(jsonl_path, 'ab', buffering=0) if jsonl_path else None
+        self._otel_provider, self._otel = _otel_tracer(otlp_endpoint) if otlp_endpoint else (None, None)
+        self._origin = time.perf_counter()
+        self._started_at = time.time()
+
+    @contextmanager
+    def span(self, name, iteration=None, **attributes):
+        """Time a block of code as a span
+
+        Args:
+            name (str): Span name, e.g. "llm_call"
+            iteration (int): Agent iteration the span belongs to (1-based)
+            **attributes: Extra values recorded with the span (may be added to inside the block)
+        """
+        otel_context = self._otel.start_as_current_span(name) if self._otel else None
+        otel_span = otel_context.__enter__() if otel_context else None
+        start = time.perf_counter()
+        error = None
+        try:
+            yield attributes
+        except BaseException as e:
+            error = f"{type(e).__name__}: {e}"
+            raise
+        finally:
+            duration = time.perf_counter() - start
+            record = {
+                "run_id": self.run_id,
+                "span": name,
+                "iteration": iteration,
+                "start_ms": round((start - self._origin) * 1000, 3),
+                "duration_ms": round(duration * 1000, 3),
+                "timestamp": self._started_at + (start - self._origin),
+            }
+            if attributes:
+                record["attributes"] = attributes
+            if error:
+                record["error"] = error
+            self.spans.append(record)
+            if self._file:
+                self._file.write((json.dumps(record, default=str) + "\n").encode('utf-8'))
+            if otel_span is not None:
+                if iteration is not None:
+                    otel_span.set_attribute("agent.iteration", iteration)
+                otel_span.set_attribute("agent.run_id", self.run_id)
+                for key, value in attributes.items():
+                    if isinstance(value, (str, bool, int, float)):
+                        otel_span.set_attribute(f"agent.{key}", value)
+                if error:
+                    otel_span.set_attribute("error", error)
+                otel_context.__exit__(None, None, None)
+
+    def summary(self):
+        """Aggregate spans by name
+
+        Returns:
+            list: One dict per span name with count, total, mean, p50, p95 and max in milliseconds
+        """
+        by_name = {}
+        for record in self.spans:
+            by_name.setdefault(record["span"], []).append(record["duration_ms"])
+        rows = []
+        for name, durations in by_name.items():
+            rows.append({
+                "span": name,
+                "count": len(durations),
+                "total_ms": round(sum(durations), 1),
+                "mean_ms": round(sum(durations) / len(durations), 1),
+                "p50_ms": round(percentile(durations, 0.50), 1),
+                "p95_ms": round(percentile(durations, 0.95), 1),
+                "max_ms": round(max(durations), 1),
+            })
+        return rows
+
+    def print_summary(self):
+        """Log a latency breakdown table for the run (INFO, through the logging setup)"""
+        rows = [row for row in self.summary() if row["span"] not in ("run", "iteration")]
+        run_total = sum(r["duration_ms"] for r in self.spans if r["span"] == "run")
+        total = run_total or sum(row["total_ms"] for row in rows) or 1
+        lines = [
+            "=" * 78,
+            f"Latency breakdown for run {self.run_id} (total {total / 1000:.2f}s)",
+            "=" * 78,
+            f"{'span':<20}{'count':>6}{'total ms':>11}{'mean ms':>10}{'p50 ms':>10}{'p95 ms':>10}{'share':>8}",
+        ]
+        for row in sorted(rows, key=lambda r: r["total_ms"], reverse=True):
+            share = 100 * row["total_ms"] / total
+            lines.append(f"{row['span']:<20}{row['count']:>6}{row['total_ms']:>11.1f}{row['mean_ms']:>10.1f}"
+                         f"{row['p50_ms']:>10.1f}{row['p95_ms']:>10.1f}{share:>7.1f}%")
+        lines.append("=" * 78)
+        logger.info("\n%s", "\n".join(lines))
+
+    def close(self):
+        """Close the trace file and flush the OpenTelemetry exporter"""
+        if self._file:
+            self._file.close()
+            self._file = None
+        if self._otel_provider is not None:
+            self._otel_provider.shutdown()
+            self._otel_provider = None